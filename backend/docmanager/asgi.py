@@ -2,6 +2,8 @@
 ASGI config for docmanager project.
 
 It exposes the ASGI callable as a module-level variable named ``application``.
+HTTP requests go to Django; WebSocket connections (live annotation updates)
+are routed by Channels.
 
 For more information on this file, see
 https://docs.djangoproject.com/en/5.1/howto/deployment/asgi/
@@ -12,5 +14,21 @@ import os
 from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'docmanager.settings')
+# Serve the read-heavy endpoints with async views (see documents/async_views.py)
+os.environ.setdefault('DOCUMENT_ASYNC_VIEWS', '1')
 
-application = get_asgi_application()
+# Set up Django before importing anything that uses models
+django_asgi_app = get_asgi_application()
+
+from channels.routing import ProtocolTypeRouter, URLRouter
+from channels.security.websocket import AllowedHostsOriginValidator
+
+from documents.consumers import TokenAuthMiddlewareStack
+from documents.routing import websocket_urlpatterns
+
+application = ProtocolTypeRouter({
+    'http': django_asgi_app,
+    'websocket': AllowedHostsOriginValidator(
+        TokenAuthMiddlewareStack(URLRouter(websocket_urlpatterns))
+    ),
+})
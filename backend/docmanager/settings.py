@@ -32,6 +32,7 @@ ALLOWED_HOSTS = ['localhost', '127.0.0.1']
 # Application definition
 
 INSTALLED_APPS = [
+    'daphne',
     'django.contrib.admin',
     'django.contrib.auth',
     'django.contrib.contenttypes',
@@ -45,6 +46,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'documents.middleware.RequestMetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'corsheaders.middleware.CorsMiddleware',
@@ -125,6 +127,16 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
+        'OPTIONS': {
+            # Take the write lock up front so concurrent writers wait for
+            # each other instead of failing with "database is locked"
+            'transaction_mode': 'IMMEDIATE',
+        },
+        'TEST': {
+            # A file rather than the default shared in-memory database, whose
+            # table locks fail immediately under the concurrency tests
+            'NAME': BASE_DIR / 'test_db.sqlite3',
+        },
     }
 }
 
@@ -177,7 +189,7 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 # REST Framework settings
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': [
-        'rest_framework.authentication.TokenAuthentication',
+        'documents.authentication.CachedTokenAuthentication',
         'rest_framework.authentication.SessionAuthentication',
         'rest_framework.authentication.BasicAuthentication',
     ],
@@ -187,3 +199,181 @@ REST_FRAMEWORK = {
     'DEFAULT_PAGINATION_CLASS': 'rest_framework.pagination.PageNumberPagination',
     'PAGE_SIZE': 10
 }
+
+# Upper bound for the client-selected ?page_size= on cursor-paginated lists
+DOCUMENT_MAX_PAGE_SIZE = 100
+
+# Background jobs
+# Text extraction runs outside the upload request; start a worker with
+# `python manage.py process_jobs`. Use 'documents.jobs.ImmediateJobQueue' to
+# run jobs inline instead (handy for tests and local development).
+DOCUMENT_JOB_QUEUE = 'documents.jobs.DatabaseJobQueue'
+DOCUMENT_JOB_MAX_ATTEMPTS = 5
+DOCUMENT_JOB_RETRY_BACKOFF = 30  # seconds, doubled after every failed attempt
+DOCUMENT_JOB_RETRY_BACKOFF_MAX = 3600
+DOCUMENT_JOB_LOCK_TIMEOUT = 600  # seconds before a running job is considered abandoned
+
+# PDF text extraction
+# With more than one worker, page ranges of large PDFs are extracted in
+# parallel by a process pool inside the job worker.
+DOCUMENT_EXTRACTION_WORKERS = 1
+DOCUMENT_EXTRACTION_PAGES_PER_TASK = 25
+# Extracted pages are written to the database (and the search index) in
+# batches of this many, so a job holds at most a batch of page text in memory
+DOCUMENT_EXTRACTION_BATCH_PAGES = 200
+# Text, HTML and Word files have no fixed pages; they are split into pages of
+# at most this many characters
+DOCUMENT_EXTRACTION_PAGE_CHARS = 3000
+# Extracted pages are cached by file SHA-256 and extractor version, so a file
+# uploaded again (to any document) isn't parsed again. Entries of files that
+# no version references any more are pruned by `manage.py extraction_cache
+# --prune` after this long unused.
+DOCUMENT_EXTRACTION_CACHE = True
+DOCUMENT_EXTRACTION_CACHE_MAX_AGE = 30 * 24 * 60 * 60  # seconds
+
+# OCR of PDF pages without a text layer
+# Needs the Tesseract binary (e.g. `apt install tesseract-ocr`); set the
+# command to None to turn OCR off. Pages are rendered at DOCUMENT_OCR_DPI and
+# recognized in a pool of DOCUMENT_OCR_WORKERS processes.
+DOCUMENT_OCR_COMMAND = 'tesseract'
+DOCUMENT_OCR_LANGUAGES = 'eng'  # Tesseract -l argument, e.g. 'eng+deu'
+DOCUMENT_OCR_WORKERS = 2
+DOCUMENT_OCR_DPI = 300
+DOCUMENT_OCR_TIMEOUT = 120  # seconds per page
+
+# In-document search
+DOCUMENT_SEARCH_CACHE_SIZE = 256  # cached (document, version, query) results per process
+DOCUMENT_SEARCH_MAX_MATCHES = 5000  # matches kept per search; pages beyond that are not scanned
+
+# Version downloads (/api/documents/<id>/versions/<pk>/content/)
+# Set to 'x-accel-redirect' (nginx) or 'x-sendfile' (Apache/lighttpd) to let
+# the web server send file bytes after Django has checked permissions. For
+# nginx, map DOCUMENT_DOWNLOAD_ACCEL_PREFIX to MEDIA_ROOT in an `internal`
+# location.
+DOCUMENT_DOWNLOAD_OFFLOAD = None
+DOCUMENT_DOWNLOAD_ACCEL_PREFIX = '/protected-media/'
+
+# Resumable chunked uploads (/api/uploads/)
+# Part files live outside MEDIA_ROOT so unfinished uploads are never served;
+# keep the directory on the same filesystem as MEDIA_ROOT so completed
+# uploads are moved into place rather than copied. Sessions idle for longer
+# than the TTL are removed by `python manage.py expire_uploads`.
+DOCUMENT_UPLOAD_SESSION_DIR = os.path.join(BASE_DIR, 'upload_sessions')
+DOCUMENT_UPLOAD_SESSION_TTL = 24 * 60 * 60  # seconds
+DOCUMENT_UPLOAD_MAX_SIZE = 4 * 1024 ** 3  # bytes
+
+# Page thumbnails (/api/documents/<id>/versions/<pk>/pages/<n>/thumb/)
+# The first pages of every new version are rendered by the job worker; other
+# pages are rendered on first request. Images live in a disk cache that
+# evicts the least recently used files beyond the size limit.
+DOCUMENT_THUMBNAIL_CACHE_DIR = os.path.join(BASE_DIR, 'thumbnail_cache')
+DOCUMENT_THUMBNAIL_CACHE_MAX_BYTES = 512 * 1024 ** 2
+DOCUMENT_THUMBNAIL_WIDTH = 200  # pixels
+DOCUMENT_PREVIEW_WIDTH = 1024  # pixels, for ?size=preview
+DOCUMENT_THUMBNAIL_PRERENDER_PAGES = 10
+
+# Delta storage of versions
+# With DOCUMENT_VERSION_DELTAS on, a job re-stores the file of a version that
+# a newer one superseded as a binary delta against the previous version's, if
+# the delta is at most DOCUMENT_DELTA_MAX_RATIO of the file. Every
+# DOCUMENT_DELTA_SNAPSHOT_INTERVAL-th file of a chain is kept whole, so at most
+# that many deltas are applied to rebuild one. Rebuilt files are kept in a
+# size-bounded disk cache, so repeated downloads don't rebuild them again.
+DOCUMENT_VERSION_DELTAS = False
+DOCUMENT_DELTA_SNAPSHOT_INTERVAL = 10
+DOCUMENT_DELTA_MAX_RATIO = 0.5
+DOCUMENT_DELTA_CACHE_DIR = os.path.join(BASE_DIR, 'delta_cache')
+DOCUMENT_DELTA_CACHE_MAX_BYTES = 1024 ** 3
+
+# Batch annotation edits (/api/documents/<id>/annotations/batch/)
+DOCUMENT_ANNOTATION_BATCH_MAX = 1000  # operations per request
+
+# Live annotation updates (ws/documents/<id>/annotations/)
+# The in-memory channel layer only reaches clients connected to the same
+# process. With several ASGI workers or servers, switch to a shared backend,
+# e.g. channels_redis:
+#   {'BACKEND': 'channels_redis.core.RedisChannelLayer',
+#    'CONFIG': {'hosts': [('127.0.0.1', 6379)]}}
+# Events older than the retention are removed by
+# `python manage.py prune_annotation_events`; clients that fall further
+# behind reload the annotations instead of replaying.
+ASGI_APPLICATION = 'docmanager.asgi.application'
+CHANNEL_LAYERS = {
+    'default': {
+        'BACKEND': 'channels.layers.InMemoryChannelLayer',
+    },
+}
+DOCUMENT_ANNOTATION_EVENT_RETENTION = 7 * 24 * 60 * 60  # seconds
+DOCUMENT_ANNOTATION_REPLAY_MAX = 1000  # events sent to a reconnecting client
+
+# Async read endpoints
+# Under an ASGI server, GET requests for the document list and detail,
+# version lists and in-document search are served by the async views in
+# documents/async_views.py. docmanager/asgi.py turns this on; WSGI servers
+# keep the sync views.
+DOCUMENT_ASYNC_VIEWS = os.environ.get('DOCUMENT_ASYNC_VIEWS', '') == '1'
+
+# Response caching
+# GET responses for documents, versions and annotations are cached per user
+# and per document generation, and carry an ETag for conditional requests.
+# The local-memory cache is per process; with several workers, point the
+# 'responses' cache at a shared backend, e.g.
+#   {'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+#    'LOCATION': 'redis://127.0.0.1:6379'}
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'responses': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'document-responses',
+        'OPTIONS': {'MAX_ENTRIES': 5000},
+    },
+}
+DOCUMENT_RESPONSE_CACHE = 'responses'
+DOCUMENT_RESPONSE_CACHE_TIMEOUT = 600
+
+# Token authentication
+# Token lookups are cached per process. Logout, token rotation and user
+# changes clear the cache of the process that handles them; other processes
+# keep accepting a deleted token for at most DOCUMENT_TOKEN_CACHE_TTL seconds
+# (0 disables the cache).
+DOCUMENT_TOKEN_CACHE_TTL = 60
+DOCUMENT_TOKEN_CACHE_SIZE = 10000
+# Set DOCUMENT_TOKEN_AUTH_ONLY=1 to accept API tokens only. Session and Basic
+# authentication are skipped (Basic hashes the password on every request), and
+# logging in to the browsable API stops working.
+if os.environ.get('DOCUMENT_TOKEN_AUTH_ONLY', '') == '1':
+    REST_FRAMEWORK['DEFAULT_AUTHENTICATION_CLASSES'] = ['documents.authentication.CachedTokenAuthentication']
+
+# Metrics and logging
+# Prometheus metrics for this process are served at /metrics; set
+# DOCUMENT_METRICS_TOKEN to require "Authorization: Bearer <token>" there.
+# Every request is logged as a JSON line on the documents.requests logger
+# when DOCUMENT_REQUEST_LOG_LEVEL is INFO.
+DOCUMENT_METRICS_TOKEN = os.environ.get('DOCUMENT_METRICS_TOKEN', '')
+# Slow-request sampler, off unless a threshold is set. Sampled requests keep
+# their query log ('queries') or run under cProfile ('cprofile', which slows
+# them down, so sample a small share); those over the threshold are logged on
+# documents.slow_requests, and cProfile dumps are written to
+# DOCUMENT_SLOW_REQUEST_DIR if set.
+DOCUMENT_SLOW_REQUEST_SECONDS = None
+DOCUMENT_SLOW_REQUEST_PROFILER = 'queries'
+DOCUMENT_SLOW_REQUEST_SAMPLE_RATE = 1.0
+DOCUMENT_SLOW_REQUEST_DIR = None
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'formatters': {
+        'json': {'()': 'documents.metrics.JsonFormatter'},
+    },
+    'handlers': {
+        'console': {'class': 'logging.StreamHandler', 'formatter': 'json'},
+    },
+    'loggers': {
+        'documents': {'handlers': ['console'], 'level': 'INFO'},
+        'documents.requests': {'level': os.environ.get('DOCUMENT_REQUEST_LOG_LEVEL', 'WARNING')},
+        # One line per extracted version with pages, characters and time per method
+        'documents.extraction': {'level': os.environ.get('DOCUMENT_EXTRACTION_LOG_LEVEL', 'WARNING')},
+    },
+}
@@ -20,10 +20,16 @@ from django.conf import settings
 from django.conf.urls.static import static
 from rest_framework.authtoken import views
 
+from documents.views import BlobFileView, metrics_endpoint
+
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('api/', include('documents.urls')),
     path('api-auth/', include('rest_framework.urls')),
+    path('metrics', metrics_endpoint, name='metrics'),
+    # Version files stored as deltas, for their owners; the web server should
+    # fall back to this for files it can't find under MEDIA_URL/blobs/
+    path(f'{settings.MEDIA_URL.strip("/")}/blobs/<path:path>', BlobFileView.as_view(), name='blob-file'),
 ]
 
 # Serve media files in development
@@ -1,11 +1,11 @@
 from django.contrib import admin
-from .models import Document, DocumentVersion, Annotation
+from .models import Document, DocumentVersion, DocumentPage, Annotation, AnnotationEvent, Job, UploadSession
 
 @admin.register(Document)
 class DocumentAdmin(admin.ModelAdmin):
-    list_display = ('name', 'file_type', 'owner', 'created_at', 'is_ocr_processed')
-    list_filter = ('file_type', 'is_ocr_processed', 'created_at')
-    search_fields = ('name', 'owner__username', 'text_content')
+    list_display = ('name', 'file_type', 'owner', 'created_at', 'extraction_status')
+    list_filter = ('file_type', 'extraction_status', 'created_at')
+    search_fields = ('name', 'owner__username')
     readonly_fields = ('created_at', 'updated_at')
     date_hierarchy = 'created_at'
     
@@ -14,7 +14,7 @@ class DocumentAdmin(admin.ModelAdmin):
             'fields': ('name', 'file', 'file_type', 'owner')
         }),
         ('Content Information', {
-            'fields': ('is_ocr_processed', 'text_content'),
+            'fields': ('extraction_status',),
             'classes': ('collapse',),
         }),
         ('Metadata', {
@@ -42,6 +42,12 @@ class DocumentVersionAdmin(admin.ModelAdmin):
     
     readonly_fields = ('created_at',)
 
+@admin.register(DocumentPage)
+class DocumentPageAdmin(admin.ModelAdmin):
+    list_display = ('document', 'version', 'page_number')
+    search_fields = ('document__name',)
+    raw_id_fields = ('document', 'version')
+
 @admin.register(Annotation)
 class AnnotationAdmin(admin.ModelAdmin):
     list_display = ('type', 'document', 'user', 'page', 'created_at')
@@ -63,3 +69,23 @@ class AnnotationAdmin(admin.ModelAdmin):
     )
     
     readonly_fields = ('created_at',)
+
+@admin.register(AnnotationEvent)
+class AnnotationEventAdmin(admin.ModelAdmin):
+    list_display = ('document', 'seq', 'op', 'annotation_id', 'created_at')
+    list_filter = ('op',)
+    raw_id_fields = ('document',)
+    readonly_fields = ('created_at',)
+
+@admin.register(Job)
+class JobAdmin(admin.ModelAdmin):
+    list_display = ('task', 'status', 'attempts', 'run_after', 'created_at')
+    list_filter = ('task', 'status')
+    readonly_fields = ('created_at', 'updated_at', 'last_error')
+
+@admin.register(UploadSession)
+class UploadSessionAdmin(admin.ModelAdmin):
+    list_display = ('filename', 'owner', 'status', 'received', 'size', 'updated_at')
+    list_filter = ('status',)
+    raw_id_fields = ('owner', 'document', 'version')
+    readonly_fields = ('created_at', 'updated_at')
@@ -4,3 +4,8 @@ from django.apps import AppConfig
 class DocumentsConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'documents'
+
+    def ready(self):
+        # Register background tasks with the job queue, model signal handlers
+        # and the query recorder for metrics
+        from . import metrics, signals, tasks  # noqa: F401
@@ -0,0 +1,198 @@
+"""Async variants of the read-heavy endpoints, for ASGI deployments.
+
+Under an ASGI server every DRF view runs through ``sync_to_async``, so a
+request holds a worker thread from authentication to rendering. These views
+await the async ORM instead and only leave the event loop for the queries
+themselves. They reuse the DRF viewsets' querysets, filters, pagination and
+serializers, so the responses are the same; every queryset loads its related
+rows up front, so serializing never queries the database.
+
+``documents/urls.py`` routes GET requests for these endpoints here when
+``DOCUMENT_ASYNC_VIEWS`` is on (the ASGI entry point turns it on). Other
+methods still go to the DRF viewsets. Responses are cached and revalidated
+the same way as the DRF views' (see ``caching``).
+"""
+import time
+from functools import wraps
+
+from asgiref.sync import sync_to_async
+from django.http import HttpResponse
+from django.views.decorators.csrf import csrf_exempt
+from rest_framework.authentication import TokenAuthentication
+from rest_framework.exceptions import AuthenticationFailed, NotAuthenticated, NotFound
+from rest_framework.renderers import JSONRenderer
+from rest_framework.request import Request
+from rest_framework.settings import api_settings
+from rest_framework.views import exception_handler
+
+from . import metrics
+from .authentication import alookup_token
+from .caching import acache_response, adocument_state, alibrary_state
+from .models import Document, DocumentVersion
+from .search_engine import ALL_VERSIONS, asearch_document
+from .serializers import DocumentVersionSerializer
+from .views import DocumentViewSet, DocumentVersionViewSet, search_options, search_page, search_unavailable
+
+
+def json_response(data, status=200, headers=None):
+    start = time.perf_counter()
+    body = JSONRenderer().render(data)
+    metrics.add_render_time(time.perf_counter() - start)
+    response = HttpResponse(body, status=status, content_type='application/json', headers=headers)
+    # Kept for the response cache, as on a DRF Response
+    response.data = data
+    return response
+
+
+async def authenticate(request):
+    """Return the requesting user like the DRF authentication classes would.
+
+    API tokens are looked up in the token cache or with the async ORM;
+    sessions and basic auth go through DRF in a thread.
+    """
+    header = request.headers.get('Authorization', '').split()
+    if len(header) == 2 and header[0] == TokenAuthentication.keyword:
+        user, _ = await alookup_token(header[1])
+        return user
+
+    drf_request = Request(request, authenticators=[
+        authenticator() for authenticator in api_settings.DEFAULT_AUTHENTICATION_CLASSES
+    ])
+    return await sync_to_async(lambda: drf_request.user)()
+
+
+def async_api_view(func):
+    """Authenticate the request and render DRF errors for an async view"""
+    @wraps(func)
+    async def view(request, *args, **kwargs):
+        try:
+            user = await authenticate(request)
+            if not user or not user.is_authenticated:
+                raise NotAuthenticated()
+            drf_request = Request(request)
+            drf_request.user = user
+            return await func(drf_request, *args, **kwargs)
+        except Exception as exc:
+            if isinstance(exc, (NotAuthenticated, AuthenticationFailed)):
+                exc.auth_header = TokenAuthentication.keyword
+            response = exception_handler(exc, {})
+            if response is None:
+                raise
+            headers = {name: response[name] for name in ('WWW-Authenticate', 'Retry-After') if name in response}
+            return json_response(response.data, response.status_code, headers)
+    return view
+
+
+def read_async(async_view, sync_view):
+    """Serve GET and HEAD with ``async_view`` and other methods with the DRF view"""
+    sync_view = sync_to_async(sync_view)
+
+    @csrf_exempt
+    async def view(request, *args, **kwargs):
+        if request.method in ('GET', 'HEAD'):
+            return await async_view(request, *args, **kwargs)
+        return await sync_view(request, *args, **kwargs)
+    return view
+
+
+def viewset(viewset_class, request, action, **kwargs):
+    """Set up a DRF viewset for ``request`` without dispatching to it"""
+    return viewset_class(request=request, action=action, args=(), kwargs=kwargs, format_kwarg=None)
+
+
+async def paginate(view, queryset):
+    # DRF's cursor pagination has no async API; the page is fetched in a
+    # thread, as the async ORM does for every query
+    return await sync_to_async(view.paginate_queryset)(queryset)
+
+
+async def get_document(view, pk):
+    document = await view.get_queryset().filter(pk=pk).afirst()
+    if document is None:
+        raise NotFound()
+    return document
+
+
+async def library_state(request, **kwargs):
+    return await alibrary_state(request.user)
+
+
+async def document_state(request, pk=None, document_id=None):
+    return await adocument_state(document_id or pk)
+
+
+def cached(state):
+    return acache_response(state, json_response)
+
+
+@async_api_view
+@cached(library_state)
+async def document_list(request):
+    view = viewset(DocumentViewSet, request, 'list')
+    page = await paginate(view, view.filter_queryset(view.get_queryset()))
+    serializer = view.get_serializer(page, many=True)
+    return json_response(view.paginator.get_paginated_response(serializer.data).data)
+
+
+@async_api_view
+@cached(document_state)
+async def document_detail(request, pk):
+    view = viewset(DocumentViewSet, request, 'retrieve', pk=pk)
+    document = await get_document(view, pk)
+    return json_response(view.get_serializer(document).data)
+
+
+@async_api_view
+@cached(document_state)
+async def document_version_list(request, pk):
+    """``version-list``: every version of a document, unpaginated"""
+    if not await Document.objects.filter(pk=pk, owner=request.user).aexists():
+        raise NotFound()
+    versions = [
+        version async for version in
+        DocumentVersion.objects.filter(document_id=pk).select_related('created_by')
+    ]
+    return json_response(DocumentVersionSerializer(versions, many=True).data)
+
+
+@async_api_view
+@cached(document_state)
+async def version_list(request, document_id):
+    view = viewset(DocumentVersionViewSet, request, 'list', document_id=document_id)
+    page = await paginate(view, view.filter_queryset(view.get_queryset()))
+    serializer = view.get_serializer(page, many=True)
+    return json_response(view.paginator.get_paginated_response(serializer.data).data)
+
+
+@async_api_view
+@cached(document_state)
+async def document_search(request, pk):
+    view = viewset(DocumentViewSet, request, 'search', pk=pk)
+    document = await get_document(view, pk)
+    query = request.query_params.get('query', '')
+    if not query:
+        return json_response({"matches": []})
+
+    try:
+        flags, offset, limit = search_options(request.query_params)
+    except ValueError:
+        return json_response({"error": "limit, offset and version must be numbers"}, status=400)
+
+    extraction_status = document.extraction_status
+    versions = DocumentVersion.objects.filter(document_id=document.pk)
+    if flags['version'] == ALL_VERSIONS:
+        # Whatever has been extracted so far is searchable
+        if await versions.filter(extraction_status='completed').aexists():
+            extraction_status = 'completed'
+    elif flags['version'] is not None:
+        extraction_status = await versions.filter(version_number=flags['version']).values_list(
+            'extraction_status', flat=True
+        ).afirst()
+        if extraction_status is None:
+            raise NotFound()
+    unavailable = search_unavailable(document, extraction_status)
+    if unavailable:
+        return json_response(unavailable)
+
+    matches = await asearch_document(document, query, **flags)
+    return json_response(search_page(matches, offset, limit))
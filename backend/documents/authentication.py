@@ -0,0 +1,91 @@
+"""API token authentication with a per-process cache of token lookups.
+
+DRF's ``TokenAuthentication`` joins ``Token`` and ``User`` on every request.
+Here a successful lookup is remembered for ``DOCUMENT_TOKEN_CACHE_TTL``
+seconds. Deleting a token (logout, rotation) or saving its user (password
+change, deactivation) drops the cached entries in the process that made the
+change; other processes notice within the TTL.
+"""
+import copy
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.utils.translation import gettext_lazy as _
+from rest_framework.authentication import TokenAuthentication
+from rest_framework.authtoken.models import Token
+from rest_framework.exceptions import AuthenticationFailed
+
+
+class TokenCache:
+    """Thread-safe LRU mapping of token keys to ``(user, token)``, with expiry"""
+
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires, user, token = entry
+            if expires <= time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+        # Each request gets its own copy, so nothing set on one leaks into another
+        return copy.copy(user), token
+
+    def set(self, key, user, token):
+        ttl = getattr(settings, 'DOCUMENT_TOKEN_CACHE_TTL', 60)
+        if ttl <= 0:
+            return
+        with self._lock:
+            self._entries[key] = (time.monotonic() + ttl, copy.copy(user), token)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def discard(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def discard_user(self, user_id):
+        with self._lock:
+            for key in [key for key, entry in self._entries.items() if entry[1].pk == user_id]:
+                del self._entries[key]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+token_cache = TokenCache(getattr(settings, 'DOCUMENT_TOKEN_CACHE_SIZE', 10000))
+
+
+def _check(token, key):
+    if token is None:
+        raise AuthenticationFailed(_('Invalid token.'))
+    if not token.user.is_active:
+        raise AuthenticationFailed(_('User inactive or deleted.'))
+    token_cache.set(key, token.user, token)
+    return token.user, token
+
+
+def lookup_token(key):
+    """Return ``(user, token)`` for an API token key, or raise ``AuthenticationFailed``"""
+    return token_cache.get(key) or _check(Token.objects.select_related('user').filter(key=key).first(), key)
+
+
+async def alookup_token(key):
+    return token_cache.get(key) or _check(await Token.objects.select_related('user').filter(key=key).afirst(), key)
+
+
+class CachedTokenAuthentication(TokenAuthentication):
+    """``TokenAuthentication`` that skips the database for recently seen tokens"""
+
+    def authenticate_credentials(self, key):
+        return lookup_token(key)
@@ -0,0 +1,114 @@
+"""Content-addressed, reference-counted storage for uploaded files.
+
+Files are stored once under ``blobs/<aa>/<bb>/<sha256><ext>`` no matter how
+many documents or versions point at them. ``store`` returns the blob with one
+reference taken; every row whose ``file`` names the blob holds one reference,
+and ``release`` frees the file once the last of them is gone.
+"""
+import hashlib
+import os
+
+from django.core.files import File
+from django.core.files.storage import default_storage
+from django.db import IntegrityError, transaction
+from django.db.models import F
+
+from .models import Blob
+
+
+class LocalFile(File):
+    """A file on local disk that file storage may move into place instead of copying"""
+
+    def temporary_file_path(self):
+        return self.file.name
+
+
+def hash_file(file):
+    """Return ``(sha256 hexdigest, size)`` of a Django ``File``, reading it in chunks"""
+    digest = hashlib.sha256()
+    size = 0
+    if hasattr(file, 'seek'):
+        file.seek(0)
+    for chunk in file.chunks():
+        digest.update(chunk)
+        size += len(chunk)
+    if hasattr(file, 'seek'):
+        file.seek(0)
+    return digest.hexdigest(), size
+
+
+def blob_name(sha256, original_name=''):
+    # Keep the extension so downloads get a sensible content type
+    ext = os.path.splitext(original_name)[1].lower()[:10]
+    return f'blobs/{sha256[:2]}/{sha256[2:4]}/{sha256}{ext}'
+
+
+def acquire(blob):
+    """Take another reference on an existing blob"""
+    Blob.objects.filter(pk=blob.pk).update(ref_count=F('ref_count') + 1)
+    blob.ref_count += 1
+    return blob
+
+
+def store(file, sha256=None, size=None):
+    """Store ``file`` (unless identical bytes are already stored) and return its blob.
+
+    The returned blob carries one new reference for the caller. Re-uploading
+    existing content only bumps the reference count; no bytes are copied.
+    """
+    if sha256 is None:
+        sha256, size = hash_file(file)
+
+    # Fast path: the content is already stored
+    if Blob.objects.filter(sha256=sha256).update(ref_count=F('ref_count') + 1):
+        return Blob.objects.get(sha256=sha256)
+
+    name = blob_name(sha256, getattr(file, 'name', '') or '')
+    if not default_storage.exists(name):
+        saved_name = default_storage.save(name, file)
+        if saved_name != name:
+            # Another upload of the same bytes won the race to write the file
+            default_storage.delete(saved_name)
+
+    try:
+        with transaction.atomic():
+            return Blob.objects.create(sha256=sha256, file=name, size=size, ref_count=1)
+    except IntegrityError:
+        # ... or the race to create the row
+        Blob.objects.filter(sha256=sha256).update(ref_count=F('ref_count') + 1)
+        return Blob.objects.get(sha256=sha256)
+
+
+def release(name):
+    """Drop one reference on the blob stored at ``name``.
+
+    Once the surrounding transaction commits with the last reference gone,
+    the blob's row and file are deleted; a blob stored as a delta releases
+    its base in turn. Names outside the blob store (files uploaded before it
+    existed) are left alone.
+    """
+    if not name:
+        return
+    with transaction.atomic():
+        blob = Blob.objects.select_for_update().filter(file=name, ref_count__gt=0).first()
+        if blob is None:
+            return
+        Blob.objects.filter(pk=blob.pk).update(ref_count=F('ref_count') - 1)
+        if blob.ref_count == 1:
+            transaction.on_commit(lambda: _delete_if_unreferenced(blob.pk))
+
+
+def _delete_if_unreferenced(pk):
+    with transaction.atomic():
+        blob = Blob.objects.filter(pk=pk).first()
+        # Deleting the row locks it (the whole database on SQLite) until the
+        # files are gone too. A store() of the same bytes meanwhile either
+        # took a reference first, so nothing is deleted, or waits and then
+        # finds no row and writes the file again.
+        if blob is None or not Blob.objects.filter(pk=pk, ref_count=0).delete()[0]:
+            return
+        default_storage.delete(blob.file.name)
+        if blob.base_id is not None:
+            # Stored as a delta: drop the delta and the reference on its base
+            default_storage.delete(blob.delta.name)
+            release(Blob.objects.filter(pk=blob.base_id).values_list('file', flat=True).first())
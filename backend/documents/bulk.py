@@ -0,0 +1,294 @@
+"""Bulk import and export of documents.
+
+Imports read a directory tree or a ZIP archive one file at a time. Each file
+is copied to a staging file while it is hashed, content that is already in
+the blob store is not stored again, and files already in the owner's library
+are skipped. Rows are written per batch with ``bulk_create``; text extraction
+and thumbnails are queued as separate jobs rather than run inline.
+
+Exports stream a ZIP of a user's current versions, plus a manifest that the
+importer uses to restore document names, without building the archive in
+memory or on disk.
+"""
+import hashlib
+import json
+import os
+import tempfile
+import time
+import zipfile
+from collections import Counter, defaultdict, namedtuple
+from functools import partial
+
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.db import IntegrityError, transaction
+from django.db.models import F
+from django.utils import timezone
+from django.utils.text import get_valid_filename
+
+from .blobstore import LocalFile, blob_name
+from .deltas import materialize
+from .extraction import can_extract
+from .jobs import enqueue_many
+from .models import Blob, Document, DocumentVersion
+from .thumbnails import can_render
+
+MANIFEST_NAME = 'manifest.json'
+COPY_CHUNK_SIZE = 1024 * 1024
+
+ImportEntry = namedtuple('ImportEntry', ['path', 'open', 'name', 'file_type'])
+
+
+def _hidden(path):
+    return any(part.startswith('.') or part == '__MACOSX' for part in path.split('/'))
+
+
+def make_entry(path, opener, name=None, file_type=None):
+    """Build an ``ImportEntry``, naming the document after the file unless told otherwise"""
+    stem, ext = os.path.splitext(os.path.basename(path))
+    return ImportEntry(path, opener, name or stem, file_type or ext.lstrip('.').lower())
+
+
+def iter_directory(root):
+    """Yield an entry for every non-hidden file below ``root``, in a stable order"""
+    for dirpath, dirnames, filenames in os.walk(root):
+        dirnames[:] = sorted(d for d in dirnames if not _hidden(d))
+        for filename in sorted(filenames):
+            if _hidden(filename):
+                continue
+            path = os.path.join(dirpath, filename)
+            yield make_entry(os.path.relpath(path, root).replace(os.sep, '/'), partial(open, path, 'rb'))
+
+
+def iter_zip(archive):
+    """Yield an entry for every file in an open ``ZipFile``.
+
+    Archives produced by ``iter_library_zip`` carry a manifest, which restores
+    the original document names and types.
+    """
+    manifest = {}
+    if MANIFEST_NAME in archive.namelist():
+        with archive.open(MANIFEST_NAME) as f:
+            manifest = {row['file']: row for row in json.load(f)}
+
+    for info in archive.infolist():
+        if info.is_dir() or info.filename == MANIFEST_NAME or _hidden(info.filename):
+            continue
+        meta = manifest.get(info.filename, {})
+        yield make_entry(info.filename, partial(archive.open, info),
+                         meta.get('name'), meta.get('file_type'))
+
+
+def _stage(entry):
+    """Copy an entry to a staging file while hashing it; return ``(sha256, size, path)``"""
+    digest = hashlib.sha256()
+    size = 0
+    staging_dir = getattr(settings, 'FILE_UPLOAD_TEMP_DIR', None)
+    with entry.open() as source, tempfile.NamedTemporaryFile(dir=staging_dir, delete=False) as staged:
+        while chunk := source.read(COPY_CHUNK_SIZE):
+            digest.update(chunk)
+            size += len(chunk)
+            staged.write(chunk)
+    return digest.hexdigest(), size, staged.name
+
+
+def _discard(path):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+def _store_blobs(batch):
+    """Store the batch's new contents and take two references per file; return ``{sha256: name}``"""
+    # Each imported file is referenced by its document and its first version
+    references = Counter()
+    for entry, sha256, size, path in batch:
+        references[sha256] += 2
+
+    names = dict(Blob.objects.filter(sha256__in=references).values_list('sha256', 'file'))
+    increments = defaultdict(list)
+    for sha256 in names:
+        increments[references[sha256]].append(sha256)
+    for increment, shas in increments.items():
+        Blob.objects.filter(sha256__in=shas).update(ref_count=F('ref_count') + increment)
+
+    new_blobs = []
+    for entry, sha256, size, path in batch:
+        if sha256 in names:
+            continue
+        name = blob_name(sha256, entry.path)
+        if not default_storage.exists(name):
+            with open(path, 'rb') as f:
+                saved_name = default_storage.save(name, LocalFile(f, name=entry.path))
+            if saved_name != name:
+                # Stored concurrently by another upload
+                default_storage.delete(saved_name)
+        names[sha256] = name
+        new_blobs.append(Blob(sha256=sha256, file=name, size=size, ref_count=references[sha256]))
+
+    try:
+        with transaction.atomic():
+            Blob.objects.bulk_create(new_blobs)
+    except IntegrityError:
+        # Another upload created some of the rows meanwhile; add our references to theirs
+        for blob in new_blobs:
+            try:
+                with transaction.atomic():
+                    blob.save()
+            except IntegrityError:
+                Blob.objects.filter(sha256=blob.sha256).update(ref_count=F('ref_count') + blob.ref_count)
+    return names
+
+
+def _import_batch(owner, batch):
+    """Create documents with a first version for a batch of staged files"""
+    with transaction.atomic():
+        names = _store_blobs(batch)
+
+        documents = Document.objects.bulk_create([
+            Document(
+                name=entry.name[:255],
+                file=names[sha256],
+                file_type=entry.file_type[:50],
+                owner=owner,
+                extraction_status='pending' if can_extract(entry.file_type, names[sha256]) else 'skipped',
+                last_version_number=1,
+            )
+            for entry, sha256, size, path in batch
+        ])
+        versions = DocumentVersion.objects.bulk_create([
+            DocumentVersion(
+                document=document,
+                version_number=1,
+                file=names[sha256],
+                original_name=os.path.basename(entry.path)[:255],
+                sha256=sha256,
+                created_by=owner,
+                extraction_status=document.extraction_status,
+            )
+            for document, (entry, sha256, size, path) in zip(documents, batch)
+        ])
+        for document, version in zip(documents, versions):
+            document.current_version = version
+        Document.objects.bulk_update(documents, ['current_version'])
+
+        enqueue_many('extract_version_text', [
+            {'version_id': version.id} for version in versions if version.extraction_status == 'pending'
+        ])
+        enqueue_many('render_version_thumbnails', [
+            {'version_id': version.id} for version in versions if can_render(version.file.name)
+        ])
+    return documents
+
+
+def import_entries(owner, entries, batch_size=500, skip_duplicates=True, progress=None):
+    """Import ``entries`` into ``owner``'s library in batches and return a summary.
+
+    Files whose content already exists in the library (or earlier in the same
+    import) are skipped unless ``skip_duplicates`` is false. ``progress`` is
+    called with the running summary after every batch.
+    """
+    summary = {'files': 0, 'imported': 0, 'duplicates': 0, 'bytes': 0, 'seconds': 0.0, 'files_per_second': 0.0}
+    started = time.monotonic()
+    known = set()
+    if skip_duplicates:
+        known = set(DocumentVersion.objects.filter(document__owner=owner).exclude(
+            sha256=''
+        ).values_list('sha256', flat=True))
+
+    def update_timing():
+        summary['seconds'] = round(time.monotonic() - started, 3)
+        summary['files_per_second'] = round(summary['files'] / summary['seconds'], 1) if summary['seconds'] else 0.0
+
+    batch = []
+    try:
+        for entry in entries:
+            sha256, size, path = _stage(entry)
+            summary['files'] += 1
+            summary['bytes'] += size
+            if skip_duplicates and sha256 in known:
+                _discard(path)
+                summary['duplicates'] += 1
+                continue
+            known.add(sha256)
+            batch.append((entry, sha256, size, path))
+
+            if len(batch) >= batch_size:
+                summary['imported'] += len(_import_batch(owner, batch))
+                for _, _, _, staged in batch:
+                    _discard(staged)
+                batch = []
+                update_timing()
+                if progress:
+                    progress(summary)
+
+        if batch:
+            summary['imported'] += len(_import_batch(owner, batch))
+    finally:
+        # Staged files are moved into storage when possible; remove the rest
+        for _, _, _, staged in batch:
+            _discard(staged)
+
+    update_timing()
+    return summary
+
+
+class _ZipOutput:
+    """Write-only, unseekable file object collecting the bytes ``ZipFile`` produces"""
+
+    def __init__(self):
+        self._chunks = []
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def take(self):
+        data = b''.join(self._chunks)
+        self._chunks.clear()
+        return data
+
+
+def iter_library_zip(owner):
+    """Yield a ZIP archive of ``owner``'s documents piece by piece.
+
+    Each document contributes its current version's file; the manifest at the
+    end of the archive records names, types and content hashes. Files are
+    stored uncompressed, as PDFs and office files are compressed already.
+    """
+    output = _ZipOutput()
+    manifest = []
+    documents = Document.objects.filter(owner=owner).select_related('current_version').order_by('id')
+    with zipfile.ZipFile(output, 'w', compression=zipfile.ZIP_STORED) as archive:
+        for document in documents.iterator(chunk_size=500):
+            version = document.current_version
+            field_file = materialize(version.file if version else document.file)
+            if not field_file or not field_file.storage.exists(field_file.name):
+                continue
+
+            ext = os.path.splitext(field_file.name)[1]
+            arcname = f'{document.id}-{get_valid_filename(document.name) or "document"}{ext}'
+            info = zipfile.ZipInfo(arcname, date_time=timezone.localtime(document.updated_at).timetuple()[:6])
+            info.file_size = field_file.storage.size(field_file.name)
+            with field_file.storage.open(field_file.name, 'rb') as source, archive.open(info, 'w') as target:
+                while chunk := source.read(COPY_CHUNK_SIZE):
+                    target.write(chunk)
+                    yield output.take()
+
+            manifest.append({
+                'file': arcname,
+                'id': document.id,
+                'name': document.name,
+                'file_type': document.file_type,
+                'version_number': version.version_number if version else None,
+                'sha256': version.sha256 if version else '',
+                'created_at': document.created_at.isoformat(),
+            })
+            yield output.take()
+
+        archive.writestr(MANIFEST_NAME, json.dumps(manifest, indent=2))
+    yield output.take()
@@ -0,0 +1,166 @@
+"""Cached GET responses and conditional requests.
+
+A document's ``generation`` goes up whenever the document, one of its versions
+or one of its annotations is saved or deleted (see ``signals``). Responses are
+cached under a key made from the user, the full request URL, the response
+format and the generation of the data they were built from. Changes
+therefore never have to find and delete stale entries; those entries just
+stop being looked up and age out of the cache.
+
+The same key is sent as the ETag. A request whose ``If-None-Match`` still
+matches is answered with 304 after one small query, without loading or
+serializing anything.
+"""
+from functools import wraps
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db.models import Count, F, Max, Sum
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.crypto import salted_hmac
+from django.utils.http import quote_etag
+from rest_framework.response import Response
+
+from .models import Annotation, Document, DocumentVersion
+
+
+def bump_generation(document_id):
+    """Invalidate cached responses built from ``document_id``"""
+    Document.objects.filter(pk=document_id).update(generation=F('generation') + 1)
+
+
+def get_cache():
+    return caches[getattr(settings, 'DOCUMENT_RESPONSE_CACHE', 'default')]
+
+
+def _document_state(row):
+    # created_at keeps keys apart if ids are ever reused (e.g. a restored database)
+    return None if row is None else f'{row[0]}.{row[1].timestamp()}'
+
+
+def document_state(document_id):
+    """Fingerprint of everything a response about one document is built from"""
+    return _document_state(Document.objects.filter(pk=document_id).values_list('generation', 'created_at').first())
+
+
+async def adocument_state(document_id):
+    return _document_state(await Document.objects.filter(pk=document_id).values_list('generation', 'created_at').afirst())
+
+
+LIBRARY_AGGREGATES = {'count': Count('id'), 'last': Max('id'), 'generations': Sum('generation')}
+
+
+def _library_state(user, totals):
+    # Adding a document raises the highest id, deleting one lowers the count,
+    # and every other change raises the sum of generations
+    return f"{user.date_joined.timestamp()}.{totals['count']}.{totals['last']}.{totals['generations']}"
+
+
+def library_state(user):
+    """Fingerprint of all of ``user``'s documents, for lists and library search"""
+    return _library_state(user, Document.objects.filter(owner=user).aggregate(**LIBRARY_AGGREGATES))
+
+
+async def alibrary_state(user):
+    return _library_state(user, await Document.objects.filter(owner=user).aaggregate(**LIBRARY_AGGREGATES))
+
+
+def response_etag(request, user, format, state):
+    digest = salted_hmac(
+        'documents.caching', f'{user.pk}\n{request.build_absolute_uri()}\n{format}\n{state}'
+    ).hexdigest()
+    return quote_etag(digest[:32])
+
+
+def _finish(response, etag):
+    response['ETag'] = etag
+    # Responses are per user; clients revalidate with If-None-Match
+    patch_cache_control(response, private=True, no_cache=True)
+    return response
+
+
+def _cache_key(etag):
+    return f'documents:response:{etag.strip(chr(34))}'
+
+
+def cache_response(state):
+    """Cache a DRF GET handler's data and answer ``If-None-Match`` with 304.
+
+    ``state(view, request, **kwargs)`` returns a fingerprint that changes
+    whenever the response could, or None to run the handler uncached (for
+    example so that it can return its own 404).
+    """
+    def decorator(handler):
+        @wraps(handler)
+        def wrapped(self, request, *args, **kwargs):
+            current = state(self, request, **kwargs)
+            if current is None:
+                return handler(self, request, *args, **kwargs)
+
+            etag = response_etag(request, request.user, request.accepted_renderer.format, current)
+            not_modified = get_conditional_response(request, etag=etag)
+            if not_modified is not None:
+                return _finish(not_modified, etag)
+
+            cache = get_cache()
+            data = cache.get(_cache_key(etag))
+            if data is not None:
+                return _finish(Response(data), etag)
+
+            response = handler(self, request, *args, **kwargs)
+            if response.status_code != 200:
+                return response
+            cache.set(_cache_key(etag), response.data, getattr(settings, 'DOCUMENT_RESPONSE_CACHE_TIMEOUT', 600))
+            return _finish(response, etag)
+        return wrapped
+    return decorator
+
+
+def acache_response(state, render):
+    """``cache_response`` for the async views, which return ``render(data)`` responses"""
+    def decorator(view):
+        @wraps(view)
+        async def wrapped(request, *args, **kwargs):
+            current = await state(request, **kwargs)
+            if current is None:
+                return await view(request, *args, **kwargs)
+
+            etag = response_etag(request, request.user, 'json', current)
+            not_modified = get_conditional_response(request, etag=etag)
+            if not_modified is not None:
+                return _finish(not_modified, etag)
+
+            cache = get_cache()
+            data = await cache.aget(_cache_key(etag))
+            if data is not None:
+                return _finish(render(data), etag)
+
+            response = await view(request, *args, **kwargs)
+            if response.status_code != 200:
+                return response
+            await cache.aset(_cache_key(etag), response.data, getattr(settings, 'DOCUMENT_RESPONSE_CACHE_TIMEOUT', 600))
+            return _finish(response, etag)
+        return wrapped
+    return decorator
+
+
+# Fingerprints for the viewsets; each takes ``(view, request, **kwargs)``
+
+def library(view, request, **kwargs):
+    return library_state(request.user)
+
+
+def document(view, request, pk=None, document_id=None, **kwargs):
+    return document_state(document_id or pk)
+
+
+def version(view, request, pk=None, document_id=None, **kwargs):
+    if document_id is None:
+        document_id = DocumentVersion.objects.filter(pk=pk).values_list('document_id', flat=True).first()
+    return document_state(document_id) if document_id else None
+
+
+def annotation(view, request, pk=None, document_id=None, **kwargs):
+    if document_id is None:
+        document_id = Annotation.objects.filter(pk=pk).values_list('document_id', flat=True).first()
+    return document_state(document_id) if document_id else None
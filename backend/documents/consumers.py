@@ -0,0 +1,111 @@
+from urllib.parse import parse_qs
+
+from channels.auth import AuthMiddlewareStack
+from channels.db import database_sync_to_async
+from channels.generic.websocket import AsyncJsonWebsocketConsumer
+from django.contrib.auth.models import AnonymousUser
+from rest_framework.exceptions import AuthenticationFailed
+
+from .authentication import lookup_token
+from .models import Document
+from .realtime import group_name, replay
+
+
+def query_param(scope, name):
+    values = parse_qs(scope.get('query_string', b'').decode()).get(name)
+    return values[0] if values else None
+
+
+@database_sync_to_async
+def get_token_user(key):
+    try:
+        return lookup_token(key)[0]
+    except AuthenticationFailed:
+        return None
+
+
+class TokenAuthMiddleware:
+    """Authenticate WebSocket connections with ``?token=<api token>``.
+
+    Browsers cannot set an Authorization header on a WebSocket, so the token
+    goes in the query string. Connections without one fall back to the
+    Django session.
+    """
+
+    def __init__(self, inner):
+        self.inner = inner
+
+    async def __call__(self, scope, receive, send):
+        key = query_param(scope, 'token')
+        if key:
+            scope = dict(scope, user=await get_token_user(key) or AnonymousUser())
+        return await self.inner(scope, receive, send)
+
+
+def TokenAuthMiddlewareStack(inner):
+    return AuthMiddlewareStack(TokenAuthMiddleware(inner))
+
+
+class AnnotationConsumer(AsyncJsonWebsocketConsumer):
+    """Push a document's annotation changes to its owner.
+
+    Connect to ``ws/documents/<id>/annotations/``, optionally with
+    ``?since=<seq>`` to first receive the events after ``seq``. Once caught
+    up the server sends ``{"type": "subscribed", "seq": n}``, then
+    ``{"type": "events", "events": [...]}`` as changes happen, in sequence
+    order. ``{"type": "reset", "seq": n}`` means missed events are no longer
+    available and the annotations should be reloaded.
+    """
+
+    async def connect(self):
+        self.group = None
+        user = self.scope.get('user')
+        if user is None or not user.is_authenticated:
+            await self.close(code=4401)
+            return
+        self.document_id = self.scope['url_route']['kwargs']['document_id']
+        if not await database_sync_to_async(
+            Document.objects.filter(pk=self.document_id, owner=user).exists
+        )():
+            await self.close(code=4403)
+            return
+
+        # Join the group before reading the log so nothing committed in
+        # between is missed; duplicates are dropped by sequence number
+        self.group = group_name(self.document_id)
+        await self.channel_layer.group_add(self.group, self.channel_name)
+        await self.accept()
+
+        try:
+            since = int(query_param(self.scope, 'since'))
+        except (TypeError, ValueError):
+            since = None
+        if since is None:
+            self.last_seq = (await database_sync_to_async(replay)(self.document_id, 0))[1]
+        else:
+            self.last_seq = since
+            await self.catch_up()
+        await self.send_json({'type': 'subscribed', 'seq': self.last_seq})
+
+    async def disconnect(self, code):
+        if self.group:
+            await self.channel_layer.group_discard(self.group, self.channel_name)
+
+    async def catch_up(self):
+        events, last = await database_sync_to_async(replay)(self.document_id, self.last_seq)
+        if events is None:
+            self.last_seq = last
+            await self.send_json({'type': 'reset', 'seq': last})
+        elif events:
+            self.last_seq = events[-1]['seq']
+            await self.send_json({'type': 'events', 'events': events})
+
+    async def annotation_events(self, message):
+        events = [event for event in message['events'] if event['seq'] > self.last_seq]
+        if events and events[0]['seq'] != self.last_seq + 1:
+            # Another transaction's broadcast hasn't arrived yet; read its events from the log
+            await self.catch_up()
+            events = [event for event in events if event['seq'] > self.last_seq]
+        if events:
+            self.last_seq = events[-1]['seq']
+            await self.send_json({'type': 'events', 'events': events})
@@ -0,0 +1,232 @@
+"""Binary delta storage for successive versions of a file.
+
+With ``DOCUMENT_VERSION_DELTAS`` on, a job re-stores the file of a version
+as a delta against the previous version's once a newer version supersedes
+it (see ``encode_blob``); the newest version of a document stays whole. A delta is a zlib-compressed list of "copy
+this range of the base" and "insert these bytes" instructions; it is only
+kept when it is at most ``DOCUMENT_DELTA_MAX_RATIO`` of the file's size.
+Chains are cut by a full snapshot every ``DOCUMENT_DELTA_SNAPSHOT_INTERVAL``
+blobs, which bounds the deltas applied to rebuild a file.
+
+Readers get a stored file through ``materialize``, which returns files
+stored in full unchanged and rebuilds the others into a size-bounded disk
+cache of recently used files; ``views.BlobFileView`` does the same for
+media URLs, for the files' owners.
+"""
+import hashlib
+import os
+import struct
+import zlib
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import FileSystemStorage, default_storage
+from django.db import transaction
+from django.db.models.fields.files import FieldFile
+
+from .blobstore import acquire
+from .diskcache import DiskCache
+from .models import Blob
+
+# Target bytes are matched against the base in blocks of this size
+BLOCK_SIZE = 32
+
+_COPY = struct.Struct('>cQI')
+_INSERT = struct.Struct('>cI')
+
+_cache = None
+
+
+class DeltaError(Exception):
+    """A delta doesn't rebuild the file it was made for"""
+
+
+def encode(source, target, max_size=None):
+    """Return a delta that turns ``source`` into ``target``.
+
+    Returns None once more than ``max_size`` bytes of ``target`` turn out
+    not to be in ``source`` (so unrelated files are given up on early), or
+    if the delta ends up larger than that.
+    """
+    index = {}
+    for offset in range(len(source) - BLOCK_SIZE, -1, -BLOCK_SIZE):
+        # Iterating backwards leaves the first occurrence of repeated blocks
+        index[source[offset:offset + BLOCK_SIZE]] = offset
+
+    ops = []
+    literal = 0
+    pending = position = 0
+    end = len(target) - BLOCK_SIZE
+    while position <= end:
+        offset = index.get(target[position:position + BLOCK_SIZE])
+        if offset is None:
+            position += 1
+            if max_size is not None and literal + position - pending > max_size:
+                return None
+            continue
+
+        # Grow the match backwards over bytes not yet emitted...
+        start = position
+        while start > pending and offset > 0 and target[start - 1] == source[offset - 1]:
+            start -= 1
+            offset -= 1
+        # ... and forwards, comparing in halving steps
+        stop = position + BLOCK_SIZE
+        source_stop = offset + stop - start
+        step = 4096
+        while step:
+            chunk = target[stop:stop + step]
+            if chunk and chunk == source[source_stop:source_stop + len(chunk)]:
+                stop += len(chunk)
+                source_stop += len(chunk)
+            else:
+                step //= 2
+
+        if start > pending:
+            ops.append(_INSERT.pack(b'I', start - pending) + target[pending:start])
+            literal += start - pending
+        ops.append(_COPY.pack(b'C', offset, stop - start))
+        pending = position = stop
+
+    if pending < len(target):
+        ops.append(_INSERT.pack(b'I', len(target) - pending) + target[pending:])
+        literal += len(target) - pending
+    delta = zlib.compress(b''.join(ops))
+    if max_size is not None and len(delta) > max_size:
+        return None
+    return delta
+
+
+def apply(source, delta):
+    """Rebuild a file from its base ``source`` and a delta made by ``encode``"""
+    ops = zlib.decompress(delta)
+    out = bytearray()
+    position = 0
+    while position < len(ops):
+        if ops[position:position + 1] == b'C':
+            _, offset, length = _COPY.unpack_from(ops, position)
+            out += source[offset:offset + length]
+            position += _COPY.size
+        else:
+            _, length = _INSERT.unpack_from(ops, position)
+            position += _INSERT.size
+            out += ops[position:position + length]
+            position += length
+    return bytes(out)
+
+
+class ReconstructionCache(DiskCache):
+    """Files rebuilt from deltas, keyed by content hash"""
+
+    def name(self, sha256, ext):
+        return f'{sha256[:2]}/{sha256}{ext}'
+
+    def get(self, sha256, ext):
+        """Return the path of a rebuilt file, or None"""
+        return self._get(os.path.join(self.directory, self.name(sha256, ext)))
+
+    def put(self, sha256, ext, data):
+        return self._put(os.path.join(self.directory, self.name(sha256, ext)), data)
+
+
+def get_cache():
+    """Return the shared reconstruction cache, recreating it if its settings changed"""
+    global _cache
+    directory = getattr(settings, 'DOCUMENT_DELTA_CACHE_DIR', os.path.join(settings.BASE_DIR, 'delta_cache'))
+    max_bytes = getattr(settings, 'DOCUMENT_DELTA_CACHE_MAX_BYTES', 1024 ** 3)
+    if _cache is None or (_cache.directory, _cache.max_bytes) != (directory, max_bytes):
+        _cache = ReconstructionCache(directory, max_bytes)
+    return _cache
+
+
+class CacheStorage(FileSystemStorage):
+    """The reconstruction cache directory as a storage, for ``FieldFile``s of rebuilt files"""
+
+    def get_modified_time(self, name):
+        # Cache mtimes track use, not content; downloads fall back to the version's date
+        raise NotImplementedError
+
+
+def _extension(blob):
+    return os.path.splitext(blob.file.name)[1]
+
+
+def blob_content(blob):
+    """Return the bytes of a blob, rebuilding (and caching) deltas as needed"""
+    if blob.base_id is None:
+        with default_storage.open(blob.file.name, 'rb') as f:
+            return f.read()
+
+    cache = get_cache()
+    path = cache.get(blob.sha256, _extension(blob))
+    if path is not None:
+        with open(path, 'rb') as f:
+            return f.read()
+
+    with default_storage.open(blob.delta.name, 'rb') as f:
+        delta = f.read()
+    data = apply(blob_content(blob.base), delta)
+    if hashlib.sha256(data).hexdigest() != blob.sha256:
+        raise DeltaError(f"Delta {blob.delta.name} doesn't rebuild {blob.sha256}")
+    cache.put(blob.sha256, _extension(blob), data)
+    return data
+
+
+def materialize(field_file):
+    """Return a readable ``FieldFile`` for a stored file.
+
+    Files stored in full come back as they are. Files stored as deltas are
+    rebuilt into the reconstruction cache, unless they are there already,
+    and the returned file points into the cache.
+    """
+    if not field_file:
+        return field_file
+    blob = Blob.objects.filter(file=field_file.name).exclude(base=None).select_related('base').first()
+    if blob is None:
+        return field_file
+
+    cache = get_cache()
+    if cache.get(blob.sha256, _extension(blob)) is None:
+        blob_content(blob)
+    rebuilt = FieldFile(field_file.instance, field_file.field, cache.name(blob.sha256, _extension(blob)))
+    rebuilt.storage = CacheStorage(location=cache.directory)
+    return rebuilt
+
+
+def delta_name(blob):
+    return f'blobs/{blob.sha256[:2]}/{blob.sha256[2:4]}/{blob.sha256}.delta'
+
+
+def encode_blob(blob, base):
+    """Store ``blob`` as a delta against ``base`` if that pays off; return whether it was.
+
+    Blobs already stored as deltas, blobs other deltas are based on and blobs
+    that are due a snapshot stay as they are. The full file is deleted once
+    the delta is in place.
+    """
+    interval = getattr(settings, 'DOCUMENT_DELTA_SNAPSHOT_INTERVAL', 10)
+    if blob.pk == base.pk or blob.base_id is not None or base.depth + 1 >= interval or blob.deltas.exists():
+        return False
+
+    with default_storage.open(blob.file.name, 'rb') as f:
+        target = f.read()
+    max_size = int(len(target) * getattr(settings, 'DOCUMENT_DELTA_MAX_RATIO', 0.5))
+    delta = encode(blob_content(base), target, max_size)
+    if delta is None:
+        return False
+    name = default_storage.save(delta_name(blob), ContentFile(delta))
+
+    with transaction.atomic():
+        # Check again now that the rows are locked: another job may have
+        # turned either blob into a delta, or based one on this blob
+        blob = Blob.objects.select_for_update().filter(pk=blob.pk).first()
+        base = Blob.objects.select_for_update().filter(pk=base.pk).first()
+        if (blob is None or base is None or blob.base_id is not None
+                or base.depth + 1 >= interval or blob.deltas.exists()):
+            transaction.on_commit(lambda: default_storage.delete(name))
+            return False
+        Blob.objects.filter(pk=blob.pk).update(base=base, delta=name, delta_size=len(delta), depth=base.depth + 1)
+        acquire(base)
+        full_name = blob.file.name
+        transaction.on_commit(lambda: default_storage.delete(full_name))
+    return True
@@ -0,0 +1,73 @@
+"""Size-bounded directories of cached files, shared by several processes."""
+import os
+import threading
+
+
+class DiskCache:
+    """A directory of files capped at ``max_bytes``, evicting least recently used files.
+
+    Reads bump a file's mtime, which is what eviction orders by. Each process
+    keeps a running estimate of the cache size and rescans the directory
+    when it crosses the limit, so several workers can share one cache.
+    Subclasses decide where entries live.
+    """
+
+    def __init__(self, directory, max_bytes):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._size = None
+        self._lock = threading.Lock()
+
+    def _get(self, path):
+        """Return ``path`` if it is cached (marking it used), or None"""
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            return None
+        return path
+
+    def _put(self, path, data):
+        """Store ``data`` at ``path``, evicting old entries if the cache is full"""
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Write then rename so readers never see a partial file
+        tmp_path = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+
+        with self._lock:
+            if self._size is None:
+                self._size = sum(size for _, size, _ in self._entries())
+            else:
+                self._size += len(data)
+            if self._size > self.max_bytes:
+                self._evict()
+        return path
+
+    def _entries(self):
+        for root, _, files in os.walk(self.directory):
+            for name in files:
+                if name.endswith('.tmp'):
+                    continue
+                path = os.path.join(root, name)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    # Evicted by another process
+                    continue
+                yield stat.st_mtime, stat.st_size, path
+
+    def _evict(self):
+        # Trim to 90% so that every write doesn't trigger another scan
+        entries = sorted(self._entries())
+        total = sum(size for _, size, _ in entries)
+        target = self.max_bytes * 0.9
+        for _, size, path in entries:
+            if total <= target:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+        self._size = total
@@ -0,0 +1,146 @@
+"""Authenticated file downloads with HTTP Range and conditional GET support.
+
+Files are streamed from storage in chunks, so Python never holds a whole file
+in memory. In production the bytes can be handed to the web server instead
+with ``DOCUMENT_DOWNLOAD_OFFLOAD = 'x-accel-redirect'`` (nginx) or
+``'x-sendfile'`` (Apache/lighttpd); the server then deals with ranges itself.
+"""
+import hashlib
+import mimetypes
+import os
+import re
+
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.http import HttpResponse, StreamingHttpResponse
+from django.utils.cache import get_conditional_response
+from django.utils.http import content_disposition_header, http_date, quote_etag
+from rest_framework.negotiation import DefaultContentNegotiation
+
+CHUNK_SIZE = 64 * 1024
+
+_RANGE = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+
+class IgnoreClientContentNegotiation(DefaultContentNegotiation):
+    """Don't 406 binary downloads because the client asked for e.g. application/pdf"""
+
+    def select_renderer(self, request, renderers, format_suffix=None):
+        return renderers[0], renderers[0].media_type
+
+
+def parse_range(header, size):
+    """Return ``(start, end)`` (inclusive) for a single-range header.
+
+    Returns None when the header is absent or one we choose to ignore (such as
+    multiple ranges), and raises ValueError when it cannot be satisfied.
+    """
+    match = _RANGE.match(header.strip()) if header else None
+    if not match:
+        return None
+    first, last = match.groups()
+    if not first and not last:
+        return None
+    if not size:
+        # No byte of an empty file can be addressed, not even by a suffix range
+        raise ValueError('Empty file')
+    if not first:
+        # Suffix range: the last N bytes
+        length = int(last)
+        if length == 0:
+            raise ValueError('Empty suffix range')
+        return max(size - length, 0), size - 1
+    start = int(first)
+    end = min(int(last), size - 1) if last else size - 1
+    if start >= size or start > end:
+        raise ValueError('Range not satisfiable')
+    return start, end
+
+
+def _stream(field_file, start, length):
+    with field_file.storage.open(field_file.name, 'rb') as f:
+        f.seek(start)
+        remaining = length
+        while remaining > 0:
+            chunk = f.read(min(CHUNK_SIZE, remaining))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            yield chunk
+
+
+def file_validators(field_file, fallback_modified=None):
+    """Return ``(etag, modified, size)`` for a stored file"""
+    storage = field_file.storage
+    size = storage.size(field_file.name)
+    try:
+        modified = storage.get_modified_time(field_file.name)
+    except NotImplementedError:
+        modified = fallback_modified
+    stamp = modified.timestamp() if modified else ''
+    etag = quote_etag(hashlib.md5(f'{field_file.name}:{size}:{stamp}'.encode()).hexdigest())
+    return etag, modified, size
+
+
+def serve_file(request, field_file, fallback_modified=None, filename=None):
+    """Build a download response for ``field_file`` honoring Range and conditional headers.
+
+    ``filename`` names the download; it defaults to the stored file's name.
+    """
+    etag, modified, size = file_validators(field_file, fallback_modified)
+    # HTTP dates have one-second resolution
+    last_modified = int(modified.timestamp()) if modified else None
+
+    # 304 Not Modified / 412 Precondition Failed
+    response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+    if response is not None:
+        return response
+
+    content_type = mimetypes.guess_type(field_file.name)[0] or 'application/octet-stream'
+    filename = filename or os.path.basename(field_file.name)
+    offload = getattr(settings, 'DOCUMENT_DOWNLOAD_OFFLOAD', None)
+    if offload == 'x-accel-redirect' and field_file.storage is not default_storage:
+        # Only MEDIA_ROOT is mapped to the accel prefix; other files (such as
+        # versions rebuilt from deltas) are streamed from here
+        offload = None
+
+    if offload:
+        response = HttpResponse(content_type=content_type)
+        if offload == 'x-accel-redirect':
+            prefix = getattr(settings, 'DOCUMENT_DOWNLOAD_ACCEL_PREFIX', '/protected-media/')
+            response['X-Accel-Redirect'] = prefix.rstrip('/') + '/' + field_file.name
+        elif offload == 'x-sendfile':
+            response['X-Sendfile'] = field_file.path
+        else:
+            raise ValueError(f"Unknown DOCUMENT_DOWNLOAD_OFFLOAD mode: {offload}")
+    else:
+        byte_range = None
+        # If-Range: only honor the range while the client's copy is current
+        if_range = request.META.get('HTTP_IF_RANGE')
+        if not if_range or if_range == etag:
+            try:
+                byte_range = parse_range(request.META.get('HTTP_RANGE'), size)
+            except ValueError:
+                response = HttpResponse(status=416)
+                response['Content-Range'] = f'bytes */{size}'
+                return response
+
+        if byte_range:
+            start, end = byte_range
+            response = StreamingHttpResponse(
+                _stream(field_file, start, end - start + 1), status=206, content_type=content_type
+            )
+            response['Content-Range'] = f'bytes {start}-{end}/{size}'
+            response['Content-Length'] = end - start + 1
+        else:
+            response = StreamingHttpResponse(_stream(field_file, 0, size), content_type=content_type)
+            response['Content-Length'] = size
+        response['Accept-Ranges'] = 'bytes'
+
+    response['ETag'] = etag
+    if modified:
+        response['Last-Modified'] = http_date(last_modified)
+    response['Content-Disposition'] = content_disposition_header(False, filename)
+    # Version files never change in place, but access is per user
+    response['Cache-Control'] = 'private, max-age=0, must-revalidate'
+    return response
@@ -0,0 +1,450 @@
+"""Page-at-a-time text extraction from stored files.
+
+Extractors are registered per file type with the ``extractor`` decorator and
+looked up with ``get_extractor``. Each one takes a local path and yields page
+dicts::
+
+    {"page": 1, "text": "...", "hash": "...", "same_as": None,
+     "method": "text", "seconds": 0.004}
+
+Files are read where they are stored (PDFs memory-mapped) and pages are
+yielded one by one; for PDFs the page tree is walked lazily and PyPDF2's
+parsed objects are dropped after every page. Memory use therefore stays flat
+however many pages a document has; callers write pages out in batches as
+they arrive. PDF pages without a text layer go through OCR (see ``ocr``).
+"""
+import hashlib
+import io
+import mmap
+import os
+import re
+import tempfile
+import time
+import zipfile
+from collections import deque, namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+from html.parser import HTMLParser
+from xml.etree import ElementTree
+
+import PyPDF2
+from django.conf import settings
+from PyPDF2 import PageObject
+from PyPDF2.errors import EmptyFileError
+from PyPDF2.generic import IndirectObject
+
+from .ocr import ocr_command, with_ocr
+
+_pool = None
+_pool_workers = None
+
+_extractors = {}
+
+
+class Extractor(namedtuple('Extractor', ['format', 'extract', 'version', 'ocr'])):
+    """A registered extractor; see ``extractor``"""
+    __slots__ = ()
+
+    @property
+    def version_key(self):
+        return f'{self.format}-{self.version}'
+
+    @property
+    def key(self):
+        """Identifies the output this extractor produces, for the extraction cache.
+
+        Adds the OCR languages for extractors that OCR, when OCR is available,
+        since both change the text of scanned pages.
+        """
+        key = self.version_key
+        if self.ocr and ocr_command():
+            key += '+ocr-' + getattr(settings, 'DOCUMENT_OCR_LANGUAGES', 'eng')
+        return key
+
+
+def extractor(*file_types, version=1, ocr=False):
+    """Register a function as the extractor for ``file_types``.
+
+    Types are matched against file extensions and ``Document.file_type``
+    (lower case, without a dot). The first one names the format in metrics.
+    Bump ``version`` whenever a change alters the extracted text, so results
+    cached for the old version aren't used any more; ``ocr`` marks extractors
+    that fall back to OCR.
+    """
+    def decorator(func):
+        for file_type in file_types:
+            _extractors[file_type] = Extractor(file_types[0], func, version, ocr)
+        return func
+    return decorator
+
+
+def get_extractor(file_type, name=''):
+    """Return the ``Extractor`` for a file, or None if its text can't be extracted.
+
+    The file name's extension wins over ``file_type``, which the upload form
+    sets loosely (``word`` for both .doc and .docx).
+    """
+    extension = os.path.splitext(name)[1].lower().lstrip('.')
+    return _extractors.get(extension) or _extractors.get((file_type or '').lower())
+
+
+def all_extractors():
+    """Every registered ``Extractor``, once each"""
+    return set(_extractors.values())
+
+
+def can_extract(file_type, name=''):
+    return get_extractor(file_type, name) is not None
+
+
+def _update_with_stream(digest, stream):
+    digest.update(stream.get_object().get_data())
+
+
+def page_fingerprint(page):
+    """Hash everything a page's extracted text depends on.
+
+    That is the content stream, the fonts (and their character maps) and any
+    form XObjects it draws, plus the rotation; images count too, as their
+    text may come from OCR. Reading these is much cheaper than extracting
+    the text, so unchanged pages of a new version can be recognized without
+    extracting them.
+    """
+    digest = hashlib.sha256()
+    contents = page.get_contents()
+    if contents is not None:
+        digest.update(contents.get_data())
+    digest.update(repr(page.get('/Rotate', 0)).encode())
+
+    resources = page.get('/Resources')
+    resources = resources.get_object() if resources is not None else {}
+    fonts = resources.get('/Font')
+    for name, font in sorted((fonts.get_object() if fonts is not None else {}).items()):
+        font = font.get_object()
+        digest.update(f"{name}{font.get('/BaseFont')}{font.get('/Encoding')}".encode())
+        if '/ToUnicode' in font:
+            _update_with_stream(digest, font['/ToUnicode'])
+    xobjects = resources.get('/XObject')
+    for name, xobject in sorted((xobjects.get_object() if xobjects is not None else {}).items()):
+        xobject = xobject.get_object()
+        if xobject.get('/Subtype') == '/Form':
+            digest.update(name.encode())
+            _update_with_stream(digest, xobject)
+        elif xobject.get('/Subtype') == '/Image':
+            # The encoded bytes identify the image; decoding them isn't needed
+            digest.update(name.encode())
+            digest.update(getattr(xobject, '_data', b''))
+    return digest.hexdigest()
+
+
+INHERITABLE_PAGE_ATTRIBUTES = ('/Resources', '/MediaBox', '/CropBox', '/Rotate')
+
+
+def page_count(pdf_reader):
+    """Number of pages, from the page tree root rather than ``pdf_reader.pages``"""
+    return int(pdf_reader.trailer['/Root']['/Pages'].get('/Count', 0))
+
+
+def iter_page_objects(pdf_reader, start=0, stop=None):
+    """Yield page objects ``start``..``stop - 1`` by walking the page tree.
+
+    ``pdf_reader.pages`` builds (and keeps) an object for every page up
+    front; this builds them one at a time and skips whole subtrees before
+    ``start`` by their ``/Count``. Attributes are inherited from parent nodes
+    the way ``PdfReader`` does it.
+    """
+    index = 0
+    stack = [(pdf_reader.trailer['/Root'].raw_get('/Pages'), {})]
+    while stack:
+        reference, inherited = stack.pop()
+        node = reference.get_object()
+        if node.get('/Type', '/Pages') == '/Pages':
+            count = int(node.get('/Count', 0))
+            if count and index + count <= start:
+                index += count
+                continue
+            inherited = dict(inherited, **{
+                name: node[name] for name in INHERITABLE_PAGE_ATTRIBUTES if name in node
+            })
+            stack.extend((kid, inherited) for kid in reversed(node['/Kids']))
+            continue
+
+        if stop is not None and index >= stop:
+            return
+        if index >= start:
+            page = PageObject(pdf_reader, reference if isinstance(reference, IndirectObject) else None)
+            page.update(inherited)
+            page.update(node)
+            yield index, page
+        index += 1
+
+
+def iter_pages(pdf_reader, start=0, stop=None, known=None):
+    """Yield a page dict for every page ``start``..``stop - 1``, with blank text where there is no text layer.
+
+    ``known`` maps page fingerprints to page numbers of an earlier extraction
+    (of a previous version). Pages found there are not extracted again: their
+    ``"text"`` is None and ``"same_as"`` names the earlier page, whose text
+    the caller copies. ``"same_as"`` is None for extracted pages.
+    """
+    for index, page in iter_page_objects(pdf_reader, start, stop):
+        started = time.perf_counter()
+        fingerprint = page_fingerprint(page)
+        same_as = known.get(fingerprint) if known else None
+        page_text = page.extract_text() if same_as is None else None
+        # Parsed objects are cached per reader; only the page tree walk
+        # needs them again, and it re-reads what it lacks
+        pdf_reader.resolved_objects.clear()
+        yield {
+            "page": index + 1,
+            "text": page_text,
+            "hash": fingerprint,
+            "same_as": same_as,
+            "method": "text" if same_as is None else "reused",
+            "seconds": time.perf_counter() - started,
+        }
+
+
+def extract_pdf_pages(file_content, known=None):
+    """Return page dicts for every page of an in-memory PDF that has a text layer.
+
+    For benchmarks and PDFs already in memory; stored files should go
+    through ``iter_file_pages``. Parser errors propagate so that background
+    jobs can retry them.
+    """
+    return [
+        page for page in iter_pages(PyPDF2.PdfReader(io.BytesIO(file_content)), known=known)
+        if page['text'] or page['same_as'] is not None
+    ]
+
+
+def _open_mapped_reader(path):
+    with open(path, 'rb') as f:
+        if not os.fstat(f.fileno()).st_size:
+            # mmap can't map an empty file; fail as PdfReader does for one
+            raise EmptyFileError("Cannot read an empty file")
+        mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    return PyPDF2.PdfReader(mapped), mapped
+
+
+@contextmanager
+def local_path(field_file):
+    """A local path to a stored file.
+
+    Remote storages have none, so their file is copied (in chunks) to a
+    temporary file for the duration of the block.
+    """
+    try:
+        path = field_file.path
+    except NotImplementedError:
+        path = None
+    if path:
+        yield path
+        return
+
+    with tempfile.NamedTemporaryFile(suffix=os.path.splitext(field_file.name)[1]) as copy:
+        with field_file.open('rb') as f:
+            for chunk in f.chunks():
+                copy.write(chunk)
+        copy.flush()
+        yield copy.name
+
+
+def _extract_page_range(path, start, stop, known=None):
+    """Process pool worker: extract pages ``start``..``stop - 1`` of the file at ``path``.
+
+    Every worker maps the file itself, so the OS shares the pages between
+    processes and no file bytes are pickled across the pool.
+    """
+    pdf_reader, mapped = _open_mapped_reader(path)
+    try:
+        return list(iter_pages(pdf_reader, start, stop, known))
+    finally:
+        mapped.close()
+
+
+def get_extraction_pool(workers):
+    """Return the shared process pool, recreating it if the size changed"""
+    global _pool, _pool_workers
+    if _pool is None or _pool_workers != workers:
+        if _pool is not None:
+            _pool.shutdown()
+        _pool = ProcessPoolExecutor(max_workers=workers)
+        _pool_workers = workers
+    return _pool
+
+
+def extract_pdf_pages_parallel(path, workers=None, pages_per_task=None, known=None):
+    """Yield pages of the PDF at ``path``, sharding page ranges across a process pool.
+
+    Pages come out in page order, so the output matches ``iter_pages``. At
+    most two ranges per worker are in flight, which bounds the pages held in
+    memory at once.
+    """
+    workers = workers or getattr(settings, 'DOCUMENT_EXTRACTION_WORKERS', 1)
+    pages_per_task = pages_per_task or getattr(settings, 'DOCUMENT_EXTRACTION_PAGES_PER_TASK', 25)
+
+    pdf_reader, mapped = _open_mapped_reader(path)
+    try:
+        count = page_count(pdf_reader)
+        if workers <= 1 or count <= pages_per_task:
+            yield from iter_pages(pdf_reader, 0, count, known)
+            return
+    finally:
+        mapped.close()
+
+    pool = get_extraction_pool(workers)
+    in_flight = deque()
+    for start in range(0, count, pages_per_task):
+        in_flight.append(pool.submit(_extract_page_range, str(path), start, min(start + pages_per_task, count), known))
+        if len(in_flight) >= 2 * workers:
+            yield from in_flight.popleft().result()
+    while in_flight:
+        yield from in_flight.popleft().result()
+
+
+@extractor('pdf', ocr=True)
+def extract_pdf(path, known=None):
+    """Text layers of every page (in parallel with ``DOCUMENT_EXTRACTION_WORKERS`` > 1), OCR for the rest"""
+    return with_ocr(path, extract_pdf_pages_parallel(path, known=known))
+
+
+PAGE_BREAK = object()
+
+
+def _text_page(number, text, started):
+    return {
+        "page": number, "text": text, "hash": "", "same_as": None,
+        "method": "text", "seconds": time.perf_counter() - started,
+    }
+
+
+def paginate(chunks, page_chars=None):
+    """Group text chunks (and ``PAGE_BREAK`` markers) into page dicts.
+
+    Formats without fixed pages are split so that no page holds more than
+    ``DOCUMENT_EXTRACTION_PAGE_CHARS`` characters, at a line break where
+    there is one.
+    """
+    page_chars = page_chars or getattr(settings, 'DOCUMENT_EXTRACTION_PAGE_CHARS', 3000)
+    number, buffer, started = 1, '', time.perf_counter()
+    for chunk in chunks:
+        if chunk is PAGE_BREAK:
+            yield _text_page(number, buffer, started)
+            number, buffer, started = number + 1, '', time.perf_counter()
+            continue
+        buffer += chunk
+        while len(buffer) >= page_chars:
+            cut = buffer.rfind('\n', 0, page_chars) + 1 or page_chars
+            yield _text_page(number, buffer[:cut], started)
+            number, buffer, started = number + 1, buffer[cut:], time.perf_counter()
+    if buffer:
+        yield _text_page(number, buffer, started)
+
+
+def _read_chunks(f, size=64 * 1024):
+    return iter(lambda: f.read(size), '')
+
+
+@extractor('txt', 'text', 'md', 'csv')
+def extract_text_file(path, known=None):
+    """Plain text as UTF-8; form feeds start a new page"""
+    with open(path, encoding='utf-8-sig', errors='replace') as f:
+        chunks = (
+            piece
+            for chunk in _read_chunks(f)
+            for index, part in enumerate(chunk.split('\f'))
+            for piece in ((PAGE_BREAK, part) if index else (part,))
+        )
+        yield from paginate(chunks)
+
+
+WORD_NAMESPACE = '{http://schemas.openxmlformats.org/wordprocessingml/2006/main}'
+
+
+def _docx_chunks(part):
+    w = WORD_NAMESPACE
+    for event, element in ElementTree.iterparse(part, events=('start', 'end')):
+        tag = element.tag
+        page_break = tag == f'{w}lastRenderedPageBreak' or (tag == f'{w}br' and element.get(f'{w}type') == 'page')
+        if event == 'start':
+            if page_break:
+                yield PAGE_BREAK
+        elif tag == f'{w}t':
+            yield element.text or ''
+        elif tag == f'{w}tab':
+            yield '\t'
+        elif tag in (f'{w}br', f'{w}cr') and not page_break:
+            yield '\n'
+        elif tag == f'{w}p':
+            yield '\n'
+            # Finished paragraphs aren't needed again
+            element.clear()
+
+
+@extractor('docx')
+def extract_docx(path, known=None):
+    """Body text of a Word document, paged where Word last laid out page breaks"""
+    with zipfile.ZipFile(path) as archive, archive.open('word/document.xml') as part:
+        yield from paginate(_docx_chunks(part))
+
+
+class HTMLText(HTMLParser):
+    """Collects the visible text of an HTML document as it is fed"""
+    BLOCK_TAGS = {
+        'address', 'article', 'aside', 'blockquote', 'br', 'dd', 'div', 'dl', 'dt', 'figcaption',
+        'footer', 'h1', 'h2', 'h3', 'h4', 'h5', 'h6', 'header', 'hr', 'li', 'main', 'nav', 'ol',
+        'p', 'pre', 'section', 'table', 'td', 'th', 'title', 'tr', 'ul',
+    }
+    HIDDEN_TAGS = {'script', 'style', 'template', 'noscript'}
+    _WHITESPACE = re.compile(r'\s+')
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.chunks = []
+        self._hidden = 0
+
+    def handle_starttag(self, tag, attrs):
+        if tag in self.HIDDEN_TAGS:
+            self._hidden += 1
+        elif tag in self.BLOCK_TAGS:
+            self.chunks.append('\n')
+
+    def handle_endtag(self, tag):
+        if tag in self.HIDDEN_TAGS:
+            self._hidden = max(self._hidden - 1, 0)
+        elif tag in self.BLOCK_TAGS:
+            self.chunks.append('\n')
+
+    def handle_data(self, data):
+        if not self._hidden:
+            self.chunks.append(self._WHITESPACE.sub(' ', data))
+
+
+def _html_chunks(f):
+    parser = HTMLText()
+    for chunk in _read_chunks(f):
+        parser.feed(chunk)
+        yield from parser.chunks
+        parser.chunks.clear()
+    parser.close()
+    yield from parser.chunks
+
+
+@extractor('html', 'htm')
+def extract_html(path, known=None):
+    """Visible text of an HTML page, without scripts and styles"""
+    with open(path, encoding='utf-8', errors='replace') as f:
+        yield from paginate(_html_chunks(f))
+
+
+def iter_file_pages(field_file, extract, known=None):
+    """Yield the pages of a stored file that have text, using the extractor ``extract``.
+
+    ``known`` is passed on to the extractor.
+    """
+    with local_path(field_file) as path:
+        for page in extract(path, known):
+            # Pages OCR failed on are kept, so the failure is on record
+            if page['text'] or page['same_as'] is not None or page['method'] == 'ocr-failed':
+                yield page
@@ -0,0 +1,148 @@
+"""Extraction results cached by file content.
+
+An ``ExtractedFile`` holds the pages an extractor produced for the file with
+a given SHA-256, keyed by ``Extractor.key`` so bumping an extractor's version
+(or changing the OCR languages) stops old entries from being used. The
+extraction job copies cached pages instead of parsing a file it has seen
+before, under any document, and fills the cache as it extracts new files.
+The ``extraction_cache`` command pre-warms and prunes it.
+"""
+import logging
+from datetime import timedelta
+from itertools import islice
+
+from django.conf import settings
+from django.db.models import Q
+from django.utils import timezone
+
+from .deltas import materialize
+from .extraction import all_extractors, get_extractor, iter_file_pages
+from .models import DocumentVersion, ExtractedFile, ExtractedPage
+
+logger = logging.getLogger(__name__)
+
+
+def enabled():
+    return getattr(settings, 'DOCUMENT_EXTRACTION_CACHE', True)
+
+
+def lookup(sha256, key):
+    """Return the complete entry for a file's extraction, marking it used, or None"""
+    if not sha256 or not enabled():
+        return None
+    entry = ExtractedFile.objects.filter(sha256=sha256, extractor=key, complete=True).first()
+    if entry is not None:
+        ExtractedFile.objects.filter(pk=entry.pk).update(last_used_at=timezone.now())
+    return entry
+
+
+def cached_pages(entry):
+    """Page dicts (see ``extraction``) for an entry's pages, read from the database in chunks"""
+    pages = entry.pages.order_by('page_number').values_list('page_number', 'text', 'hash')
+    for number, text, fingerprint in pages.iterator(chunk_size=getattr(settings, 'DOCUMENT_EXTRACTION_BATCH_PAGES', 200)):
+        yield {"page": number, "text": text, "hash": fingerprint, "same_as": None, "method": "reused", "seconds": 0.0}
+
+
+class CacheWriter:
+    """Adds pages to a new entry as they are extracted; the entry is used once ``finish`` is called"""
+
+    def __init__(self, entry):
+        self.entry = entry
+        self.page_count = 0
+
+    def add(self, pages):
+        ExtractedPage.objects.bulk_create([
+            ExtractedPage(
+                file=self.entry,
+                page_number=page['page'],
+                text=page['text'],
+                hash=page['hash'] or '',
+                method=page['method'],
+                extraction_ms=round(page['seconds'] * 1000, 3),
+            )
+            for page in pages
+        ])
+        self.page_count += len(pages)
+
+    def finish(self):
+        ExtractedFile.objects.filter(pk=self.entry.pk).update(
+            complete=True, page_count=self.page_count, last_used_at=timezone.now()
+        )
+
+    def discard(self):
+        self.entry.delete()
+
+
+def writer(sha256, key):
+    """Return a ``CacheWriter`` for a file's extraction, or None.
+
+    None when the cache is off or the entry already exists, either complete
+    or still being written by another job (or left by one that crashed, until
+    ``prune`` removes it).
+    """
+    if not sha256 or not enabled():
+        return None
+    entry, created = ExtractedFile.objects.get_or_create(sha256=sha256, extractor=key)
+    return CacheWriter(entry) if created else None
+
+
+def prewarm(limit=None):
+    """Extract the files of stored versions that have no cache entry yet.
+
+    Returns ``(files, pages, failed)``. Each distinct file is read once, however
+    many versions share it; failures, including pages OCR failed on, are
+    logged and left uncached.
+    """
+    batch_size = getattr(settings, 'DOCUMENT_EXTRACTION_BATCH_PAGES', 200)
+    seen = set()
+    files = pages = failed = 0
+    versions = DocumentVersion.objects.exclude(sha256='').select_related('document').order_by('-created_at')
+    for version in versions.iterator():
+        if limit is not None and files >= limit:
+            break
+        extraction = get_extractor(version.document.file_type, version.file.name)
+        if version.sha256 in seen or extraction is None:
+            continue
+        seen.add(version.sha256)
+        cache = writer(version.sha256, extraction.key)
+        if cache is None:
+            continue
+        page_texts = iter_file_pages(materialize(version.file), extraction.extract)
+        complete = True
+        try:
+            while batch := list(islice(page_texts, batch_size)):
+                cache.add(batch)
+                complete = complete and all(page['method'] != 'ocr-failed' for page in batch)
+        except Exception:
+            logger.exception("Couldn't extract %s for the extraction cache", version.file.name)
+            complete = False
+        if not complete:
+            cache.discard()
+            failed += 1
+            continue
+        cache.finish()
+        files += 1
+        pages += cache.page_count
+    return files, pages, failed
+
+
+def prune(max_age=None, incomplete_age=timedelta(days=1)):
+    """Delete cache entries that can't or needn't be used any more; return how many.
+
+    That is entries of extractor versions that are no longer registered,
+    unfinished entries older than ``incomplete_age`` (their job died), and
+    entries of files no version references that weren't used for ``max_age``.
+    """
+    if max_age is None:
+        max_age = timedelta(seconds=getattr(settings, 'DOCUMENT_EXTRACTION_CACHE_MAX_AGE', 30 * 24 * 60 * 60))
+    # Any OCR suffix of a key depends on the host; only the extractor version decides
+    current = Q()
+    for extraction in all_extractors():
+        current |= Q(extractor=extraction.version_key) | Q(extractor__startswith=extraction.version_key + '+')
+    now = timezone.now()
+    _, deleted = ExtractedFile.objects.filter(
+        ~current
+        | Q(complete=False, created_at__lt=now - incomplete_age)
+        | Q(last_used_at__lt=now - max_age) & ~Q(sha256__in=DocumentVersion.objects.values('sha256'))
+    ).delete()
+    return deleted.get('documents.ExtractedFile', 0)
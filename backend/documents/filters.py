@@ -0,0 +1,59 @@
+from django.db.models import Q
+from django.db.models.expressions import RawSQL
+from rest_framework import filters
+from rest_framework.exceptions import ValidationError
+
+from .search_index import get_index
+
+
+class FullTextSearchFilter(filters.SearchFilter):
+    """``?search=`` over document names and, through the full-text index, page text"""
+
+    def filter_queryset(self, request, queryset, view):
+        query = request.query_params.get(self.search_param, '').strip()
+        if not query:
+            return queryset
+
+        sql, params = get_index().document_ids_sql(query, request.user.id)
+        return queryset.filter(Q(name__icontains=query) | Q(id__in=RawSQL(sql, params)))
+
+
+class AnnotationViewportFilter(filters.BaseFilterBackend):
+    """Limit annotations to what a viewer has on screen.
+
+    ``?page=`` or ``?start=``/``?end=`` (inclusive) select pages, and
+    ``?bbox=x1,y1,x2,y2`` keeps annotations positioned inside the box. Both
+    are served by the (document, page, position_x, position_y) index.
+    """
+
+    def _page(self, request, name):
+        value = request.query_params.get(name)
+        if value is None:
+            return None
+        try:
+            return int(value)
+        except ValueError:
+            raise ValidationError({name: "Must be a page number"})
+
+    def filter_queryset(self, request, queryset, view):
+        page = self._page(request, 'page')
+        start = self._page(request, 'start')
+        end = self._page(request, 'end')
+        if page is not None:
+            queryset = queryset.filter(page=page)
+        if start is not None:
+            queryset = queryset.filter(page__gte=start)
+        if end is not None:
+            queryset = queryset.filter(page__lte=end)
+
+        bbox = request.query_params.get('bbox')
+        if bbox:
+            try:
+                x1, y1, x2, y2 = (float(value) for value in bbox.split(','))
+            except ValueError:
+                raise ValidationError({'bbox': "Expected x1,y1,x2,y2"})
+            queryset = queryset.filter(
+                position_x__range=(min(x1, x2), max(x1, x2)),
+                position_y__range=(min(y1, y2), max(y1, y2)),
+            )
+        return queryset
@@ -0,0 +1,157 @@
+"""Pluggable background job queue.
+
+Tasks are plain functions registered with the ``task`` decorator and queued
+with ``enqueue``. The backend is chosen by the ``DOCUMENT_JOB_QUEUE`` setting;
+the default ``DatabaseJobQueue`` stores jobs in the ``Job`` table and needs no
+outside broker, they are run by ``manage.py process_jobs``.
+"""
+import traceback
+from datetime import timedelta
+
+from django.conf import settings
+from django.db.models import Q
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from .models import Job
+
+_tasks = {}
+
+
+def task(name, on_failure=None):
+    """Register a function as a background task.
+
+    ``on_failure(payload, exc)`` is called once the task has used up all of its
+    attempts.
+    """
+    def decorator(func):
+        _tasks[name] = (func, on_failure)
+        return func
+    return decorator
+
+
+def get_task(name):
+    if name not in _tasks:
+        raise KeyError(f"Unknown background task: {name}")
+    return _tasks[name]
+
+
+def retry_delay(attempts):
+    """Return the backoff before the next attempt, doubling after each failure"""
+    base = getattr(settings, 'DOCUMENT_JOB_RETRY_BACKOFF', 30)
+    cap = getattr(settings, 'DOCUMENT_JOB_RETRY_BACKOFF_MAX', 3600)
+    return timedelta(seconds=min(cap, base * 2 ** max(attempts - 1, 0)))
+
+
+class BaseJobQueue:
+    def enqueue(self, task_name, **payload):
+        raise NotImplementedError
+
+    def enqueue_many(self, task_name, payloads):
+        """Queue one job per payload"""
+        for payload in payloads:
+            self.enqueue(task_name, **payload)
+
+    def work(self, batch_size=10):
+        """Run up to ``batch_size`` due jobs and return how many were run"""
+        return 0
+
+
+class ImmediateJobQueue(BaseJobQueue):
+    """Run tasks inline in the calling process; meant for tests and development"""
+
+    def enqueue(self, task_name, **payload):
+        func, on_failure = get_task(task_name)
+        try:
+            func(**payload)
+        except Exception as e:
+            if on_failure:
+                on_failure(payload, e)
+            else:
+                raise
+
+
+class DatabaseJobQueue(BaseJobQueue):
+    """Store jobs in the ``Job`` table and run them from a worker process"""
+
+    def enqueue(self, task_name, **payload):
+        get_task(task_name)
+        return Job.objects.create(
+            task=task_name,
+            payload=payload,
+            max_attempts=getattr(settings, 'DOCUMENT_JOB_MAX_ATTEMPTS', 5),
+        )
+
+    def enqueue_many(self, task_name, payloads):
+        get_task(task_name)
+        max_attempts = getattr(settings, 'DOCUMENT_JOB_MAX_ATTEMPTS', 5)
+        return Job.objects.bulk_create([
+            Job(task=task_name, payload=payload, max_attempts=max_attempts)
+            for payload in payloads
+        ], batch_size=500)
+
+    def _claimable(self, now):
+        lock_timeout = getattr(settings, 'DOCUMENT_JOB_LOCK_TIMEOUT', 600)
+        # Jobs left running by a worker that died are picked up again once stale
+        return Job.objects.filter(
+            Q(status='queued', run_after__lte=now) |
+            Q(status='running', locked_at__lt=now - timedelta(seconds=lock_timeout))
+        )
+
+    def claim(self, batch_size):
+        now = timezone.now()
+        claimed = []
+        for job in self._claimable(now)[:batch_size]:
+            # The conditional update makes sure only one worker wins each job,
+            # without relying on SELECT ... FOR UPDATE, which SQLite lacks
+            won = self._claimable(now).filter(pk=job.pk).update(
+                status='running', locked_at=now, updated_at=now
+            )
+            if won:
+                job.status = 'running'
+                job.locked_at = now
+                claimed.append(job)
+        return claimed
+
+    def run_job(self, job):
+        job.attempts += 1
+        on_failure = None
+        try:
+            func, on_failure = get_task(job.task)
+            func(**job.payload)
+        except Exception as e:
+            job.last_error = traceback.format_exc()
+            if job.attempts >= job.max_attempts:
+                job.status = 'failed'
+                if on_failure:
+                    on_failure(job.payload, e)
+            else:
+                job.status = 'queued'
+                job.run_after = timezone.now() + retry_delay(job.attempts)
+        else:
+            job.status = 'completed'
+            job.last_error = ''
+        job.locked_at = None
+        job.save()
+        return job
+
+    def work(self, batch_size=10):
+        jobs = self.claim(batch_size)
+        for job in jobs:
+            self.run_job(job)
+        return len(jobs)
+
+
+def get_queue():
+    backend = getattr(settings, 'DOCUMENT_JOB_QUEUE', 'documents.jobs.DatabaseJobQueue')
+    return import_string(backend)()
+
+
+def enqueue(task_name, **payload):
+    """Queue ``task_name`` on the configured backend"""
+    return get_queue().enqueue(task_name, **payload)
+
+
+def enqueue_many(task_name, payloads):
+    """Queue ``task_name`` once per payload dict, in bulk where the backend supports it"""
+    return get_queue().enqueue_many(task_name, payloads)
@@ -0,0 +1,71 @@
+"""Synthetic document fixtures shared by the benchmark commands"""
+import random
+import zlib
+
+WORDS = (
+    'agreement party term payment invoice clause schedule notice liability '
+    'contract period renewal delivery service warranty confidential annex '
+    'section amendment signature obligation termination effective date'
+).split()
+
+
+def fake_page_text(page_number, words=250, seed=0):
+    """Return deterministic pseudo-contract text for one page"""
+    rng = random.Random(seed * 100003 + page_number)
+    return ' '.join(rng.choice(WORDS) for _ in range(words))
+
+
+def revise_text(text, revision):
+    """``text`` (paragraphs separated by blank lines) with one paragraph rewritten and one added"""
+    paragraphs = text.split('\n\n')
+    paragraphs[revision % len(paragraphs)] = fake_page_text(revision, 60, seed=revision + 100)
+    paragraphs.append(f'Revision {revision} notes. ' + fake_page_text(revision, 20, seed=revision + 200))
+    return '\n\n'.join(paragraphs)
+
+
+def build_text_pdf(page_count, words_per_page=250, seed=0, page_seeds=None, compress=False):
+    """Build a PDF with a real text layer on every page and return its bytes.
+
+    PyPDF2 cannot write text, so the file is assembled by hand: one Helvetica
+    font shared by every page and one content stream per page, eight words
+    per line. ``page_seeds`` gives every page its own seed, so revisions can
+    change single pages; ``compress`` deflates the content streams, as most
+    PDF writers do.
+    """
+    objects = {
+        1: b'<< /Type /Catalog /Pages 2 0 R >>',
+        3: b'<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>',
+    }
+    kids = []
+    for page_index in range(page_count):
+        page_id = 4 + page_index * 2
+        content_id = page_id + 1
+        page_seed = page_seeds[page_index] if page_seeds else seed
+        words = fake_page_text(page_index + 1, words_per_page, page_seed).split()
+        lines = [' '.join(words[i:i + 8]) for i in range(0, len(words), 8)]
+        stream = 'BT /F1 10 Tf 14 TL 40 800 Td\n' + ''.join(f'({line}) Tj T*\n' for line in lines) + 'ET'
+        stream = stream.encode('latin-1')
+        stream_filter = b''
+        if compress:
+            stream = zlib.compress(stream)
+            stream_filter = b' /Filter /FlateDecode'
+        objects[page_id] = (
+            f'<< /Type /Page /Parent 2 0 R /MediaBox [0 0 595 842] '
+            f'/Resources << /Font << /F1 3 0 R >> >> /Contents {content_id} 0 R >>'
+        ).encode()
+        objects[content_id] = b'<< /Length %d%s >>\nstream\n%s\nendstream' % (len(stream), stream_filter, stream)
+        kids.append(f'{page_id} 0 R')
+    objects[2] = f'<< /Type /Pages /Kids [{" ".join(kids)}] /Count {page_count} >>'.encode()
+
+    out = bytearray(b'%PDF-1.4\n')
+    offsets = {}
+    for obj_id in sorted(objects):
+        offsets[obj_id] = len(out)
+        out += b'%d 0 obj\n%s\nendobj\n' % (obj_id, objects[obj_id])
+    xref_offset = len(out)
+    size = max(objects) + 1
+    out += b'xref\n0 %d\n0000000000 65535 f \n' % size
+    for obj_id in range(1, size):
+        out += b'%010d 00000 n \n' % offsets[obj_id]
+    out += b'trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n' % (size, xref_offset)
+    return bytes(out)
@@ -0,0 +1,65 @@
+import base64
+import time
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test import RequestFactory
+from django.test.utils import CaptureQueriesContext
+from rest_framework.authentication import BasicAuthentication, SessionAuthentication, TokenAuthentication
+from rest_framework.authtoken.models import Token
+from rest_framework.request import Request
+
+from documents.authentication import CachedTokenAuthentication, token_cache
+
+DEFAULT_CHAIN = (TokenAuthentication, SessionAuthentication, BasicAuthentication)
+CACHED_CHAIN = (CachedTokenAuthentication, SessionAuthentication, BasicAuthentication)
+TOKEN_ONLY = (CachedTokenAuthentication,)
+
+
+class Command(BaseCommand):
+    help = ('Measure the per-request cost of authenticating an API request with each '
+            'authentication setup. Runs against a throwaway test database.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--iterations', type=int, default=2000)
+        parser.add_argument('--basic-iterations', type=int, default=20,
+                            help='Iterations for Basic auth, which hashes the password every time')
+
+    def _measure(self, authenticators, headers, iterations):
+        """Mean microseconds to resolve ``request.user`` through ``authenticators``"""
+        factory = RequestFactory()
+        requests = [factory.get('/api/documents/', headers=headers) for _ in range(iterations)]
+        start = time.perf_counter()
+        for request in requests:
+            user = Request(request, authenticators=[cls() for cls in authenticators]).user
+        elapsed = time.perf_counter() - start
+        assert user.is_authenticated
+        return elapsed / iterations * 1e6
+
+    def handle(self, *args, **options):
+        old_name = connection.settings_dict['NAME']
+        connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+        try:
+            user = User.objects.create_user('benchmark', password='benchmark-password')
+            token = Token.objects.create(user=user)
+            bearer = {'Authorization': f'Token {token.key}'}
+            basic = {'Authorization': 'Basic ' + base64.b64encode(b'benchmark:benchmark-password').decode()}
+            iterations = options['iterations']
+
+            token_cache.clear()
+            cases = [
+                ('token, DRF default chain', DEFAULT_CHAIN, bearer, iterations),
+                ('token, cached chain', CACHED_CHAIN, bearer, iterations),
+                ('token, token-only chain', TOKEN_ONLY, bearer, iterations),
+                ('basic, default chain', DEFAULT_CHAIN, basic, options['basic_iterations']),
+            ]
+            self.stdout.write(f"{'authentication':>26} {'us/request':>11} {'queries':>8}")
+            for label, authenticators, headers, count in cases:
+                self._measure(authenticators, headers, 1)
+                cost = self._measure(authenticators, headers, count)
+                with CaptureQueriesContext(connection) as queries:
+                    self._measure(authenticators, headers, 1)
+                self.stdout.write(f"{label:>26} {cost:>11.1f} {len(queries):>8}")
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
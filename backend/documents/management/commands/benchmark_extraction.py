@@ -0,0 +1,122 @@
+import io
+import os
+import tempfile
+import time
+import tracemalloc
+from itertools import islice
+
+import PyPDF2
+from django.core.files.storage import FileSystemStorage
+from django.core.management.base import BaseCommand
+from django.db.models.fields.files import FieldFile
+
+from documents.extraction import (
+    extract_pdf, extract_pdf_pages, extract_pdf_pages_parallel, get_extraction_pool, iter_file_pages,
+)
+from documents.models import DocumentVersion
+
+from ._fixtures import build_text_pdf
+
+
+class Command(BaseCommand):
+    help = ('Compare serial and process-pool PDF text extraction throughput (pages/sec), '
+            'or with --memory the peak memory of whole-file and streaming extraction')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--pages', type=int, nargs='+', default=[10, 100, 1000],
+                            help='Page counts of the generated fixtures')
+        parser.add_argument('--workers', type=int, default=os.cpu_count() or 2,
+                            help='Process pool size for the parallel path')
+        parser.add_argument('--pages-per-task', type=int, default=25)
+        parser.add_argument('--repeat', type=int, default=3,
+                            help='Runs per measurement; the best one is reported')
+        parser.add_argument('--memory', action='store_true',
+                            help='Report peak traced memory (tracemalloc) instead of throughput. '
+                                 'Tracing slows extraction down considerably, so use fewer pages')
+        parser.add_argument('--batch-size', type=int, default=200,
+                            help='Pages consumed per batch by the streaming path, as the extraction job does')
+
+    def _best_of(self, repeat, func):
+        best = None
+        for _ in range(repeat):
+            start = time.perf_counter()
+            result = func()
+            elapsed = time.perf_counter() - start
+            best = elapsed if best is None else min(best, elapsed)
+        return best, result
+
+    def _peak_memory(self, func):
+        """Peak bytes allocated by Python while ``func`` runs"""
+        tracemalloc.start()
+        try:
+            func()
+            return tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+
+    def _whole_file(self, path):
+        # What extraction did before it streamed: read the file into memory,
+        # parse every page and build the joined text
+        with open(path, 'rb') as f:
+            pdf_reader = PyPDF2.PdfReader(io.BytesIO(f.read()))
+        page_texts = [page.extract_text() for page in pdf_reader.pages]
+        return ''.join(page_texts)
+
+    def _streaming(self, path, batch_size):
+        # A stored version's file, consumed in batches like the extraction job does
+        field_file = FieldFile(None, DocumentVersion._meta.get_field('file'), os.path.basename(path))
+        field_file.storage = FileSystemStorage(location=os.path.dirname(path))
+        pages = iter_file_pages(field_file, extract_pdf)
+        while list(islice(pages, batch_size)):
+            pass
+
+    def _memory(self, options):
+        mb = 1024 * 1024
+        self.stdout.write(f"{'pages':>6} {'file MB':>8} {'whole-file MB':>14} {'streaming MB':>13}")
+        for page_count in options['pages']:
+            with tempfile.NamedTemporaryFile(suffix='.pdf', delete=False) as f:
+                f.write(build_text_pdf(page_count))
+            try:
+                size = os.path.getsize(f.name)
+                whole = self._peak_memory(lambda: self._whole_file(f.name))
+                streaming = self._peak_memory(lambda: self._streaming(f.name, options['batch_size']))
+            finally:
+                os.unlink(f.name)
+            self.stdout.write(f"{page_count:>6} {size / mb:>8.1f} {whole / mb:>14.1f} {streaming / mb:>13.1f}")
+
+    def handle(self, *args, **options):
+        if options['memory']:
+            return self._memory(options)
+
+        workers = options['workers']
+        # Start the pool up front so process spawn time isn't charged to the first fixture
+        pool = get_extraction_pool(workers)
+        list(pool.map(abs, range(workers)))
+
+        self.stdout.write(f"{'pages':>6} {'serial p/s':>12} {'parallel p/s':>13} {'speedup':>8}")
+        for page_count in options['pages']:
+            content = build_text_pdf(page_count)
+            with tempfile.NamedTemporaryFile(suffix='.pdf', delete=False) as f:
+                f.write(content)
+            try:
+                serial_time, serial_pages = self._best_of(
+                    options['repeat'], lambda: extract_pdf_pages(content)
+                )
+                parallel_time, parallel_pages = self._best_of(
+                    options['repeat'],
+                    lambda: list(extract_pdf_pages_parallel(
+                        f.name, workers=workers, pages_per_task=options['pages_per_task']
+                    )),
+                )
+            finally:
+                os.unlink(f.name)
+
+            # Timings differ from run to run; compare the text
+            serial_pages = [(page['page'], page['text']) for page in serial_pages]
+            parallel_pages = [(page['page'], page['text']) for page in parallel_pages if page['text']]
+            if serial_pages != parallel_pages:
+                self.stderr.write(f"Parallel output differs from serial for {page_count} pages")
+            self.stdout.write(
+                f"{page_count:>6} {page_count / serial_time:>12.1f} "
+                f"{page_count / parallel_time:>13.1f} {serial_time / parallel_time:>7.2f}x"
+            )
@@ -0,0 +1,102 @@
+import time
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.db.models import Q
+from django.db.models.expressions import RawSQL
+
+from documents.models import Document, DocumentPage, DocumentVersion
+from documents.search_index import get_index, search_library
+
+from ._fixtures import fake_page_text
+
+RARE_TERM = 'zephyrine'
+
+
+class Command(BaseCommand):
+    help = ('Compare library search through the full-text index against the old '
+            'icontains filter. Runs against a throwaway test database.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--documents', type=int, nargs='+', default=[10000, 100000])
+        parser.add_argument('--pages-per-document', type=int, default=2)
+        parser.add_argument('--words-per-page', type=int, default=120)
+        parser.add_argument('--repeat', type=int, default=3,
+                            help='Runs per measurement; the best one is reported')
+
+    def _best_of(self, repeat, func):
+        best = None
+        for _ in range(repeat):
+            start = time.perf_counter()
+            func()
+            elapsed = time.perf_counter() - start
+            best = elapsed if best is None else min(best, elapsed)
+        return best * 1000
+
+    def _populate(self, owner, start, stop, options):
+        batch_size = 2000
+        for batch_start in range(start, stop, batch_size):
+            batch_stop = min(batch_start + batch_size, stop)
+            documents = Document.objects.bulk_create([
+                Document(name=f'Contract {i}', file=f'documents/contract-{i}.pdf',
+                         file_type='pdf', owner=owner, extraction_status='completed')
+                for i in range(batch_start, batch_stop)
+            ])
+            # Library search only matches pages of the current version
+            versions = DocumentVersion.objects.bulk_create([
+                DocumentVersion(document=document, version_number=1, file=document.file.name,
+                                created_by=owner, extraction_status='completed')
+                for document in documents
+            ])
+            for document, version in zip(documents, versions):
+                document.current_version = version
+            Document.objects.bulk_update(documents, ['current_version'])
+            pages = []
+            for i, document in zip(range(batch_start, batch_stop), documents):
+                for page_number in range(1, options['pages_per_document'] + 1):
+                    text = fake_page_text(page_number, options['words_per_page'], seed=i)
+                    # One page in a thousand carries a rare term
+                    if (i * options['pages_per_document'] + page_number) % 1000 == 0:
+                        text += f' {RARE_TERM}'
+                    pages.append(DocumentPage(document=document, version=document.current_version,
+                                              page_number=page_number, text=text))
+            DocumentPage.objects.bulk_create(pages, batch_size=batch_size)
+
+    def _old_filter(self, owner, query):
+        # What SearchFilter(search_fields=['name', 'text_content']) did, on page rows
+        documents = Document.objects.filter(owner=owner).filter(
+            Q(name__icontains=query) | Q(pages__text__icontains=query)
+        ).distinct()
+        documents.count()
+        list(documents.order_by('-created_at')[:10])
+
+    def _index_filter(self, owner, query):
+        sql, params = get_index().document_ids_sql(query, owner.id)
+        documents = Document.objects.filter(owner=owner).filter(
+            Q(name__icontains=query) | Q(id__in=RawSQL(sql, params))
+        )
+        documents.count()
+        list(documents.order_by('-created_at')[:10])
+
+    def handle(self, *args, **options):
+        old_name = connection.settings_dict['NAME']
+        connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+        try:
+            owner = User.objects.create_user('benchmark')
+            populated = 0
+            self.stdout.write(f"index backend: {type(get_index()).__name__}")
+            self.stdout.write(
+                f"{'documents':>10} {'query':>16} {'old filter ms':>14} "
+                f"{'index filter ms':>16} {'ranked ms':>10}"
+            )
+            for size in sorted(options['documents']):
+                self._populate(owner, populated, size, options)
+                populated = size
+                for query in (RARE_TERM, 'invoice', 'renewal notice'):
+                    old = self._best_of(options['repeat'], lambda: self._old_filter(owner, query))
+                    new = self._best_of(options['repeat'], lambda: self._index_filter(owner, query))
+                    ranked = self._best_of(options['repeat'], lambda: search_library(query, owner.id, limit=10))
+                    self.stdout.write(f"{size:>10} {query:>16} {old:>14.1f} {new:>16.1f} {ranked:>10.1f}")
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
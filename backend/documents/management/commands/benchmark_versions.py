@@ -0,0 +1,123 @@
+import random
+import shutil
+import statistics
+import tempfile
+import time
+
+from django.core.files.base import ContentFile
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test import override_settings
+
+from documents.blobstore import store
+from documents.deltas import encode_blob, get_cache, materialize
+
+from ._fixtures import build_text_pdf, fake_page_text, revise_text
+
+
+class Command(BaseCommand):
+    help = ('Store a synthetic revision history in full and as deltas, and report the storage '
+            'ratio and download latency of each. Runs against a throwaway test database.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--documents', type=int, default=10,
+                            help='Documents per kind (PDF, text)')
+        parser.add_argument('--revisions', type=int, default=30,
+                            help='Versions per document')
+        parser.add_argument('--pages', type=int, default=40,
+                            help='Pages of the first version of each PDF')
+        parser.add_argument('--snapshot-interval', type=int, default=10)
+
+    def _pdf_history(self, index, options):
+        # Each revision rewrites one page; every fifth one adds a page
+        rng = random.Random(index)
+        page_seeds = [index * 1000 + page for page in range(options['pages'])]
+        for revision in range(options['revisions']):
+            if revision:
+                page_seeds[rng.randrange(len(page_seeds))] = rng.randrange(10 ** 9)
+                if revision % 5 == 0:
+                    page_seeds.append(rng.randrange(10 ** 9))
+            yield 'pdf', build_text_pdf(len(page_seeds), page_seeds=page_seeds, compress=True)
+
+    def _text_history(self, index, options):
+        text = '\n\n'.join(fake_page_text(number, 120, seed=index) for number in range(1, 60))
+        for revision in range(options['revisions']):
+            if revision:
+                text = revise_text(text, revision)
+            yield 'md', text.encode()
+
+    def _read(self, field_file):
+        start = time.perf_counter()
+        with field_file.storage.open(field_file.name, 'rb') as f:
+            while f.read(64 * 1024):
+                pass
+        return (time.perf_counter() - start) * 1000
+
+    def _download(self, blob):
+        # What a download does: find the stored file (rebuilding it if needed), then stream it
+        start = time.perf_counter()
+        self._read(materialize(blob.file))
+        return (time.perf_counter() - start) * 1000
+
+    def _run(self, kind, histories):
+        chains = []
+        for history in histories:
+            chains.append([store(ContentFile(content, name=f'revision.{ext}')) for ext, content in history])
+        blobs = [blob for chain in chains for blob in chain]
+        full_bytes = sum(blob.size for blob in blobs)
+        full_ms = [self._download(blob) for blob in blobs]
+
+        start = time.perf_counter()
+        encoded = 0
+        for chain in chains:
+            # As the delta_encode_version job does after each upload: the
+            # newest version stays whole
+            for previous, blob in zip(chain, chain[1:-1]):
+                blob.refresh_from_db()
+                previous.refresh_from_db()
+                encoded += 1
+                encode_blob(blob, previous)
+        encode_ms = (time.perf_counter() - start) * 1000 / max(encoded, 1)
+        for blob in blobs:
+            blob.refresh_from_db()
+        stored_bytes = sum(blob.stored_size for blob in blobs)
+
+        # Downloads of superseded versions; the newest ones cost the same as before
+        older = [blob for chain in chains for blob in chain[:-1]]
+        cold_ms = []
+        for blob in older:
+            # Rebuilt from the nearest snapshot, however many deltas that takes
+            shutil.rmtree(get_cache().directory, ignore_errors=True)
+            cold_ms.append(self._download(blob))
+        for blob in older:
+            materialize(blob.file)
+        warm_ms = [self._download(blob) for blob in older]
+
+        def summary(timings):
+            return f"{statistics.median(timings):>6.2f} {sorted(timings)[int(len(timings) * 0.95)]:>6.2f}"
+
+        mb = 1024 * 1024
+        self.stdout.write(
+            f"{kind:>5} {len(blobs):>8} {full_bytes / mb:>8.1f} {stored_bytes / mb:>9.2f} "
+            f"{full_bytes / stored_bytes:>6.1f}x {encode_ms:>9.1f}  "
+            f"{summary(full_ms)}  {summary(cold_ms)}  {summary(warm_ms)}"
+        )
+
+    def handle(self, *args, **options):
+        old_name = connection.settings_dict['NAME']
+        connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+        media_root = tempfile.mkdtemp()
+        cache_dir = tempfile.mkdtemp()
+        try:
+            with override_settings(MEDIA_ROOT=media_root, DOCUMENT_DELTA_CACHE_DIR=cache_dir,
+                                   DOCUMENT_DELTA_SNAPSHOT_INTERVAL=options['snapshot_interval']):
+                self.stdout.write(
+                    f"{'kind':>5} {'versions':>8} {'full MB':>8} {'stored MB':>9} {'ratio':>7} {'encode ms':>9}  "
+                    f"{'full p50/p95 ms':>13}  {'cold p50/p95 ms':>13}  {'cached p50/p95 ms':>13}"
+                )
+                self._run('pdf', [self._pdf_history(i, options) for i in range(options['documents'])])
+                self._run('text', [self._text_history(i, options) for i in range(options['documents'])])
+        finally:
+            shutil.rmtree(media_root, ignore_errors=True)
+            shutil.rmtree(cache_dir, ignore_errors=True)
+            connection.creation.destroy_test_db(old_name, verbosity=0)
@@ -0,0 +1,51 @@
+from itertools import groupby
+from operator import itemgetter
+
+from django.core.management.base import BaseCommand
+from django.db.models import Sum
+from django.template.defaultfilters import filesizeformat
+
+from documents.deltas import encode_blob
+from documents.models import Blob, DocumentVersion
+
+
+class Command(BaseCommand):
+    help = ('Store the files of existing versions (but the newest of each document) as deltas '
+            'against their predecessors, as DOCUMENT_VERSION_DELTAS does for new uploads, '
+            'and report the storage used')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--report', action='store_true',
+                            help='Only report the storage used by blobs in full and as deltas')
+
+    def _totals(self):
+        totals = Blob.objects.aggregate(size=Sum('size'))
+        totals.update(Blob.objects.filter(base=None).aggregate(full=Sum('size')))
+        totals.update(Blob.objects.exclude(base=None).aggregate(deltas=Sum('delta_size')))
+        return {name: value or 0 for name, value in totals.items()}
+
+    def handle(self, *args, **options):
+        if not options['report']:
+            encoded = 0
+            versions = DocumentVersion.objects.order_by('document_id', 'version_number').values_list(
+                'document_id', 'file'
+            )
+            for _, rows in groupby(versions.iterator(), key=itemgetter(0)):
+                names = [name for _, name in rows]
+                # Every version but the newest, each against the one before it
+                for base_name, name in zip(names, names[1:-1]):
+                    # Rows change as blobs are encoded, so read them fresh
+                    blob = Blob.objects.filter(file=name).first()
+                    base = Blob.objects.filter(file=base_name).first()
+                    if blob is not None and base is not None and encode_blob(blob, base):
+                        encoded += 1
+            self.stdout.write(f"Stored {encoded} version file(s) as deltas")
+
+        totals = self._totals()
+        stored = totals['full'] + totals['deltas']
+        self.stdout.write(f"Content:      {filesizeformat(totals['size'])}")
+        self.stdout.write(f"Stored full:  {filesizeformat(totals['full'])}")
+        self.stdout.write(f"Stored delta: {filesizeformat(totals['deltas'])}")
+        self.stdout.write(self.style.SUCCESS(
+            f"Storage ratio {totals['size'] / stored:.1f}x" if stored else "Nothing stored"
+        ))
@@ -0,0 +1,107 @@
+import os
+
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.template.defaultfilters import filesizeformat
+
+from documents.blobstore import blob_name, hash_file, store
+from documents.models import Blob, Document, DocumentVersion
+
+
+LEGACY_DIRS = ('documents', 'document_versions')
+
+
+def walk_storage(path):
+    """Yield every file name below ``path`` in the default storage"""
+    if not default_storage.exists(path):
+        return
+    dirs, files = default_storage.listdir(path)
+    for name in files:
+        yield f'{path}/{name}'
+    for name in dirs:
+        yield from walk_storage(f'{path}/{name}')
+
+
+class Command(BaseCommand):
+    help = ('Move document and version files into the content-addressed blob store, '
+            'sharing identical files, and report the bytes saved')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true',
+                            help='Only report what would be deduplicated')
+        parser.add_argument('--keep-originals', action='store_true',
+                            help="Don't delete the old files after repointing rows at blobs")
+        parser.add_argument('--prune-orphans', action='store_true',
+                            help='Also delete files under the legacy upload directories that no row references')
+
+    def handle(self, *args, **options):
+        dry_run = options['dry_run']
+        rows = [
+            (model, pk, name)
+            for model in (Document, DocumentVersion)
+            for pk, name in model.objects.exclude(file='').exclude(file__startswith='blobs/').values_list('pk', 'file')
+        ]
+
+        # Hash every distinct legacy file once
+        hashes = {}
+        missing = set()
+        for _, _, name in rows:
+            if name in hashes or name in missing:
+                continue
+            if not default_storage.exists(name):
+                missing.add(name)
+                self.stderr.write(f"Missing file, skipped: {name}")
+                continue
+            with default_storage.open(name, 'rb') as f:
+                hashes[name] = hash_file(f)
+
+        bytes_before = sum(size for _, size in hashes.values())
+        already_stored = set(Blob.objects.filter(
+            sha256__in={sha256 for sha256, _ in hashes.values()}
+        ).values_list('sha256', flat=True))
+        unique = {sha256: size for sha256, size in hashes.values()}
+        bytes_after = sum(size for sha256, size in unique.items() if sha256 not in already_stored)
+
+        if not dry_run:
+            for model, pk, name in rows:
+                if name in missing:
+                    continue
+                sha256, size = hashes[name]
+                with transaction.atomic():
+                    with default_storage.open(name, 'rb') as f:
+                        # Keep the original name so the blob gets its extension
+                        f.name = name
+                        blob = store(f, sha256=sha256, size=size)
+                    fields = {'file': blob.file.name}
+                    if model is DocumentVersion:
+                        # Downloads keep the name the file had until now
+                        fields.update(sha256=sha256, original_name=os.path.basename(name)[:255])
+                    model.objects.filter(pk=pk).update(**fields)
+
+            if not options['keep_originals']:
+                for name in hashes:
+                    # Blob names never collide with legacy names, but be careful anyway
+                    if name != blob_name(hashes[name][0], name):
+                        default_storage.delete(name)
+
+        # Files left behind by earlier uploads that nothing points at
+        referenced = {name for _, _, name in rows}
+        orphans = [
+            name for directory in LEGACY_DIRS for name in walk_storage(directory)
+            if name not in referenced
+        ]
+        orphan_bytes = sum(default_storage.size(name) for name in orphans)
+        if options['prune_orphans'] and not dry_run:
+            for name in orphans:
+                default_storage.delete(name)
+
+        self.stdout.write(f"Rows pointing at legacy files: {len(rows)}")
+        self.stdout.write(f"Distinct legacy files:         {len(hashes)} ({filesizeformat(bytes_before)})")
+        self.stdout.write(f"Distinct contents:             {len(unique)} ({filesizeformat(bytes_after)} newly stored)")
+        self.stdout.write(f"Unreferenced legacy files:     {len(orphans)} ({filesizeformat(orphan_bytes)})"
+                          + (" deleted" if options['prune_orphans'] and not dry_run else ""))
+        self.stdout.write(self.style.SUCCESS(
+            f"{'Would save' if dry_run else 'Saved'} {filesizeformat(bytes_before - bytes_after)}"
+            + (" (originals kept)" if options['keep_originals'] and not dry_run else "")
+        ))
@@ -0,0 +1,18 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+
+from documents.uploads import expire_sessions
+
+
+class Command(BaseCommand):
+    help = 'Delete chunked upload sessions that have been idle too long, along with their partial files'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--max-age', type=int, default=None,
+                            help='Idle seconds before a session expires (default: DOCUMENT_UPLOAD_SESSION_TTL)')
+
+    def handle(self, *args, **options):
+        max_age = timedelta(seconds=options['max_age']) if options['max_age'] is not None else None
+        count = expire_sessions(max_age)
+        self.stdout.write(self.style.SUCCESS(f"Expired {count} upload session(s)"))
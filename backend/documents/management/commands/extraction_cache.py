@@ -0,0 +1,45 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Count, Sum
+
+from documents import extraction_cache
+from documents.models import ExtractedFile
+
+
+class Command(BaseCommand):
+    help = ('Pre-warm the extraction cache with the text of stored files, '
+            'or prune entries of old extractor versions and unused files')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--prewarm', action='store_true',
+                            help='Extract stored files whose text is not cached for the current extractors')
+        parser.add_argument('--limit', type=int, default=None,
+                            help='Extract at most this many files when pre-warming')
+        parser.add_argument('--prune', action='store_true',
+                            help='Delete entries of old extractor versions, unfinished entries and unused ones')
+        parser.add_argument('--max-age', type=int, default=None,
+                            help='Seconds after which entries of files no version references are pruned '
+                                 '(default: DOCUMENT_EXTRACTION_CACHE_MAX_AGE)')
+
+    def handle(self, *args, **options):
+        if not options['prewarm'] and not options['prune']:
+            raise CommandError('Pass --prewarm, --prune or both')
+
+        if options['prune']:
+            max_age = timedelta(seconds=options['max_age']) if options['max_age'] is not None else None
+            count = extraction_cache.prune(max_age)
+            self.stdout.write(f"Pruned {count} cache entr{'y' if count == 1 else 'ies'}")
+
+        if options['prewarm']:
+            if not extraction_cache.enabled():
+                raise CommandError('The extraction cache is off (DOCUMENT_EXTRACTION_CACHE)')
+            files, pages, failed = extraction_cache.prewarm(options['limit'])
+            self.stdout.write(f"Cached {files} file(s), {pages} page(s)")
+            if failed:
+                self.stderr.write(f"{failed} file(s) could not be extracted; see the log")
+
+        totals = ExtractedFile.objects.filter(complete=True).aggregate(files=Count('id'), pages=Sum('page_count'))
+        self.stdout.write(self.style.SUCCESS(
+            f"Extraction cache: {totals['files']} file(s), {totals['pages'] or 0} page(s)"
+        ))
@@ -0,0 +1,54 @@
+import os
+import zipfile
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.template.defaultfilters import filesizeformat
+
+from documents.bulk import import_entries, iter_directory, iter_zip
+
+
+class Command(BaseCommand):
+    help = ('Import every file in a directory or ZIP archive as a document, '
+            'deduplicating content and queueing text extraction for workers')
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='Directory or .zip file to import')
+        parser.add_argument('--owner', required=True, help='Username that will own the documents')
+        parser.add_argument('--batch-size', type=int, default=500,
+                            help='Files per database transaction')
+        parser.add_argument('--allow-duplicates', action='store_true',
+                            help='Import files even if the same content is already in the library')
+
+    def handle(self, *args, **options):
+        try:
+            owner = User.objects.get(username=options['owner'])
+        except User.DoesNotExist:
+            raise CommandError(f"No such user: {options['owner']}")
+
+        def progress(summary):
+            self.stdout.write(
+                f"{summary['files']} files read, {summary['imported']} imported "
+                f"({summary['files_per_second']} files/s)"
+            )
+
+        path = options['path']
+        kwargs = {
+            'batch_size': options['batch_size'],
+            'skip_duplicates': not options['allow_duplicates'],
+            'progress': progress,
+        }
+        if os.path.isdir(path):
+            summary = import_entries(owner, iter_directory(path), **kwargs)
+        elif zipfile.is_zipfile(path):
+            with zipfile.ZipFile(path) as archive:
+                summary = import_entries(owner, iter_zip(archive), **kwargs)
+        else:
+            raise CommandError(f"{path} is neither a directory nor a ZIP archive")
+
+        self.stdout.write(f"Files read:       {summary['files']} ({filesizeformat(summary['bytes'])})")
+        self.stdout.write(f"Duplicates:       {summary['duplicates']}")
+        self.stdout.write(self.style.SUCCESS(
+            f"Imported {summary['imported']} document(s) in {summary['seconds']:.1f}s "
+            f"({summary['files_per_second']} files/s)"
+        ))
@@ -0,0 +1,259 @@
+import asyncio
+import os
+import random
+import socket
+import subprocess
+import sys
+import time
+from collections import Counter
+from urllib.parse import urlsplit
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from rest_framework.authtoken.models import Token
+
+from documents.models import Annotation, Document, DocumentPage, DocumentVersion
+
+from ._fixtures import fake_page_text
+
+LOADTEST_USER = 'loadtest'
+ENDPOINTS = ('list', 'retrieve', 'versions', 'search')
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+async def read_response(reader):
+    """Read one HTTP/1.1 response; return ``(status, keep_alive)``"""
+    head = await reader.readuntil(b'\r\n\r\n')
+    lines = head.decode('latin-1').split('\r\n')
+    status = int(lines[0].split()[1])
+    headers = {}
+    for line in lines[1:]:
+        if ':' in line:
+            name, value = line.split(':', 1)
+            headers[name.strip().lower()] = value.strip()
+
+    if headers.get('transfer-encoding', '').lower() == 'chunked':
+        while True:
+            size = int((await reader.readline()).split(b';')[0], 16)
+            await reader.readexactly(size + 2)
+            if size == 0:
+                break
+    else:
+        await reader.readexactly(int(headers.get('content-length', 0)))
+    return status, headers.get('connection', '').lower() != 'close'
+
+
+async def exchange(reader, writer, host, path, token):
+    writer.write(
+        f'GET {path} HTTP/1.1\r\nHost: {host}\r\nAuthorization: Token {token}\r\n'
+        f'Accept: application/json\r\n\r\n'.encode()
+    )
+    return await read_response(reader)
+
+
+async def run_client(host, port, paths, token, measure_from, deadline, stats):
+    """Request ``paths`` in turn over one keep-alive connection until ``deadline``.
+
+    Requests that complete after ``measure_from`` are measured; one still
+    waiting for its response at the deadline is abandoned and counted as
+    in flight.
+    """
+    reader = writer = None
+    i = random.randrange(len(paths))
+    while (started := time.monotonic()) < deadline:
+        path = paths[i % len(paths)]
+        i += 1
+        try:
+            if writer is None:
+                reader, writer = await asyncio.wait_for(asyncio.open_connection(host, port), deadline - started)
+            status, keep_alive = await asyncio.wait_for(
+                exchange(reader, writer, host, path, token), deadline - time.monotonic()
+            )
+        except asyncio.TimeoutError:
+            stats['in_flight'] += 1
+            break
+        except (OSError, asyncio.IncompleteReadError, asyncio.LimitOverrunError, ValueError, IndexError):
+            if time.monotonic() >= measure_from:
+                stats['errors']['connection'] += 1
+            if writer is not None:
+                writer.close()
+            reader = writer = None
+            await asyncio.sleep(0.05)
+            continue
+
+        finished = time.monotonic()
+        if finished >= measure_from:
+            stats['latencies'].append(finished - started)
+            if status != 200:
+                stats['errors'][status] += 1
+        if not keep_alive:
+            writer.close()
+            reader = writer = None
+    if writer is not None:
+        writer.close()
+
+
+async def run_load(url, paths, token, clients, warmup, duration):
+    parts = urlsplit(url)
+    prefix = parts.path.rstrip('/')
+    paths = [prefix + path for path in paths]
+    stats = {'latencies': [], 'errors': Counter(), 'in_flight': 0}
+    measure_from = time.monotonic() + warmup
+    deadline = measure_from + duration
+    await asyncio.gather(*(
+        run_client(parts.hostname, parts.port or 80, paths, token, measure_from, deadline, stats)
+        for _ in range(clients)
+    ))
+    return stats
+
+
+async def settle(url, path, token, timeout=300):
+    """Wait for one request to come back, so requests abandoned by the previous run are done"""
+    parts = urlsplit(url)
+    reader, writer = await asyncio.open_connection(parts.hostname, parts.port or 80)
+    try:
+        await asyncio.wait_for(exchange(reader, writer, parts.hostname, parts.path.rstrip('/') + path, token), timeout)
+    finally:
+        writer.close()
+
+
+def percentile(ordered, fraction):
+    if not ordered:
+        return 0.0
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+
+class Command(BaseCommand):
+    help = ('Load-test the read endpoints under the WSGI deployment (gunicorn, sync views) and the '
+            'ASGI deployment (uvicorn, async views) and compare p50/p99 latency and requests/sec. '
+            'Uses the configured database; the test data is removed afterwards.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--clients', type=int, nargs='+', default=[50, 200, 1000],
+                            help='Concurrent keep-alive clients per run')
+        parser.add_argument('--endpoints', nargs='+', choices=ENDPOINTS, default=list(ENDPOINTS))
+        parser.add_argument('--duration', type=float, default=10, help='Measured seconds per run')
+        parser.add_argument('--warmup', type=float, default=5, help='Unmeasured seconds before each run')
+        parser.add_argument('--documents', type=int, default=200)
+        parser.add_argument('--workers', type=int, default=2, help='Server processes for both deployments')
+        parser.add_argument('--threads', type=int, default=8, help='Threads per gunicorn worker')
+        parser.add_argument('--limit-concurrency', type=int,
+                            help="uvicorn's --limit-concurrency: answer 503 beyond this many open requests")
+        parser.add_argument('--wsgi-url', help='Test a running WSGI deployment instead of starting gunicorn')
+        parser.add_argument('--asgi-url', help='Test a running ASGI deployment instead of starting uvicorn')
+        parser.add_argument('--keep-data', action='store_true')
+
+    def _populate(self, count):
+        owner, _ = User.objects.get_or_create(username=LOADTEST_USER)
+        token, _ = Token.objects.get_or_create(user=owner)
+        Document.objects.filter(owner=owner).delete()
+        documents = Document.objects.bulk_create([
+            Document(name=f'Contract {i}', file=f'documents/loadtest-{i}.pdf', file_type='pdf',
+                     owner=owner, extraction_status='completed', last_version_number=3)
+            for i in range(count)
+        ])
+        versions = DocumentVersion.objects.bulk_create([
+            DocumentVersion(document=document, version_number=number,
+                            file=f'document_versions/loadtest-{document.id}-{number}.pdf', created_by=owner)
+            for document in documents for number in (1, 2, 3)
+        ])
+        for document, version in zip(documents, versions[2::3]):
+            document.current_version = version
+        Document.objects.bulk_update(documents, ['current_version'])
+        Annotation.objects.bulk_create([
+            Annotation(document=document, user=owner, type='comment', content=f'note {n}', page=n)
+            for document in documents for n in range(1, 6)
+        ])
+        DocumentPage.objects.bulk_create([
+            DocumentPage(document=document, version=document.current_version, page_number=page,
+                         text=fake_page_text(page, seed=document.id))
+            for document in documents for page in range(1, 11)
+        ], batch_size=2000)
+        return owner, token.key, [document.id for document in documents]
+
+    def _paths(self, endpoint, ids):
+        if endpoint == 'list':
+            return ['/documents/?page_size=20']
+        if endpoint == 'retrieve':
+            return [f'/documents/{pk}/' for pk in ids]
+        if endpoint == 'versions':
+            return [f'/documents/{pk}/versions/' for pk in ids]
+        return [f'/documents/{pk}/search/?query=renewal' for pk in ids]
+
+    def _start(self, kind, options):
+        port = free_port()
+        env = dict(os.environ, DJANGO_SETTINGS_MODULE=os.environ.get('DJANGO_SETTINGS_MODULE', 'docmanager.settings'))
+        workers = str(options['workers'])
+        if kind == 'wsgi':
+            env['DOCUMENT_ASYNC_VIEWS'] = '0'
+            command = [sys.executable, '-m', 'gunicorn', 'docmanager.wsgi:application',
+                       '--bind', f'127.0.0.1:{port}', '--workers', workers,
+                       '--worker-class', 'gthread', '--threads', str(options['threads']),
+                       '--backlog', '2048', '--log-level', 'warning']
+        else:
+            env['DOCUMENT_ASYNC_VIEWS'] = '1'
+            command = [sys.executable, '-m', 'uvicorn', 'docmanager.asgi:application',
+                       '--host', '127.0.0.1', '--port', str(port), '--workers', workers,
+                       '--backlog', '2048', '--no-access-log', '--log-level', 'warning']
+            if options['limit_concurrency']:
+                command += ['--limit-concurrency', str(options['limit_concurrency'])]
+        process = subprocess.Popen(command, cwd=settings.BASE_DIR, env=env)
+
+        deadline = time.monotonic() + 30
+        while time.monotonic() < deadline:
+            if process.poll() is not None:
+                raise CommandError(f"{kind} server exited with code {process.returncode}")
+            try:
+                socket.create_connection(('127.0.0.1', port), timeout=1).close()
+                return process, f'http://127.0.0.1:{port}/api'
+            except OSError:
+                time.sleep(0.2)
+        process.terminate()
+        raise CommandError(f"{kind} server did not start")
+
+    def handle(self, *args, **options):
+        owner, token, ids = self._populate(options['documents'])
+        processes = []
+        try:
+            urls = {}
+            for kind in ('wsgi', 'asgi'):
+                if options[f'{kind}_url']:
+                    urls[kind] = options[f'{kind}_url']
+                else:
+                    process, urls[kind] = self._start(kind, options)
+                    processes.append(process)
+
+            self.stdout.write(
+                f"{'endpoint':>9} {'clients':>8} {'server':>7} {'requests':>9} {'req/s':>8} "
+                f"{'p50 ms':>8} {'p99 ms':>8} {'errors':>7} {'in flight':>10}"
+            )
+            for endpoint in options['endpoints']:
+                paths = self._paths(endpoint, ids)
+                for clients in options['clients']:
+                    for kind, url in urls.items():
+                        asyncio.run(settle(url, paths[0], token))
+                        stats = asyncio.run(run_load(
+                            url, paths, token, clients, options['warmup'], options['duration']
+                        ))
+                        latencies = sorted(stats['latencies'])
+                        errors = stats['errors']
+                        self.stdout.write(
+                            f"{endpoint:>9} {clients:>8} {kind:>7} {len(latencies):>9} "
+                            f"{len(latencies) / options['duration']:>8.1f} "
+                            f"{percentile(latencies, 0.5) * 1000:>8.1f} {percentile(latencies, 0.99) * 1000:>8.1f} "
+                            f"{sum(errors.values()):>7} {stats['in_flight']:>10}"
+                        )
+                        if errors:
+                            self.stdout.write(f"{'':>9} errors: {dict(errors)}")
+        finally:
+            for process in processes:
+                process.terminate()
+                process.wait(timeout=30)
+            if not options['keep_data']:
+                owner.delete()
@@ -0,0 +1,35 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from documents import metrics
+from documents.jobs import get_queue
+
+
+class Command(BaseCommand):
+    help = 'Run queued background jobs such as document text extraction'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true',
+                            help='Process the jobs that are currently due and exit')
+        parser.add_argument('--batch-size', type=int, default=10,
+                            help='Number of jobs to claim at a time')
+        parser.add_argument('--sleep', type=float, default=2.0,
+                            help='Seconds to wait when the queue is empty')
+        parser.add_argument('--metrics-port', type=int,
+                            help='Serve Prometheus metrics (e.g. extraction times) on this port')
+
+    def handle(self, *args, **options):
+        queue = get_queue()
+        if options['metrics_port']:
+            metrics.serve(options['metrics_port'])
+        total = 0
+        while True:
+            processed = queue.work(batch_size=options['batch_size'])
+            total += processed
+            if options['once'] and not processed:
+                break
+            if not processed:
+                time.sleep(options['sleep'])
+
+        self.stdout.write(self.style.SUCCESS(f"Processed {total} job(s)"))
@@ -0,0 +1,18 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+
+from documents.realtime import prune_events
+
+
+class Command(BaseCommand):
+    help = 'Delete logged annotation events that are too old for clients to resume from'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--max-age', type=int, default=None,
+                            help='Age in seconds after which events are deleted (default: DOCUMENT_ANNOTATION_EVENT_RETENTION)')
+
+    def handle(self, *args, **options):
+        max_age = timedelta(seconds=options['max_age']) if options['max_age'] is not None else None
+        count = prune_events(max_age)
+        self.stdout.write(self.style.SUCCESS(f"Pruned {count} annotation event(s)"))
@@ -0,0 +1,248 @@
+"""Process-local performance metrics in the Prometheus text format.
+
+``RequestMetricsMiddleware`` (see ``middleware``) fills the request metrics;
+``/metrics`` renders every metric of the serving process. Each process keeps
+its own numbers, so scrape every server process (and every job worker, with
+``process_jobs --metrics-port``) and let Prometheus sum them.
+
+Database queries are attributed to the request in whose context they run,
+including queries the async ORM runs in a thread, through a context variable
+set up by ``track``.
+"""
+import json
+import logging
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from contextvars import ContextVar
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERY_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200)
+EXTRACTION_BUCKETS = (0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+PAGE_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+registry = []
+
+
+def _labels(names, values):
+    if not names:
+        return ''
+    pairs = ','.join(
+        '{}="{}"'.format(name, str(value).replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n'))
+        for name, value in zip(names, values)
+    )
+    return '{' + pairs + '}'
+
+
+def _number(value):
+    return repr(float(value)) if value != float('inf') else '+Inf'
+
+
+class Counter:
+    """Monotonic total per label combination"""
+    kind = 'counter'
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+        registry.append(self)
+
+    def inc(self, amount=1, **labels):
+        key = tuple(labels[name] for name in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            values = dict(self._values)
+        for key, value in sorted(values.items()):
+            yield f'{self.name}{_labels(self.labelnames, key)} {_number(value)}'
+
+    def clear(self):
+        with self._lock:
+            self._values.clear()
+
+
+class Histogram:
+    """Cumulative bucket counts, sum and count per label combination"""
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        self._values = {}
+        self._lock = threading.Lock()
+        registry.append(self)
+
+    def observe(self, value, **labels):
+        key = tuple(labels[name] for name in self.labelnames)
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            counts, total = self._values.get(key) or ([0] * (len(self.buckets) + 1), 0)
+            counts[index] += 1
+            self._values[key] = (counts, total + value)
+
+    def samples(self):
+        with self._lock:
+            values = {key: (list(counts), total) for key, (counts, total) in self._values.items()}
+        names = self.labelnames + ('le',)
+        for key, (counts, total) in sorted(values.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += count
+                yield f'{self.name}_bucket{_labels(names, key + (_number(bound),))} {cumulative}'
+            yield f'{self.name}_sum{_labels(self.labelnames, key)} {_number(total)}'
+            yield f'{self.name}_count{_labels(self.labelnames, key)} {cumulative}'
+
+    def clear(self):
+        with self._lock:
+            self._values.clear()
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    """Serves ``render()`` for processes without a web server, such as job workers"""
+
+    def do_GET(self):
+        body = render().encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def serve(port, address=''):
+    """Serve this process's metrics on ``port`` from a background thread"""
+    server = ThreadingHTTPServer((address, port), MetricsHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def render():
+    """Every registered metric in the Prometheus text exposition format"""
+    lines = []
+    for metric in registry:
+        lines.append(f'# HELP {metric.name} {metric.documentation}')
+        lines.append(f'# TYPE {metric.name} {metric.kind}')
+        lines.extend(metric.samples())
+    return '\n'.join(lines) + '\n'
+
+
+REQUEST_LABELS = ('view', 'method')
+
+request_duration = Histogram(
+    'docmanager_http_request_duration_seconds', 'Time to produce a response, by view',
+    REQUEST_LABELS + ('status',))
+request_queries = Histogram(
+    'docmanager_http_request_db_queries', 'Database queries per request',
+    REQUEST_LABELS, QUERY_BUCKETS)
+request_db_duration = Histogram(
+    'docmanager_http_request_db_duration_seconds', 'Time spent in database queries per request',
+    REQUEST_LABELS)
+request_render_duration = Histogram(
+    'docmanager_http_request_render_duration_seconds',
+    'Time spent rendering serialized data into the response body',
+    REQUEST_LABELS)
+request_bytes = Counter(
+    'docmanager_http_request_bytes_total', 'Request body bytes received', REQUEST_LABELS)
+response_bytes = Counter(
+    'docmanager_http_response_bytes_total', 'Response body bytes sent', REQUEST_LABELS)
+extraction_duration = Histogram(
+    'docmanager_extraction_duration_seconds', 'Text extraction time per document',
+    ('status',), EXTRACTION_BUCKETS)
+extraction_pages = Counter(
+    'docmanager_extraction_pages_total', 'Pages extracted')
+extraction_reused_pages = Counter(
+    'docmanager_extraction_reused_pages_total',
+    'Pages whose text was reused from an earlier extraction instead of extracted')
+extraction_page_duration = Histogram(
+    'docmanager_extraction_page_duration_seconds', 'Time to get the text of one page',
+    ('format', 'method'), PAGE_BUCKETS)
+extraction_chars = Counter(
+    'docmanager_extraction_chars_total', 'Characters of extracted text', ('format', 'method'))
+extraction_cache_lookups = Counter(
+    'docmanager_extraction_cache_lookups_total', 'Extraction cache lookups by file content', ('result',))
+
+
+class Stats:
+    """Database work done on behalf of one request or job"""
+
+    def __init__(self, keep_queries=False):
+        self.queries = 0
+        self.db_time = 0.0
+        self.render_time = 0.0
+        self.query_log = [] if keep_queries else None
+
+
+_current = ContextVar('docmanager_metrics_stats', default=None)
+
+
+@contextmanager
+def track(keep_queries=False):
+    """Collect the database work done inside the block into a ``Stats``"""
+    stats = Stats(keep_queries)
+    token = _current.set(stats)
+    try:
+        yield stats
+    finally:
+        _current.reset(token)
+
+
+def current_stats():
+    return _current.get()
+
+
+def add_render_time(seconds):
+    stats = _current.get()
+    if stats is not None:
+        stats.render_time += seconds
+
+
+def record_query(execute, sql, params, many, context):
+    stats = _current.get()
+    if stats is None:
+        return execute(sql, params, many, context)
+    start = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        elapsed = time.perf_counter() - start
+        stats.queries += 1
+        stats.db_time += elapsed
+        if stats.query_log is not None:
+            stats.query_log.append((elapsed, sql))
+
+
+@receiver(connection_created)
+def install_query_recorder(sender, connection, **kwargs):
+    if record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(record_query)
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line: time, level, logger, message and ``extra={'fields': {...}}``"""
+
+    def format(self, record):
+        entry = {
+            'time': self.formatTime(record),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+        }
+        entry.update(getattr(record, 'fields', {}))
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
@@ -0,0 +1,169 @@
+import cProfile
+import io
+import logging
+import os
+import pstats
+import random
+import re
+import time
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.utils import timezone
+
+from . import metrics
+
+request_logger = logging.getLogger('documents.requests')
+slow_logger = logging.getLogger('documents.slow_requests')
+
+
+def view_label(request):
+    """Name of the URL pattern that served ``request``, for metric labels"""
+    match = getattr(request, 'resolver_match', None)
+    if match is None:
+        return '<unmatched>'
+    return match.url_name or match.route
+
+
+def count_bytes(chunks, labels):
+    sent = 0
+    try:
+        for chunk in chunks:
+            sent += len(chunk)
+            yield chunk
+    finally:
+        metrics.response_bytes.inc(sent, **labels)
+
+
+async def acount_bytes(chunks, labels):
+    sent = 0
+    try:
+        async for chunk in chunks:
+            sent += len(chunk)
+            yield chunk
+    finally:
+        metrics.response_bytes.inc(sent, **labels)
+
+
+class RequestMetricsMiddleware:
+    """Record latency, database work, render time and body sizes per view.
+
+    Every request is measured and, when the ``documents.requests`` logger is
+    at INFO, logged as one structured line. With ``DOCUMENT_SLOW_REQUEST_SECONDS``
+    set, a ``DOCUMENT_SLOW_REQUEST_SAMPLE_RATE`` share of requests also keeps
+    its query log (or a cProfile, with ``DOCUMENT_SLOW_REQUEST_PROFILER =
+    'cprofile'``), which is logged if the request turns out to be slow.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def _sampled(self):
+        if getattr(settings, 'DOCUMENT_SLOW_REQUEST_SECONDS', None) is None:
+            return None
+        if random.random() >= getattr(settings, 'DOCUMENT_SLOW_REQUEST_SAMPLE_RATE', 1.0):
+            return None
+        return getattr(settings, 'DOCUMENT_SLOW_REQUEST_PROFILER', 'queries')
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        sampler = self._sampled()
+        profiler = cProfile.Profile() if sampler == 'cprofile' else None
+        start = time.perf_counter()
+        with metrics.track(keep_queries=sampler == 'queries') as stats:
+            if profiler:
+                profiler.enable()
+            try:
+                response = self.get_response(request)
+            finally:
+                if profiler:
+                    profiler.disable()
+        return self._finish(request, response, stats, time.perf_counter() - start, profiler)
+
+    async def __acall__(self, request):
+        sampler = self._sampled()
+        # The profiler only sees this thread, not ORM queries run in others
+        profiler = cProfile.Profile() if sampler == 'cprofile' else None
+        start = time.perf_counter()
+        with metrics.track(keep_queries=sampler == 'queries') as stats:
+            if profiler:
+                profiler.enable()
+            try:
+                response = await self.get_response(request)
+            finally:
+                if profiler:
+                    profiler.disable()
+        return self._finish(request, response, stats, time.perf_counter() - start, profiler)
+
+    def process_template_response(self, request, response):
+        # DRF responses are rendered after the view returns; time that separately
+        stats = metrics.current_stats()
+        if stats is not None:
+            start = time.perf_counter()
+
+            def rendered(response):
+                stats.render_time += time.perf_counter() - start
+            response.add_post_render_callback(rendered)
+        return response
+
+    def _finish(self, request, response, stats, duration, profiler):
+        labels = {'view': view_label(request), 'method': request.method}
+        metrics.request_duration.observe(duration, status=str(response.status_code), **labels)
+        metrics.request_queries.observe(stats.queries, **labels)
+        metrics.request_db_duration.observe(stats.db_time, **labels)
+        metrics.request_render_duration.observe(stats.render_time, **labels)
+
+        bytes_in = int(request.META.get('CONTENT_LENGTH') or 0)
+        metrics.request_bytes.inc(bytes_in, **labels)
+        if not response.streaming:
+            bytes_out = len(response.content)
+            metrics.response_bytes.inc(bytes_out, **labels)
+        elif response.has_header('Content-Length'):
+            # Keep file responses unwrapped so servers can still use sendfile
+            bytes_out = int(response['Content-Length'])
+            metrics.response_bytes.inc(bytes_out, **labels)
+        else:
+            bytes_out = None
+            if response.is_async:
+                response.streaming_content = acount_bytes(response.streaming_content, labels)
+            else:
+                response.streaming_content = count_bytes(response.streaming_content, labels)
+
+        fields = {
+            **labels,
+            'path': request.path,
+            'status': response.status_code,
+            'duration_ms': round(duration * 1000, 2),
+            'db_queries': stats.queries,
+            'db_ms': round(stats.db_time * 1000, 2),
+            'render_ms': round(stats.render_time * 1000, 2),
+            'bytes_in': bytes_in,
+            'bytes_out': bytes_out,
+        }
+        request_logger.info('request', extra={'fields': fields})
+
+        threshold = getattr(settings, 'DOCUMENT_SLOW_REQUEST_SECONDS', None)
+        if threshold is not None and duration >= threshold and (profiler or stats.query_log is not None):
+            self._report_slow(fields, stats, profiler)
+        return response
+
+    def _report_slow(self, fields, stats, profiler):
+        if profiler:
+            out = io.StringIO()
+            pstats.Stats(profiler, stream=out).sort_stats('cumulative').print_stats(30)
+            fields = dict(fields, profile=out.getvalue())
+            directory = getattr(settings, 'DOCUMENT_SLOW_REQUEST_DIR', None)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+                name = re.sub(r'[^\w.-]+', '_', f"{timezone.now():%Y%m%dT%H%M%S%f}-{fields['view']}") + '.prof'
+                profiler.dump_stats(os.path.join(directory, name))
+        else:
+            fields = dict(fields, queries=[
+                {'ms': round(elapsed * 1000, 2), 'sql': sql} for elapsed, sql in stats.query_log
+            ])
+        slow_logger.warning('slow request', extra={'fields': fields})
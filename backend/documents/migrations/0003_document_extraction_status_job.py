@@ -0,0 +1,57 @@
+# Generated by Django 5.1.3 on 2026-10-17 05:57
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+def copy_ocr_flag_to_status(apps, schema_editor):
+    Document = apps.get_model('documents', 'Document')
+    Document.objects.filter(is_ocr_processed=True).update(extraction_status='completed')
+    Document.objects.filter(is_ocr_processed=False).exclude(
+        file_type__iexact='pdf'
+    ).update(extraction_status='skipped')
+
+
+def copy_status_to_ocr_flag(apps, schema_editor):
+    Document = apps.get_model('documents', 'Document')
+    Document.objects.filter(extraction_status='completed').update(is_ocr_processed=True)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('documents', '0002_rename_title_document_name_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='document',
+            name='extraction_status',
+            field=models.CharField(choices=[('pending', 'Pending'), ('processing', 'Processing'), ('completed', 'Completed'), ('failed', 'Failed'), ('skipped', 'Skipped')], default='pending', max_length=20),
+        ),
+        migrations.RunPython(copy_ocr_flag_to_status, copy_status_to_ocr_flag),
+        migrations.RemoveField(
+            model_name='document',
+            name='is_ocr_processed',
+        ),
+        migrations.CreateModel(
+            name='Job',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('task', models.CharField(max_length=100)),
+                ('payload', models.JSONField(blank=True, default=dict)),
+                ('status', models.CharField(choices=[('queued', 'Queued'), ('running', 'Running'), ('completed', 'Completed'), ('failed', 'Failed')], default='queued', max_length=20)),
+                ('attempts', models.PositiveIntegerField(default=0)),
+                ('max_attempts', models.PositiveIntegerField(default=5)),
+                ('run_after', models.DateTimeField(default=django.utils.timezone.now)),
+                ('locked_at', models.DateTimeField(blank=True, null=True)),
+                ('last_error', models.TextField(blank=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'ordering': ['run_after', 'id'],
+                'indexes': [models.Index(fields=['status', 'run_after'], name='documents_j_status_362e1f_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,71 @@
+# Generated by Django 5.1.3 on 2026-10-17 05:58
+
+import django.db.models.deletion
+import re
+
+from django.db import migrations, models
+
+PAGE_MARKER = re.compile(r"--- PAGE (\d+) ---\n\n")
+
+
+def split_text_content_into_pages(apps, schema_editor):
+    Document = apps.get_model('documents', 'Document')
+    DocumentPage = apps.get_model('documents', 'DocumentPage')
+    documents = Document.objects.exclude(text_content__isnull=True).exclude(text_content='')
+    # The text was extracted from Document.file; 0013 attaches the pages to
+    # the version with that file
+    for document in documents.only('id', 'text_content').iterator():
+        # The blob is [text_before_first_marker, page1, text1, page2, text2, ...]
+        # and every page but the last is followed by the "\n\n" of the next marker
+        parts = PAGE_MARKER.split(document.text_content)
+        pages = []
+        for i in range(1, len(parts) - 1, 2):
+            text = parts[i + 1]
+            if i + 2 < len(parts):
+                text = text.removesuffix("\n\n")
+            pages.append(DocumentPage(
+                document_id=document.id,
+                page_number=int(parts[i]),
+                text=text,
+            ))
+        DocumentPage.objects.bulk_create(pages, batch_size=500)
+
+
+def join_pages_into_text_content(apps, schema_editor):
+    Document = apps.get_model('documents', 'Document')
+    DocumentPage = apps.get_model('documents', 'DocumentPage')
+    for document in Document.objects.filter(pages__isnull=False).distinct().iterator():
+        pages = DocumentPage.objects.filter(document_id=document.id).order_by('page_number')
+        document.text_content = "".join(
+            f"\n\n--- PAGE {page.page_number} ---\n\n{page.text}" for page in pages
+        )
+        document.save(update_fields=['text_content'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('documents', '0003_document_extraction_status_job'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DocumentPage',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('page_number', models.PositiveIntegerField()),
+                ('text', models.TextField(blank=True)),
+                ('document', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='pages', to='documents.document')),
+                ('version', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='pages', to='documents.documentversion')),
+            ],
+            options={
+                'ordering': ['page_number'],
+                'unique_together': {('document', 'version', 'page_number')},
+            },
+        ),
+        migrations.RunPython(split_text_content_into_pages, join_pages_into_text_content),
+        migrations.RemoveField(
+            model_name='document',
+            name='text_content',
+        ),
+    ]
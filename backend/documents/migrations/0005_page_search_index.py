@@ -0,0 +1,84 @@
+from django.db import migrations
+
+# Note: when a later migration alters documents_documentpage on SQLite, Django
+# rebuilds the table and the triggers below are dropped with it. Such a
+# migration has to create them again. Rebuilding documents_document (which the
+# insert/update triggers join) fails outright unless they are dropped first.
+
+SQLITE_INSTALL = [
+    """
+    CREATE VIRTUAL TABLE documents_page_fts USING fts5(
+        text, document_id UNINDEXED, owner_id UNINDEXED, page_number UNINDEXED,
+        tokenize = 'unicode61 remove_diacritics 2'
+    )
+    """,
+    """
+    CREATE TRIGGER documents_page_fts_insert AFTER INSERT ON documents_documentpage BEGIN
+        INSERT INTO documents_page_fts(rowid, text, document_id, owner_id, page_number)
+        SELECT new.id, new.text, new.document_id, d.owner_id, new.page_number
+        FROM documents_document d WHERE d.id = new.document_id;
+    END
+    """,
+    """
+    CREATE TRIGGER documents_page_fts_delete AFTER DELETE ON documents_documentpage BEGIN
+        DELETE FROM documents_page_fts WHERE rowid = old.id;
+    END
+    """,
+    """
+    CREATE TRIGGER documents_page_fts_update AFTER UPDATE ON documents_documentpage BEGIN
+        DELETE FROM documents_page_fts WHERE rowid = old.id;
+        INSERT INTO documents_page_fts(rowid, text, document_id, owner_id, page_number)
+        SELECT new.id, new.text, new.document_id, d.owner_id, new.page_number
+        FROM documents_document d WHERE d.id = new.document_id;
+    END
+    """,
+    """
+    INSERT INTO documents_page_fts(rowid, text, document_id, owner_id, page_number)
+    SELECT p.id, p.text, p.document_id, d.owner_id, p.page_number
+    FROM documents_documentpage p JOIN documents_document d ON d.id = p.document_id
+    """,
+]
+
+SQLITE_UNINSTALL = [
+    'DROP TRIGGER IF EXISTS documents_page_fts_insert',
+    'DROP TRIGGER IF EXISTS documents_page_fts_delete',
+    'DROP TRIGGER IF EXISTS documents_page_fts_update',
+    'DROP TABLE IF EXISTS documents_page_fts',
+]
+
+POSTGRES_INSTALL = [
+    """
+    ALTER TABLE documents_documentpage ADD COLUMN search_vector tsvector
+    GENERATED ALWAYS AS (to_tsvector('simple', coalesce(text, ''))) STORED
+    """,
+    'CREATE INDEX documents_documentpage_search_idx ON documents_documentpage USING GIN (search_vector)',
+]
+
+POSTGRES_UNINSTALL = [
+    'DROP INDEX IF EXISTS documents_documentpage_search_idx',
+    'ALTER TABLE documents_documentpage DROP COLUMN IF EXISTS search_vector',
+]
+
+
+def _run(schema_editor, statements_by_vendor):
+    for statement in statements_by_vendor.get(schema_editor.connection.vendor, []):
+        schema_editor.execute(statement)
+
+
+def install_search_index(apps, schema_editor):
+    _run(schema_editor, {'sqlite': SQLITE_INSTALL, 'postgresql': POSTGRES_INSTALL})
+
+
+def uninstall_search_index(apps, schema_editor):
+    _run(schema_editor, {'sqlite': SQLITE_UNINSTALL, 'postgresql': POSTGRES_UNINSTALL})
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('documents', '0004_document_pages'),
+    ]
+
+    operations = [
+        migrations.RunPython(install_search_index, uninstall_search_index),
+    ]
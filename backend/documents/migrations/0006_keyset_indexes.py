@@ -0,0 +1,31 @@
+# Generated by Django 5.1.3 on 2026-10-17 06:06
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('documents', '0005_page_search_index'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='annotation',
+            index=models.Index(fields=['document', 'page'], name='documents_a_documen_581dd5_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='annotation',
+            index=models.Index(fields=['document', 'created_at'], name='documents_a_documen_b4d8df_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='document',
+            index=models.Index(fields=['owner', 'created_at'], name='documents_d_owner_i_db5cd3_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='documentversion',
+            index=models.Index(fields=['document', 'created_at'], name='documents_d_documen_96e07e_idx'),
+        ),
+    ]
@@ -0,0 +1,72 @@
+# Generated by Django 5.1.3 on 2026-10-17 06:17
+
+from django.db import migrations, models
+from django.db.models import Max, OuterRef, Subquery
+
+
+# Adding a column to documents_document rebuilds it on SQLite, which fails
+# while the page search triggers (0005) reference the table. Drop them for
+# the rebuild and create them again afterwards.
+SQLITE_DROP_TRIGGERS = [
+    'DROP TRIGGER IF EXISTS documents_page_fts_insert',
+    'DROP TRIGGER IF EXISTS documents_page_fts_update',
+]
+
+SQLITE_CREATE_TRIGGERS = [
+    """
+    CREATE TRIGGER documents_page_fts_insert AFTER INSERT ON documents_documentpage BEGIN
+        INSERT INTO documents_page_fts(rowid, text, document_id, owner_id, page_number)
+        SELECT new.id, new.text, new.document_id, d.owner_id, new.page_number
+        FROM documents_document d WHERE d.id = new.document_id;
+    END
+    """,
+    """
+    CREATE TRIGGER documents_page_fts_update AFTER UPDATE ON documents_documentpage BEGIN
+        DELETE FROM documents_page_fts WHERE rowid = old.id;
+        INSERT INTO documents_page_fts(rowid, text, document_id, owner_id, page_number)
+        SELECT new.id, new.text, new.document_id, d.owner_id, new.page_number
+        FROM documents_document d WHERE d.id = new.document_id;
+    END
+    """,
+]
+
+
+def _run_sqlite(schema_editor, statements):
+    if schema_editor.connection.vendor == 'sqlite':
+        for statement in statements:
+            schema_editor.execute(statement)
+
+
+def drop_search_triggers(apps, schema_editor):
+    _run_sqlite(schema_editor, SQLITE_DROP_TRIGGERS)
+
+
+def create_search_triggers(apps, schema_editor):
+    _run_sqlite(schema_editor, SQLITE_CREATE_TRIGGERS)
+
+
+def count_existing_versions(apps, schema_editor):
+    Document = apps.get_model('documents', 'Document')
+    DocumentVersion = apps.get_model('documents', 'DocumentVersion')
+    highest = DocumentVersion.objects.filter(document=OuterRef('pk')).order_by().values('document').annotate(
+        highest=Max('version_number')
+    ).values('highest')
+    Document.objects.filter(pk__in=DocumentVersion.objects.values('document')).update(last_version_number=Subquery(highest))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('documents', '0008_upload_sessions'),
+    ]
+
+    operations = [
+        migrations.RunPython(drop_search_triggers, create_search_triggers),
+        migrations.AddField(
+            model_name='document',
+            name='last_version_number',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(count_existing_versions, migrations.RunPython.noop),
+        migrations.RunPython(create_search_triggers, drop_search_triggers),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.1.3 on 2026-10-17 06:24
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('documents', '0009_document_version_counter'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='annotation',
+            name='documents_a_documen_581dd5_idx',
+        ),
+        migrations.AddIndex(
+            model_name='annotation',
+            index=models.Index(fields=['document', 'page', 'position_x', 'position_y'], name='documents_a_documen_7b550b_idx'),
+        ),
+    ]
@@ -0,0 +1,44 @@
+# Generated by Django 5.1.3 on 2026-10-17 06:27
+
+from importlib import import_module
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+# documents_document is rebuilt again on SQLite; see 0009 for the page
+# search triggers that have to be dropped around the rebuild
+version_counter = import_module('documents.migrations.0009_document_version_counter')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('documents', '0010_annotation_viewport_index'),
+    ]
+
+    operations = [
+        migrations.RunPython(version_counter.drop_search_triggers, version_counter.create_search_triggers),
+        migrations.AddField(
+            model_name='document',
+            name='last_event_seq',
+            field=models.PositiveBigIntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(version_counter.create_search_triggers, version_counter.drop_search_triggers),
+        migrations.CreateModel(
+            name='AnnotationEvent',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('seq', models.PositiveBigIntegerField()),
+                ('op', models.CharField(choices=[('create', 'Create'), ('update', 'Update'), ('delete', 'Delete')], max_length=10)),
+                ('annotation_id', models.PositiveBigIntegerField()),
+                ('data', models.JSONField(blank=True, default=dict)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('document', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='annotation_events', to='documents.document')),
+            ],
+            options={
+                'ordering': ['seq'],
+                'indexes': [models.Index(fields=['created_at'], name='documents_a_created_c80b20_idx')],
+                'unique_together': {('document', 'seq')},
+            },
+        ),
+    ]
@@ -0,0 +1,26 @@
+# Generated by Django 5.1.3 on 2026-10-17 07:08
+
+from importlib import import_module
+
+from django.db import migrations, models
+
+# documents_document is rebuilt again on SQLite; see 0009 for the page
+# search triggers that have to be dropped around the rebuild
+version_counter = import_module('documents.migrations.0009_document_version_counter')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('documents', '0011_annotation_events'),
+    ]
+
+    operations = [
+        migrations.RunPython(version_counter.drop_search_triggers, version_counter.create_search_triggers),
+        migrations.AddField(
+            model_name='document',
+            name='generation',
+            field=models.PositiveBigIntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(version_counter.create_search_triggers, version_counter.drop_search_triggers),
+    ]
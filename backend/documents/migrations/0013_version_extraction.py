@@ -0,0 +1,73 @@
+# Generated by Django 5.1.3 on 2026-10-17 07:24
+
+from django.db import migrations, models
+from django.db.models import OuterRef, Subquery
+
+
+def track_existing_versions(apps, schema_editor):
+    """Give the extracted pages of each document to the version they came from; queue the others.
+
+    Text used to be extracted from ``Document.file``, which stays the first
+    version's file however many versions are added. When a newer version is
+    current it is queued too, instead of inheriting text it doesn't contain.
+    """
+    Document = apps.get_model('documents', 'Document')
+    DocumentPage = apps.get_model('documents', 'DocumentPage')
+    DocumentVersion = apps.get_model('documents', 'DocumentVersion')
+    Job = apps.get_model('documents', 'Job')
+
+    extracted = set()
+    documents = Document.objects.exclude(file='').filter(extraction_status='completed').values_list(
+        'id', 'file', 'current_version_id'
+    )
+    for document_id, name, current_version_id in documents.iterator():
+        matching = list(DocumentVersion.objects.filter(document_id=document_id, file=name)
+                        .order_by('version_number').values_list('id', flat=True))
+        if not matching:
+            continue
+        version_id = current_version_id if current_version_id in matching else matching[0]
+        DocumentPage.objects.filter(document_id=document_id, version__isnull=True).update(version_id=version_id)
+        DocumentVersion.objects.filter(pk=version_id).update(extraction_status='completed')
+        extracted.add(version_id)
+
+    # Every other version was never extracted (or its extraction didn't
+    # finish); only PDFs could be
+    skipped = []
+    jobs = []
+    versions = DocumentVersion.objects.values_list('id', 'document__file_type')
+    for version_id, file_type in versions.iterator():
+        if version_id in extracted:
+            continue
+        if file_type.lower() == 'pdf':
+            jobs.append(Job(task='extract_version_text', payload={'version_id': version_id}))
+        else:
+            skipped.append(version_id)
+    for i in range(0, len(skipped), 500):
+        DocumentVersion.objects.filter(pk__in=skipped[i:i + 500]).update(extraction_status='skipped')
+    Job.objects.bulk_create(jobs, batch_size=500)
+
+    # A document's status is its current version's
+    Document.objects.exclude(current_version=None).update(extraction_status=Subquery(
+        DocumentVersion.objects.filter(pk=OuterRef('current_version_id')).values('extraction_status')[:1]
+    ))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('documents', '0012_document_generation'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='documentversion',
+            name='extraction_status',
+            field=models.CharField(choices=[('pending', 'Pending'), ('processing', 'Processing'), ('completed', 'Completed'), ('failed', 'Failed'), ('skipped', 'Skipped')], default='pending', max_length=20),
+        ),
+        migrations.AddField(
+            model_name='documentversion',
+            name='page_hashes',
+            field=models.JSONField(blank=True, default=dict, editable=False),
+        ),
+        migrations.RunPython(track_existing_versions, migrations.RunPython.noop),
+    ]
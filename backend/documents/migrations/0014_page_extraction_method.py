@@ -0,0 +1,48 @@
+# Generated by Django 5.1.3 on 2026-10-17 07:51
+
+import os
+
+from django.db import migrations, models
+
+# Extensions of the extractors added alongside these fields; files of these
+# types were skipped so far
+NEW_EXTENSIONS = ('.docx', '.txt', '.text', '.md', '.csv', '.html', '.htm')
+
+
+def queue_newly_supported(apps, schema_editor):
+    """Queue extraction for skipped versions that an extractor now handles"""
+    Document = apps.get_model('documents', 'Document')
+    DocumentVersion = apps.get_model('documents', 'DocumentVersion')
+    Job = apps.get_model('documents', 'Job')
+
+    version_ids = [
+        version_id
+        for version_id, name in DocumentVersion.objects.filter(extraction_status='skipped').values_list('id', 'file')
+        if os.path.splitext(name)[1].lower() in NEW_EXTENSIONS
+    ]
+    DocumentVersion.objects.filter(id__in=version_ids).update(extraction_status='pending')
+    Document.objects.filter(current_version_id__in=version_ids).update(extraction_status='pending')
+    Job.objects.bulk_create([
+        Job(task='extract_version_text', payload={'version_id': version_id}) for version_id in version_ids
+    ], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('documents', '0013_version_extraction'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='documentpage',
+            name='extraction_ms',
+            field=models.FloatField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='documentpage',
+            name='method',
+            field=models.CharField(blank=True, choices=[('text', 'Text layer'), ('ocr', 'OCR'), ('reused', 'Reused from an earlier version')], max_length=10, null=True),
+        ),
+        migrations.RunPython(queue_newly_supported, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,52 @@
+# Generated by Django 5.1.3 on 2026-10-17 07:58
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('documents', '0014_page_extraction_method'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='documentpage',
+            name='method',
+            field=models.CharField(blank=True, choices=[('text', 'Text layer'), ('ocr', 'OCR'), ('reused', 'Reused from an earlier extraction')], max_length=10, null=True),
+        ),
+        migrations.CreateModel(
+            name='ExtractedFile',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('sha256', models.CharField(max_length=64)),
+                ('extractor', models.CharField(max_length=100)),
+                ('complete', models.BooleanField(default=False)),
+                ('page_count', models.PositiveIntegerField(default=0)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('last_used_at', models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['last_used_at'], name='documents_e_last_us_df4c08_idx')],
+                'unique_together': {('sha256', 'extractor')},
+            },
+        ),
+        migrations.CreateModel(
+            name='ExtractedPage',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('page_number', models.PositiveIntegerField()),
+                ('text', models.TextField(blank=True)),
+                ('hash', models.CharField(blank=True, max_length=64)),
+                ('method', models.CharField(choices=[('text', 'Text layer'), ('ocr', 'OCR'), ('reused', 'Reused from an earlier extraction')], max_length=10)),
+                ('extraction_ms', models.FloatField()),
+                ('file', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='pages', to='documents.extractedfile')),
+            ],
+            options={
+                'ordering': ['page_number'],
+                'unique_together': {('file', 'page_number')},
+            },
+        ),
+    ]
@@ -0,0 +1,38 @@
+# Generated by Django 5.1.3 on 2026-10-17 08:02
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('documents', '0015_extraction_cache'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='blob',
+            name='base',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.PROTECT, related_name='deltas', to='documents.blob'),
+        ),
+        migrations.AddField(
+            model_name='blob',
+            name='delta',
+            field=models.FileField(blank=True, max_length=255, upload_to='blobs/'),
+        ),
+        migrations.AddField(
+            model_name='blob',
+            name='delta_size',
+            field=models.PositiveBigIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='blob',
+            name='depth',
+            field=models.PositiveSmallIntegerField(default=0),
+        ),
+        migrations.AddIndex(
+            model_name='blob',
+            index=models.Index(fields=['file'], name='documents_b_file_126fb1_idx'),
+        ),
+    ]
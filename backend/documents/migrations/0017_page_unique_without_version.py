@@ -0,0 +1,17 @@
+# Generated by Django 5.1.3 on 2026-10-17 08:34
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('documents', '0016_version_deltas'),
+    ]
+
+    operations = [
+        migrations.AddConstraint(
+            model_name='documentpage',
+            constraint=models.UniqueConstraint(condition=models.Q(('version__isnull', True)), fields=('document', 'page_number'), name='documents_page_unique_without_version'),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.1.3 on 2026-10-17 08:37
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('documents', '0017_page_unique_without_version'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='documentpage',
+            name='method',
+            field=models.CharField(blank=True, choices=[('text', 'Text layer'), ('ocr', 'OCR'), ('reused', 'Reused from an earlier extraction'), ('ocr-failed', 'OCR failed')], max_length=10, null=True),
+        ),
+        migrations.AlterField(
+            model_name='extractedpage',
+            name='method',
+            field=models.CharField(choices=[('text', 'Text layer'), ('ocr', 'OCR'), ('reused', 'Reused from an earlier extraction'), ('ocr-failed', 'OCR failed')], max_length=10),
+        ),
+    ]
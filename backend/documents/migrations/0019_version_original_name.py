@@ -0,0 +1,18 @@
+# Generated by Django 5.1.3 on 2026-10-17 08:47
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('documents', '0018_page_ocr_failed_method'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='documentversion',
+            name='original_name',
+            field=models.CharField(blank=True, max_length=255),
+        ),
+    ]
@@ -1,16 +1,37 @@
+import uuid
+
 from django.db import models
 from django.contrib.auth.models import User
+from django.utils import timezone
 
 class Document(models.Model):
+    EXTRACTION_STATUSES = (
+        ('pending', 'Pending'),
+        ('processing', 'Processing'),
+        ('completed', 'Completed'),
+        ('failed', 'Failed'),
+        ('skipped', 'Skipped'),
+    )
+    COUNTER_FIELDS = ('last_version_number', 'last_event_seq', 'generation')
+    
     name = models.CharField(max_length=255)
     file = models.FileField(upload_to='documents/')
     file_type = models.CharField(max_length=50)  # PDF, DOCX, etc.
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
     owner = models.ForeignKey(User, on_delete=models.CASCADE, related_name='documents')
-    is_ocr_processed = models.BooleanField(default=False)
-    text_content = models.TextField(blank=True, null=True)  # Extracted text for search
+    extraction_status = models.CharField(max_length=20, choices=EXTRACTION_STATUSES, default='pending')
     current_version = models.ForeignKey('DocumentVersion', on_delete=models.SET_NULL, null=True, blank=True, related_name='current_for')
+    # Highest version number handed out so far; see services.allocate_version_number
+    last_version_number = models.PositiveIntegerField(default=0, editable=False)
+    # Sequence number of the latest annotation event; see realtime.record_events
+    last_event_seq = models.PositiveBigIntegerField(default=0, editable=False)
+    # Bumped whenever the document, its versions or its annotations change;
+    # see caching.bump_generation
+    generation = models.PositiveBigIntegerField(default=0, editable=False)
+    
+    class Meta:
+        indexes = [models.Index(fields=['owner', 'created_at'])]
     
     @property
     def url(self):
@@ -26,6 +47,16 @@ class Document(models.Model):
             return self.current_version.id
         return None
     
+    def save(self, *args, **kwargs):
+        # The counters are only changed by atomic UPDATEs; a full save of a
+        # stale instance must not roll them back under concurrent requests
+        if not self._state.adding and kwargs.get('update_fields') is None:
+            kwargs['update_fields'] = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key and field.name not in self.COUNTER_FIELDS
+            ]
+        super().save(*args, **kwargs)
+    
     def __str__(self):
         return self.name
 
@@ -33,12 +64,22 @@ class DocumentVersion(models.Model):
     document = models.ForeignKey(Document, on_delete=models.CASCADE, related_name='versions')
     version_number = models.PositiveIntegerField()
     file = models.FileField(upload_to='document_versions/')
+    # Name of the uploaded file; stored files are named by their content hash
+    original_name = models.CharField(max_length=255, blank=True)
+    sha256 = models.CharField(max_length=64, blank=True, db_index=True)
     created_at = models.DateTimeField(auto_now_add=True)
     created_by = models.ForeignKey(User, on_delete=models.SET_NULL, null=True)
+    # Text extraction of this version's file; the document's extraction_status
+    # mirrors its current version's
+    extraction_status = models.CharField(max_length=20, choices=Document.EXTRACTION_STATUSES, default='pending')
+    # Fingerprint of every page with text, {"<page number>": "<sha256>"}, so a
+    # later version can reuse the text of unchanged pages
+    page_hashes = models.JSONField(default=dict, blank=True, editable=False)
     
     class Meta:
         unique_together = ('document', 'version_number')
         ordering = ['-version_number']
+        indexes = [models.Index(fields=['document', 'created_at'])]
     
     @property
     def file_url(self):
@@ -48,6 +89,103 @@ class DocumentVersion(models.Model):
     def __str__(self):
         return f"{self.document.name} - v{self.version_number}"
 
+class Blob(models.Model):
+    """A file in the content-addressed store, shared by every row that references it"""
+    sha256 = models.CharField(max_length=64, unique=True)
+    file = models.FileField(upload_to='blobs/', max_length=255)
+    size = models.PositiveBigIntegerField()
+    ref_count = models.PositiveIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+    # Set when the content is stored as a binary delta against ``base`` (see
+    # deltas) instead of in full at ``file``; the blob holds a reference on
+    # its base. ``depth`` counts the deltas to apply to get from the nearest
+    # full blob to this one.
+    base = models.ForeignKey('self', on_delete=models.PROTECT, null=True, blank=True, related_name='deltas')
+    delta = models.FileField(upload_to='blobs/', max_length=255, blank=True)
+    delta_size = models.PositiveBigIntegerField(null=True, blank=True)
+    depth = models.PositiveSmallIntegerField(default=0)
+    
+    class Meta:
+        indexes = [models.Index(fields=['file'])]
+    
+    @property
+    def stored_size(self):
+        """Bytes this blob takes up in storage"""
+        return self.size if self.delta_size is None else self.delta_size
+    
+    def __str__(self):
+        return f"{self.sha256[:12]} ({self.ref_count} refs)"
+
+class DocumentPage(models.Model):
+    """Extracted text of a single page, used for search and previews"""
+    EXTRACTION_METHODS = (
+        ('text', 'Text layer'),
+        ('ocr', 'OCR'),
+        ('reused', 'Reused from an earlier extraction'),
+        ('ocr-failed', 'OCR failed'),
+    )
+    
+    document = models.ForeignKey(Document, on_delete=models.CASCADE, related_name='pages')
+    version = models.ForeignKey(DocumentVersion, on_delete=models.CASCADE, null=True, blank=True, related_name='pages')
+    page_number = models.PositiveIntegerField()
+    text = models.TextField(blank=True)
+    # How the text was obtained and how long that took; null for pages
+    # extracted before this was recorded (nullable so adding them doesn't
+    # rebuild the table and its full-text triggers on SQLite)
+    method = models.CharField(max_length=10, choices=EXTRACTION_METHODS, null=True, blank=True)
+    extraction_ms = models.FloatField(null=True, blank=True)
+    
+    class Meta:
+        unique_together = ('document', 'version', 'page_number')
+        # unique_together treats NULLs as distinct, so it doesn't cover pages
+        # without a version (those of documents that had none in 0013)
+        constraints = [
+            models.UniqueConstraint(
+                fields=['document', 'page_number'], condition=models.Q(version__isnull=True),
+                name='documents_page_unique_without_version',
+            ),
+        ]
+        ordering = ['page_number']
+    
+    def __str__(self):
+        return f"{self.document.name} - page {self.page_number}"
+
+class ExtractedFile(models.Model):
+    """Cached extraction output of a file, shared by every version with the same content"""
+    sha256 = models.CharField(max_length=64)
+    # Extractor.key of the extractor that produced the pages; entries for
+    # other keys are never read and get pruned
+    extractor = models.CharField(max_length=100)
+    # False while pages are being written
+    complete = models.BooleanField(default=False)
+    page_count = models.PositiveIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+    last_used_at = models.DateTimeField(default=timezone.now)
+    
+    class Meta:
+        unique_together = ('sha256', 'extractor')
+        indexes = [models.Index(fields=['last_used_at'])]
+    
+    def __str__(self):
+        return f"{self.sha256[:12]} ({self.extractor}, {self.page_count} pages)"
+
+class ExtractedPage(models.Model):
+    """One page of a cached extraction, copied into ``DocumentPage`` rows on a cache hit"""
+    file = models.ForeignKey(ExtractedFile, on_delete=models.CASCADE, related_name='pages')
+    page_number = models.PositiveIntegerField()
+    text = models.TextField(blank=True)
+    # Fingerprint, as in DocumentVersion.page_hashes
+    hash = models.CharField(max_length=64, blank=True)
+    method = models.CharField(max_length=10, choices=DocumentPage.EXTRACTION_METHODS)
+    extraction_ms = models.FloatField()
+    
+    class Meta:
+        unique_together = ('file', 'page_number')
+        ordering = ['page_number']
+    
+    def __str__(self):
+        return f"{self.file} - page {self.page_number}"
+
 class Annotation(models.Model):
     ANNOTATION_TYPES = (
         ('highlight', 'Highlight'),
@@ -64,10 +202,97 @@ class Annotation(models.Model):
     position_y = models.FloatField(null=True, blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
     
+    class Meta:
+        indexes = [
+            # Viewport queries: a page range, then a box on the page
+            models.Index(fields=['document', 'page', 'position_x', 'position_y']),
+            models.Index(fields=['document', 'created_at']),
+        ]
+    
     @property
     def created_by(self):
         """Return the username of the annotation creator"""
         return self.user.username
     
     def __str__(self):
-        return f"{self.type} by {self.user.username} on {self.document.name}" 
\ No newline at end of file
+        return f"{self.type} by {self.user.username} on {self.document.name}"
+
+class AnnotationEvent(models.Model):
+    """A change to a document's annotations, numbered per document so live clients can resume"""
+    OPS = (
+        ('create', 'Create'),
+        ('update', 'Update'),
+        ('delete', 'Delete'),
+    )
+    
+    document = models.ForeignKey(Document, on_delete=models.CASCADE, related_name='annotation_events')
+    seq = models.PositiveBigIntegerField()
+    op = models.CharField(max_length=10, choices=OPS)
+    annotation_id = models.PositiveBigIntegerField()
+    # The serialized annotation; empty for deletes
+    data = models.JSONField(default=dict, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    
+    class Meta:
+        unique_together = ('document', 'seq')
+        ordering = ['seq']
+        indexes = [models.Index(fields=['created_at'])]
+    
+    def __str__(self):
+        return f"{self.op} annotation {self.annotation_id} (#{self.seq} on {self.document_id})"
+
+class Job(models.Model):
+    """A unit of background work picked up by the ``process_jobs`` command"""
+    STATUSES = (
+        ('queued', 'Queued'),
+        ('running', 'Running'),
+        ('completed', 'Completed'),
+        ('failed', 'Failed'),
+    )
+    
+    task = models.CharField(max_length=100)
+    payload = models.JSONField(default=dict, blank=True)
+    status = models.CharField(max_length=20, choices=STATUSES, default='queued')
+    attempts = models.PositiveIntegerField(default=0)
+    max_attempts = models.PositiveIntegerField(default=5)
+    run_after = models.DateTimeField(default=timezone.now)
+    locked_at = models.DateTimeField(null=True, blank=True)
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    class Meta:
+        ordering = ['run_after', 'id']
+        indexes = [models.Index(fields=['status', 'run_after'])]
+    
+    def __str__(self):
+        return f"{self.task} #{self.pk} ({self.status})"
+
+class UploadSession(models.Model):
+    """A resumable, chunked upload; assembled into a document or a new version on completion"""
+    STATUSES = (
+        ('active', 'Active'),
+        ('complete', 'Complete'),
+        ('failed', 'Failed'),
+    )
+    
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    owner = models.ForeignKey(User, on_delete=models.CASCADE, related_name='upload_sessions')
+    # Set up front to upload a new version, or on completion to the created document
+    document = models.ForeignKey(Document, on_delete=models.CASCADE, null=True, blank=True, related_name='upload_sessions')
+    version = models.ForeignKey(DocumentVersion, on_delete=models.SET_NULL, null=True, blank=True, related_name='+')
+    name = models.CharField(max_length=255, blank=True)
+    file_type = models.CharField(max_length=50, blank=True)
+    filename = models.CharField(max_length=255)
+    size = models.PositiveBigIntegerField()
+    sha256 = models.CharField(max_length=64, blank=True)
+    received = models.PositiveBigIntegerField(default=0)
+    status = models.CharField(max_length=20, choices=STATUSES, default='active')
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    class Meta:
+        indexes = [models.Index(fields=['status', 'updated_at'])]
+    
+    def __str__(self):
+        return f"{self.filename} ({self.received}/{self.size} bytes, {self.status})"
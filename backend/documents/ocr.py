@@ -0,0 +1,108 @@
+"""OCR for PDF pages without a text layer.
+
+Pages are rasterized with pdfium and recognized by a local Tesseract binary
+(``DOCUMENT_OCR_COMMAND``), in a process pool of ``DOCUMENT_OCR_WORKERS``
+processes. Without the binary, OCR is skipped and textless pages stay
+unsearchable, as before.
+"""
+import io
+import logging
+import shutil
+import subprocess
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+import pypdfium2 as pdfium
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+_pool = None
+_pool_workers = None
+
+
+def ocr_command():
+    """Path of the OCR binary, or None when OCR is disabled or not installed"""
+    command = getattr(settings, 'DOCUMENT_OCR_COMMAND', 'tesseract')
+    return shutil.which(command) if command else None
+
+
+def get_ocr_pool(workers):
+    """Return the shared OCR process pool, recreating it if the size changed"""
+    global _pool, _pool_workers
+    if _pool is None or _pool_workers != workers:
+        if _pool is not None:
+            _pool.shutdown()
+        _pool = ProcessPoolExecutor(max_workers=workers)
+        _pool_workers = workers
+    return _pool
+
+
+def ocr_page(path, page_index, command, languages, dpi, timeout):
+    """Process pool worker: render one page of the PDF at ``path`` and return ``(text, seconds)``"""
+    start = time.perf_counter()
+    pdf = pdfium.PdfDocument(path)
+    try:
+        page = pdf[page_index]
+        try:
+            image = page.render(scale=dpi / 72).to_pil()
+        finally:
+            page.close()
+    finally:
+        pdf.close()
+
+    png = io.BytesIO()
+    image.convert('L').save(png, 'PNG')
+    result = subprocess.run(
+        [command, 'stdin', 'stdout', '-l', languages],
+        input=png.getvalue(), capture_output=True, timeout=timeout, check=True,
+    )
+    return result.stdout.decode('utf-8', 'replace'), time.perf_counter() - start
+
+
+def with_ocr(path, pages):
+    """Fill in pages of the PDF at ``path`` that have no text layer, keeping page order.
+
+    ``pages`` are page dicts from ``extraction.iter_pages``; those with blank
+    text that weren't reused are recognized in the OCR pool and come back
+    with ``"method": "ocr"``, or ``"ocr-failed"`` and no text if Tesseract
+    failed on them. At most two pages per worker wait for OCR at a time, so
+    memory stays bounded.
+    """
+    command = ocr_command()
+    if command is None:
+        yield from pages
+        return
+
+    workers = getattr(settings, 'DOCUMENT_OCR_WORKERS', 2)
+    options = (
+        command,
+        getattr(settings, 'DOCUMENT_OCR_LANGUAGES', 'eng'),
+        getattr(settings, 'DOCUMENT_OCR_DPI', 300),
+        getattr(settings, 'DOCUMENT_OCR_TIMEOUT', 120),
+    )
+    pool = get_ocr_pool(workers)
+    waiting = deque()
+    for page in pages:
+        future = None
+        if page['same_as'] is None and not page['text'].strip():
+            future = pool.submit(ocr_page, path, page['page'] - 1, *options)
+        waiting.append((page, future))
+        # Pass pages on as soon as everything before them is done
+        while waiting and (waiting[0][1] is None or len(waiting) > 2 * workers):
+            yield _finish(*waiting.popleft())
+    while waiting:
+        yield _finish(*waiting.popleft())
+
+
+def _finish(page, future):
+    if future is None:
+        return page
+    try:
+        text, seconds = future.result()
+    except (subprocess.SubprocessError, OSError) as e:
+        # One bad page shouldn't fail the text layers of all the others
+        logger.warning("OCR failed on page %s: %s", page['page'], e)
+        return dict(page, text='', method='ocr-failed')
+    return dict(page, text=text, method='ocr', seconds=page['seconds'] + seconds)
@@ -0,0 +1,17 @@
+from django.conf import settings
+from rest_framework import pagination
+
+
+class CreatedAtCursorPagination(pagination.CursorPagination):
+    """Keyset pagination, newest first.
+
+    Unlike page numbers it needs no ``COUNT(*)`` and no ``OFFSET`` scan, so
+    deep pages cost the same as the first one. Clients pick the page size with
+    ``?page_size=``, capped at ``DOCUMENT_MAX_PAGE_SIZE``.
+    """
+    ordering = ('-created_at', '-id')
+    page_size_query_param = 'page_size'
+
+    @property
+    def max_page_size(self):
+        return getattr(settings, 'DOCUMENT_MAX_PAGE_SIZE', 100)
@@ -0,0 +1,109 @@
+"""Live annotation updates.
+
+Every annotation change is also written to the ``AnnotationEvent`` log. Each
+entry gets the next number from the document's ``last_event_seq`` counter,
+in the same transaction as the change. After that transaction commits, the
+events are sent to the document's group on the channel layer, and
+``consumers.AnnotationConsumer`` forwards them to WebSocket subscribers.
+
+A client that reconnects passes the last sequence number it saw and is sent
+whatever it missed from the log. If those events have been pruned, it is
+told to reload the annotations instead.
+"""
+import logging
+from datetime import timedelta
+
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from .models import AnnotationEvent, Document
+from .services import bump_counter
+
+logger = logging.getLogger(__name__)
+
+
+def group_name(document_id):
+    """Channel layer group for one document's annotation events"""
+    return f'document-{document_id}-annotations'
+
+
+def serialize_event(event):
+    return {
+        'seq': event.seq,
+        'op': event.op,
+        'id': event.annotation_id,
+        'annotation': event.data or None,
+        'created_at': event.created_at.isoformat(),
+    }
+
+
+def broadcast(document_id, events):
+    """Send serialized events to the document's subscribers"""
+    layer = get_channel_layer()
+    if layer is None:
+        return
+    try:
+        async_to_sync(layer.group_send)(group_name(document_id), {
+            'type': 'annotation.events',
+            'events': events,
+        })
+    except Exception as e:
+        # Subscribers notice the gap in sequence numbers and read the log
+        logger.exception("Error broadcasting annotation events for document %s: %s", document_id, e)
+
+
+def record_events(document_id, changes):
+    """Log ``(op, annotation_id, data)`` changes to a document, in order.
+
+    Call this inside the transaction that makes the changes. The events are
+    broadcast once that transaction commits, so nobody hears about a change
+    that was rolled back.
+    """
+    changes = list(changes)
+    if not changes:
+        return []
+    with transaction.atomic():
+        last = bump_counter(document_id, 'last_event_seq', by=len(changes))
+        first = last - len(changes) + 1
+        events = AnnotationEvent.objects.bulk_create([
+            AnnotationEvent(document_id=document_id, seq=first + i, op=op, annotation_id=annotation_id, data=data or {})
+            for i, (op, annotation_id, data) in enumerate(changes)
+        ])
+        payload = [serialize_event(event) for event in events]
+        transaction.on_commit(lambda: broadcast(document_id, payload))
+    return events
+
+
+def replay(document_id, since):
+    """Return ``(events, last_seq)`` with the serialized events after ``since``.
+
+    ``events`` is None if the client cannot catch up from the log: some of
+    the events it missed have been pruned, there are more than
+    ``DOCUMENT_ANNOTATION_REPLAY_MAX`` of them, or ``since`` is ahead of the
+    document. It should then reload the annotations and carry on from
+    ``last_seq``.
+    """
+    last = Document.objects.filter(pk=document_id).values_list('last_event_seq', flat=True).first() or 0
+    if since == last:
+        return [], last
+    if since > last:
+        return None, last
+
+    limit = getattr(settings, 'DOCUMENT_ANNOTATION_REPLAY_MAX', 1000)
+    events = list(AnnotationEvent.objects.filter(
+        document_id=document_id, seq__gt=since, seq__lte=last
+    ).order_by('seq')[:limit + 1])
+    if not events or events[0].seq != since + 1 or len(events) > limit:
+        return None, last
+    return [serialize_event(event) for event in events], last
+
+
+def prune_events(max_age=None):
+    """Delete logged events older than ``max_age`` and return how many"""
+    if max_age is None:
+        max_age = timedelta(seconds=getattr(settings, 'DOCUMENT_ANNOTATION_EVENT_RETENTION', 7 * 24 * 60 * 60))
+    count, _ = AnnotationEvent.objects.filter(created_at__lt=timezone.now() - max_age).delete()
+    return count
@@ -0,0 +1,7 @@
+from django.urls import path
+
+from .consumers import AnnotationConsumer
+
+websocket_urlpatterns = [
+    path('ws/documents/<int:document_id>/annotations/', AnnotationConsumer.as_asgi()),
+]
@@ -0,0 +1,197 @@
+"""In-document search over extracted pages.
+
+A query is parsed into terms (``"quoted phrases"`` stay whole) and compiled
+into a single regular expression, so each page is scanned once no matter how
+many terms there are. Results are kept in a per-process LRU cache keyed by the
+document, its current version and the normalized query, which makes repeated
+search-as-you-type requests from the viewer cheap.
+
+Search targets the current version unless a version number (or
+``ALL_VERSIONS``) is asked for; matches from every version carry their
+``"version"`` number.
+"""
+import re
+import threading
+from collections import OrderedDict
+from functools import lru_cache
+from itertools import islice
+
+from django.conf import settings
+from django.db.models import F, Q
+
+PREVIEW_CONTEXT = 50
+
+ALL_VERSIONS = 'all'
+
+
+_QUERY_TERM = re.compile(r'"([^"]+)"|(\S+)')
+
+
+def parse_query(query, case_sensitive=False):
+    """Split a query into normalized terms, keeping double-quoted phrases together"""
+    terms = []
+    for phrase, word in _QUERY_TERM.findall(query):
+        # Collapse inner whitespace so "a   b" and "a b" are the same phrase
+        term = ' '.join((phrase or word).split())
+        if term:
+            terms.append(term if case_sensitive else term.lower())
+    return tuple(dict.fromkeys(terms))
+
+
+@lru_cache(maxsize=512)
+def compile_terms(terms, case_sensitive=False, whole_word=False):
+    """Compile terms into one alternation, longest first so phrases win over their words"""
+    alternatives = '|'.join(
+        r'\s+'.join(re.escape(word) for word in term.split())
+        for term in sorted(terms, key=len, reverse=True)
+    )
+    if whole_word:
+        # Not \b, which needs a word character at each end and so never
+        # matches terms like "c++" or ".net"
+        alternatives = rf'(?<!\w)(?:{alternatives})(?!\w)'
+    return re.compile(alternatives, 0 if case_sensitive else re.IGNORECASE)
+
+
+def _page_matches(page_number, text, pattern, version=None):
+    for match in pattern.finditer(text):
+        context_start = max(0, match.start() - PREVIEW_CONTEXT)
+        context_end = min(len(text), match.end() + PREVIEW_CONTEXT)
+        preview = text[context_start:context_end]
+        if context_start > 0:
+            preview = "..." + preview
+        if context_end < len(text):
+            preview = preview + "..."
+        found = {
+            "page": page_number,
+            "text": match.group(0),
+            "preview": preview
+        }
+        if version is not None:
+            found["version"] = version
+        yield found
+
+
+def find_matches(pages, pattern, max_matches):
+    """Scan ``(page_number, text[, version])`` rows once each and return up to ``max_matches`` matches"""
+    matches = []
+    for page_number, text, *version in pages:
+        matches.extend(islice(_page_matches(page_number, text, pattern, *version), max_matches - len(matches)))
+        if len(matches) >= max_matches:
+            return matches
+    return matches
+
+
+class SearchResultCache:
+    """Thread-safe LRU mapping of search keys to match lists"""
+
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            matches = self._entries.get(key)
+            if matches is not None:
+                self._entries.move_to_end(key)
+            return matches
+
+    def set(self, key, matches):
+        with self._lock:
+            self._entries[key] = matches
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+result_cache = SearchResultCache(getattr(settings, 'DOCUMENT_SEARCH_CACHE_SIZE', 256))
+
+
+def _search_key(document, version, terms, case_sensitive, whole_word):
+    # The generation goes up whenever a version is added or deleted (and its
+    # pages with it) or extraction of one finishes, so stale entries are
+    # simply never looked up again
+    return (
+        document.id, document.current_version_id, version, document.generation,
+        terms, case_sensitive, whole_word,
+    )
+
+
+def _candidate_pages(document, terms, version=None):
+    """The pages of the searched version(s) that can contain a term.
+
+    ``version`` is a version number, ``ALL_VERSIONS`` (newest version first,
+    annotated with ``version_number``) or None for the current version.
+    """
+    if version == ALL_VERSIONS:
+        pages = document.pages.annotate(version_number=F('version__version_number')).order_by(
+            '-version_number', 'page_number'
+        )
+    elif version is not None:
+        pages = document.pages.filter(version__version_number=version)
+    else:
+        pages = document.pages.filter(version_id=document.current_version_id)
+    # SQLite's LIKE folds ASCII case only, so non-ASCII terms are filtered in Python
+    if all(term.isascii() for term in terms):
+        # A phrase may span a line break in the page text, so filter on its
+        # first word and let the regex check the rest
+        condition = Q()
+        for term in terms:
+            condition |= Q(text__icontains=term.split()[0])
+        pages = pages.filter(condition)
+    return pages
+
+
+def search_document(document, query, case_sensitive=False, whole_word=False, version=None):
+    """Return every match of ``query`` in ``document``'s extracted pages.
+
+    ``version`` picks the version to search, as for ``_candidate_pages``.
+    The list is capped at ``DOCUMENT_SEARCH_MAX_MATCHES``; callers slice it
+    for pagination.
+    """
+    terms = parse_query(query, case_sensitive)
+    if not terms:
+        return []
+
+    key = _search_key(document, version, terms, case_sensitive, whole_word)
+    matches = result_cache.get(key)
+    if matches is not None:
+        return matches
+
+    pattern = compile_terms(terms, case_sensitive, whole_word)
+    max_matches = getattr(settings, 'DOCUMENT_SEARCH_MAX_MATCHES', 5000)
+    fields = ('page_number', 'text') + (('version_number',) if version == ALL_VERSIONS else ())
+    pages = _candidate_pages(document, terms, version).values_list(*fields)
+    matches = find_matches(pages.iterator(), pattern, max_matches)
+    result_cache.set(key, matches)
+    return matches
+
+
+async def asearch_document(document, query, case_sensitive=False, whole_word=False, version=None):
+    """``search_document`` for async views; pages are streamed with the async ORM"""
+    terms = parse_query(query, case_sensitive)
+    if not terms:
+        return []
+
+    key = _search_key(document, version, terms, case_sensitive, whole_word)
+    matches = result_cache.get(key)
+    if matches is not None:
+        return matches
+
+    pattern = compile_terms(terms, case_sensitive, whole_word)
+    max_matches = getattr(settings, 'DOCUMENT_SEARCH_MAX_MATCHES', 5000)
+    matches = []
+    # values_list() querysets run their query eagerly in aiterator(), so
+    # stream (deferred) model rows instead
+    pages = _candidate_pages(document, terms, version).only('page_number', 'text')
+    async for page in pages.aiterator():
+        found = _page_matches(page.page_number, page.text, pattern, getattr(page, 'version_number', None))
+        matches.extend(islice(found, max_matches - len(matches)))
+        if len(matches) >= max_matches:
+            break
+    result_cache.set(key, matches)
+    return matches
@@ -0,0 +1,192 @@
+"""Full-text index over ``DocumentPage`` text.
+
+SQLite uses an FTS5 table and PostgreSQL a generated ``tsvector`` column with
+a GIN index (both created in migration 0005). The database maintains them
+itself through triggers or the generated column, so every write to
+``DocumentPage`` keeps the index in sync, whichever code path made it. Other
+databases fall back to a ``LIKE`` scan.
+
+Pages of every version are indexed, but library search only matches pages of
+each document's current version.
+"""
+import re
+
+from django.db import connection
+from django.db.models import F
+
+FTS_TABLE = 'documents_page_fts'
+
+_TOKEN = re.compile(r'\w+')
+
+
+class LikeIndex:
+    """Unindexed fallback for databases without a supported full-text engine"""
+
+    def search_pages(self, query, owner_id, limit):
+        from .models import DocumentPage
+
+        terms = _TOKEN.findall(query)
+        if not terms:
+            return []
+        pages = DocumentPage.objects.filter(
+            document__owner_id=owner_id, version_id=F('document__current_version_id')
+        )
+        for term in terms:
+            pages = pages.filter(text__icontains=term)
+        return [
+            (page_id, document_id, page_number, 1.0)
+            for page_id, document_id, page_number in pages.values_list('id', 'document_id', 'page_number')[:limit]
+        ]
+
+    def previews(self, query, page_ids):
+        from .models import DocumentPage
+
+        terms = _TOKEN.findall(query) or ['']
+        pages = DocumentPage.objects.filter(id__in=page_ids).only('text')
+        return {page.id: _preview(page.text, terms[0]) for page in pages}
+
+    def document_ids_sql(self, query, owner_id):
+        terms = _TOKEN.findall(query) or ['']
+        sql = (
+            'SELECT p.document_id FROM documents_documentpage p '
+            'JOIN documents_document d ON d.id = p.document_id AND p.version_id = d.current_version_id '
+            'WHERE ' + ' AND '.join(['p.text LIKE %s'] * len(terms))
+        )
+        return sql, [f'%{term}%' for term in terms]
+
+    def rebuild(self):
+        pass
+
+
+class SQLiteFTS5Index:
+    def _match(self, query):
+        # Quote every token so user input can't use FTS5 query syntax; the
+        # tokens are ANDed together
+        return ' '.join(f'"{token}"' for token in _TOKEN.findall(query))
+
+    def search_pages(self, query, owner_id, limit):
+        match = self._match(query)
+        if not match:
+            return []
+        with connection.cursor() as cursor:
+            # Matches are checked against the current version by primary key
+            cursor.execute(
+                f"SELECT {FTS_TABLE}.rowid, {FTS_TABLE}.document_id, {FTS_TABLE}.page_number, "
+                f"-{FTS_TABLE}.rank FROM {FTS_TABLE} "
+                f"JOIN documents_documentpage p ON p.id = {FTS_TABLE}.rowid "
+                "JOIN documents_document d ON d.id = p.document_id AND d.current_version_id = p.version_id "
+                f"WHERE {FTS_TABLE} MATCH %s AND {FTS_TABLE}.owner_id = %s ORDER BY {FTS_TABLE}.rank LIMIT %s",
+                [match, owner_id, limit],
+            )
+            return cursor.fetchall()
+
+    def previews(self, query, page_ids):
+        if not page_ids:
+            return {}
+        placeholders = ', '.join(['%s'] * len(page_ids))
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"SELECT rowid, snippet({FTS_TABLE}, 0, '', '', '...', 16) FROM {FTS_TABLE} "
+                f"WHERE {FTS_TABLE} MATCH %s AND rowid IN ({placeholders})",
+                [self._match(query), *page_ids],
+            )
+            return dict(cursor.fetchall())
+
+    def document_ids_sql(self, query, owner_id):
+        return (
+            f'SELECT {FTS_TABLE}.document_id FROM {FTS_TABLE} '
+            f'JOIN documents_documentpage p ON p.id = {FTS_TABLE}.rowid '
+            'JOIN documents_document d ON d.id = p.document_id AND d.current_version_id = p.version_id '
+            f'WHERE {FTS_TABLE} MATCH %s AND {FTS_TABLE}.owner_id = %s',
+            [self._match(query) or '""', owner_id],
+        )
+
+    def rebuild(self):
+        with connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM {FTS_TABLE}')
+            cursor.execute(
+                f'INSERT INTO {FTS_TABLE}(rowid, text, document_id, owner_id, page_number) '
+                'SELECT p.id, p.text, p.document_id, d.owner_id, p.page_number '
+                'FROM documents_documentpage p JOIN documents_document d ON d.id = p.document_id'
+            )
+
+
+class PostgresIndex:
+    def search_pages(self, query, owner_id, limit):
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "SELECT p.id, p.document_id, p.page_number, "
+                "ts_rank_cd(p.search_vector, plainto_tsquery('simple', %s)) AS score "
+                "FROM documents_documentpage p "
+                "JOIN documents_document d ON d.id = p.document_id AND d.current_version_id = p.version_id "
+                "WHERE d.owner_id = %s AND p.search_vector @@ plainto_tsquery('simple', %s) "
+                "ORDER BY score DESC LIMIT %s",
+                [query, owner_id, query, limit],
+            )
+            return cursor.fetchall()
+
+    def previews(self, query, page_ids):
+        if not page_ids:
+            return {}
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "SELECT id, ts_headline('simple', text, plainto_tsquery('simple', %s), "
+                "'MaxFragments=1, MinWords=8, MaxWords=20, StartSel=\"\", StopSel=\"\"') "
+                "FROM documents_documentpage WHERE id = ANY(%s)",
+                [query, list(page_ids)],
+            )
+            return dict(cursor.fetchall())
+
+    def document_ids_sql(self, query, owner_id):
+        return (
+            "SELECT p.document_id FROM documents_documentpage p "
+            "JOIN documents_document d ON d.id = p.document_id AND d.current_version_id = p.version_id "
+            "WHERE d.owner_id = %s AND p.search_vector @@ plainto_tsquery('simple', %s)",
+            [owner_id, query],
+        )
+
+    def rebuild(self):
+        # The tsvector column is generated by PostgreSQL and never goes stale
+        pass
+
+
+def _preview(text, term, context=50):
+    index = text.lower().find(term.lower())
+    if index == -1:
+        return text[:2 * context]
+    start = max(0, index - context)
+    end = min(len(text), index + len(term) + context)
+    return ('...' if start > 0 else '') + text[start:end] + ('...' if end < len(text) else '')
+
+
+def get_index():
+    if connection.vendor == 'sqlite':
+        return SQLiteFTS5Index()
+    if connection.vendor == 'postgresql':
+        return PostgresIndex()
+    return LikeIndex()
+
+
+def search_library(query, owner_id, limit=20, hits_per_document=3, max_pages=500):
+    """Return ranked ``(document_id, score, hits)`` for a user's documents.
+
+    Documents are ordered by their best-scoring page; ``hits`` holds up to
+    ``hits_per_document`` ``{"page", "score", "preview"}`` dicts. Previews
+    are only built for the hits that are returned.
+    """
+    index = get_index()
+    results = {}
+    for page_id, document_id, page_number, score in index.search_pages(query, owner_id, max_pages):
+        if document_id not in results:
+            if len(results) >= limit:
+                continue
+            results[document_id] = {"score": score, "hits": []}
+        entry = results[document_id]
+        if len(entry["hits"]) < hits_per_document:
+            entry["hits"].append({"id": page_id, "page": page_number, "score": score})
+
+    previews = index.previews(query, [hit["id"] for entry in results.values() for hit in entry["hits"]])
+    for entry in results.values():
+        for hit in entry["hits"]:
+            hit["preview"] = previews.get(hit.pop("id"), "")
+    return [(document_id, entry["score"], entry["hits"]) for document_id, entry in results.items()]
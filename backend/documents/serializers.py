@@ -1,7 +1,37 @@
-from rest_framework import serializers
-from .models import Document, DocumentVersion, Annotation
+import os
+import re
+
+from django.conf import settings
+from rest_framework import permissions, serializers
+from .models import Document, DocumentVersion, DocumentPage, Annotation, UploadSession
 from django.contrib.auth.models import User
 
+EXPANDABLE_FIELDS = ('versions', 'annotations')
+
+def get_expand(request):
+    """Return the nested collections requested with ``?expand=versions,annotations``"""
+    if request is None:
+        return set()
+    expand = request.query_params.get('expand', '')
+    return {name.strip() for name in expand.split(',')} & set(EXPANDABLE_FIELDS)
+
+class DynamicFieldsMixin:
+    """Trim the output to ``?fields=a,b`` when a read request asks for a sparse fieldset.
+
+    Writes ignore ``fields`` so they never drop writable fields from the input.
+    """
+    
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        request = self.context.get('request')
+        if request is None or request.method not in permissions.SAFE_METHODS:
+            return
+        fields = request.query_params.get('fields')
+        if fields:
+            requested = {name.strip() for name in fields.split(',')}
+            for name in set(self.fields) - requested:
+                self.fields.pop(name)
+
 class UserSerializer(serializers.ModelSerializer):
     class Meta:
         model = User
@@ -20,29 +50,25 @@ class AnnotationSerializer(serializers.ModelSerializer):
         validated_data['user'] = self.context['request'].user
         return super().create(validated_data)
 
+class DocumentPageSerializer(serializers.ModelSerializer):
+    page = serializers.ReadOnlyField(source='page_number')
+    
+    class Meta:
+        model = DocumentPage
+        fields = ['page', 'version', 'text', 'method']
+
 class DocumentVersionSerializer(serializers.ModelSerializer):
     created_by = serializers.ReadOnlyField(source='created_by.username')
     file_url = serializers.ReadOnlyField()
     
     class Meta:
         model = DocumentVersion
-        fields = ['id', 'document', 'version_number', 'file', 'file_url', 
-                 'created_at', 'created_by']
-        read_only_fields = ['document', 'version_number', 'created_by', 'created_at']
-    
-    def create(self, validated_data):
-        # Auto-increment version number
-        validated_data['version_number'] = 1
-        document = validated_data.get('document')
-        if document:
-            latest_version = document.versions.order_by('-version_number').first()
-            if latest_version:
-                validated_data['version_number'] = latest_version.version_number + 1
-        
-        validated_data['created_by'] = self.context['request'].user
-        return super().create(validated_data)
+        fields = ['id', 'document', 'version_number', 'file', 'file_url', 'original_name',
+                 'created_at', 'created_by', 'extraction_status']
+        read_only_fields = ['document', 'version_number', 'original_name', 'created_by', 'created_at',
+                            'extraction_status']
 
-class DocumentSerializer(serializers.ModelSerializer):
+class DocumentSerializer(DynamicFieldsMixin, serializers.ModelSerializer):
     owner = UserSerializer(read_only=True)
     versions = DocumentVersionSerializer(many=True, read_only=True)
     annotations = AnnotationSerializer(many=True, read_only=True)
@@ -52,11 +78,73 @@ class DocumentSerializer(serializers.ModelSerializer):
     class Meta:
         model = Document
         fields = ['id', 'name', 'file', 'file_type', 'created_at', 'updated_at', 
-                 'owner', 'is_ocr_processed', 'text_content', 'versions', 
+                 'owner', 'extraction_status', 'versions', 
                  'annotations', 'url', 'current_version', 'current_version_id']
-        read_only_fields = ['owner', 'created_at', 'updated_at', 'is_ocr_processed', 
+        read_only_fields = ['owner', 'created_at', 'updated_at', 'extraction_status', 
                            'current_version_id', 'url']
     
     def create(self, validated_data):
         validated_data['owner'] = self.context['request'].user
-        return super().create(validated_data) 
\ No newline at end of file
+        return super().create(validated_data)
+
+class DocumentListSerializer(DynamicFieldsMixin, serializers.ModelSerializer):
+    """Compact list representation: counts instead of nested collections and no text.
+
+    Nested ``versions``/``annotations`` are only included when requested with
+    ``?expand=``; the view prefetches them in that case.
+    """
+    owner = UserSerializer(read_only=True)
+    versions = DocumentVersionSerializer(many=True, read_only=True)
+    annotations = AnnotationSerializer(many=True, read_only=True)
+    version_count = serializers.IntegerField(read_only=True)
+    annotation_count = serializers.IntegerField(read_only=True)
+    url = serializers.ReadOnlyField()
+    current_version_id = serializers.ReadOnlyField()
+    
+    class Meta:
+        model = Document
+        fields = ['id', 'name', 'file', 'file_type', 'created_at', 'updated_at',
+                 'owner', 'extraction_status', 'url', 'current_version', 'current_version_id',
+                 'version_count', 'annotation_count', 'versions', 'annotations']
+        read_only_fields = fields
+    
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        expand = get_expand(self.context.get('request'))
+        for name in EXPANDABLE_FIELDS:
+            if name not in expand:
+                self.fields.pop(name, None)
+
+class UploadSessionSerializer(serializers.ModelSerializer):
+    """Opens a chunked upload; ``offset`` is where the next chunk must start"""
+    offset = serializers.ReadOnlyField(source='received')
+    
+    class Meta:
+        model = UploadSession
+        fields = ['id', 'filename', 'size', 'sha256', 'name', 'file_type', 'document',
+                 'offset', 'status', 'version', 'created_at', 'updated_at']
+        read_only_fields = ['status', 'version', 'created_at', 'updated_at']
+    
+    def validate_size(self, value):
+        max_size = getattr(settings, 'DOCUMENT_UPLOAD_MAX_SIZE', None)
+        if value < 1:
+            raise serializers.ValidationError("File is empty")
+        if max_size and value > max_size:
+            raise serializers.ValidationError(f"File is larger than {max_size} bytes")
+        return value
+    
+    def validate_sha256(self, value):
+        if value and not re.fullmatch(r'[0-9a-fA-F]{64}', value):
+            raise serializers.ValidationError("Expected a hex-encoded SHA-256 digest")
+        return value.lower()
+    
+    def validate_document(self, value):
+        # New versions can only be uploaded to your own documents
+        if value is not None and value.owner_id != self.context['request'].user.id:
+            raise serializers.ValidationError("Document not found")
+        return value
+    
+    def validate(self, attrs):
+        if not attrs.get('file_type'):
+            attrs['file_type'] = os.path.splitext(attrs['filename'])[1].lstrip('.').lower()
+        return attrs
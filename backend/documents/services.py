@@ -0,0 +1,119 @@
+"""Creating documents and versions from files already in the blob store.
+
+Both the multipart upload endpoints and completed chunked upload sessions go
+through these helpers, so every upload path numbers versions, takes blob
+references and queues text extraction and thumbnails the same way.
+"""
+import os
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .blobstore import acquire
+from .extraction import can_extract
+from .jobs import enqueue
+from .models import Document, DocumentVersion
+from .thumbnails import can_render
+
+
+def queue_thumbnails(version):
+    """Render the first pages of a new version in the background"""
+    if can_render(version.file.name):
+        enqueue('render_version_thumbnails', version_id=version.id)
+
+
+def queue_delta(version):
+    """Re-store the file of the version a new one superseded as a delta in the background"""
+    if getattr(settings, 'DOCUMENT_VERSION_DELTAS', False) and version.version_number > 2:
+        enqueue('delta_encode_version', version_id=version.id)
+
+
+def bump_counter(document_id, field, by=1):
+    """Atomically add ``by`` to one of a document's counters and return the new value.
+
+    The counter is bumped and read back in one ``UPDATE ... RETURNING`` where
+    the database supports it. Either way the UPDATE locks the document row
+    until the surrounding transaction ends, so concurrent requests queue up
+    instead of racing for the same numbers.
+    """
+    table = connection.ops.quote_name(Document._meta.db_table)
+    column = connection.ops.quote_name(Document._meta.get_field(field).column)
+    if connection.features.can_return_columns_from_insert:
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'UPDATE {table} SET {column} = {column} + %s WHERE id = %s RETURNING {column}',
+                [by, document_id]
+            )
+            return cursor.fetchone()[0]
+
+    Document.objects.filter(pk=document_id).update(**{field: F(field) + by})
+    return Document.objects.filter(pk=document_id).values_list(field, flat=True).get()
+
+
+def allocate_version_number(document_id):
+    """Take the next version number for a document"""
+    return bump_counter(document_id, 'last_version_number')
+
+
+def add_version(document, blob, user, original_name=''):
+    """Append a version holding ``blob`` to ``document``, make it current and queue its text extraction.
+
+    The caller's blob reference from ``store`` is handed to the version.
+    Every upload path goes through here, so numbers never collide.
+    ``original_name`` is the uploaded file's name, which downloads keep.
+    """
+    extractable = can_extract(document.file_type, blob.file.name)
+    status = 'pending' if extractable else 'skipped'
+    with transaction.atomic():
+        version_number = allocate_version_number(document.pk)
+        version = DocumentVersion.objects.create(
+            document=document,
+            version_number=version_number,
+            file=blob.file.name,
+            original_name=os.path.basename(original_name)[:255],
+            sha256=blob.sha256,
+            created_by=user,
+            extraction_status=status,
+        )
+
+        # Set this as the current version without overwriting the counter
+        # (or anything else) another request changed meanwhile
+        now = timezone.now()
+        Document.objects.filter(pk=document.pk).update(
+            current_version=version, extraction_status=status, updated_at=now
+        )
+        document.current_version = version
+        document.extraction_status = status
+        document.last_version_number = version_number
+        document.updated_at = now
+
+        # Extract text in the background so upload latency doesn't depend on file size
+        if extractable:
+            enqueue('extract_version_text', version_id=version.id)
+        queue_thumbnails(version)
+        queue_delta(version)
+    return version
+
+
+def start_document(document, blob, user, original_name=''):
+    """Create version 1 of a just-saved document from ``blob``.
+
+    ``document.file`` must already name the blob; the caller's reference from
+    ``store`` belongs to it and the new version takes one more.
+    """
+    with transaction.atomic():
+        acquire(blob)
+        version = add_version(document, blob, user, original_name)
+    return version
+
+
+def create_document(owner, name, file_type, blob, original_name=''):
+    """Create a document (and its first version) owned by ``owner`` from ``blob``"""
+    with transaction.atomic():
+        document = Document.objects.create(
+            name=name, file=blob.file.name, file_type=file_type, owner=owner
+        )
+        start_document(document, blob, owner, original_name)
+    return document
@@ -0,0 +1,60 @@
+from django.contrib.auth.models import User
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from rest_framework.authtoken.models import Token
+
+from .authentication import token_cache
+from .blobstore import release
+from .caching import bump_generation
+from .models import Annotation, Document, DocumentVersion
+
+
+@receiver(post_delete, sender=DocumentVersion)
+def release_version_blob(sender, instance, **kwargs):
+    """Drop the deleted version's reference on its stored file"""
+    release(instance.file.name)
+
+
+@receiver(post_delete, sender=Document)
+def release_document_blob(sender, instance, **kwargs):
+    """Drop the deleted document's reference on its original upload"""
+    release(instance.file.name)
+
+
+@receiver(post_save, sender=Document)
+def document_saved(sender, instance, created, **kwargs):
+    """Invalidate cached responses for an edited document"""
+    if not created:
+        bump_generation(instance.pk)
+
+
+@receiver(post_save, sender=DocumentVersion)
+@receiver(post_save, sender=Annotation)
+def child_saved(sender, instance, **kwargs):
+    """Invalidate cached responses for the document a version or annotation belongs to"""
+    bump_generation(instance.document_id)
+
+
+@receiver(post_delete, sender=DocumentVersion)
+@receiver(post_delete, sender=Annotation)
+def child_deleted(sender, instance, origin=None, **kwargs):
+    # Rows removed in a cascade (their document or its owner being deleted)
+    # leave nothing behind to invalidate. Queryset deletes are bulk writes:
+    # like bulk_create and bulk_update, their callers bump the generation
+    # once instead of once per row
+    if isinstance(origin, sender):
+        bump_generation(instance.document_id)
+
+
+@receiver(post_save, sender=Token)
+@receiver(post_delete, sender=Token)
+def forget_token(sender, instance, **kwargs):
+    """Stop accepting a deleted (logged out or rotated) token from the cache"""
+    token_cache.discard(instance.key)
+
+
+@receiver(post_save, sender=User)
+def forget_user_tokens(sender, instance, created, **kwargs):
+    # The cached user may have been deactivated or changed its password
+    if not created:
+        token_cache.discard_user(instance.pk)
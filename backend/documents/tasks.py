@@ -0,0 +1,210 @@
+import logging
+import time
+from itertools import islice
+
+from django.conf import settings
+from django.db.models import Case, F, Value, When
+from django.utils import timezone
+
+from . import extraction_cache
+from .deltas import encode_blob, materialize
+from .extraction import get_extractor, iter_file_pages
+from .jobs import task
+from .metrics import (
+    extraction_cache_lookups, extraction_chars, extraction_duration, extraction_page_duration, extraction_pages,
+    extraction_reused_pages,
+)
+from .models import Blob, Document, DocumentPage, DocumentVersion
+from .thumbnails import render_version
+
+logger = logging.getLogger(__name__)
+extraction_logger = logging.getLogger('documents.extraction')
+
+
+def set_extraction_status(version_id, document_id, status, **fields):
+    """Record a version's extraction status; the document follows its current version"""
+    DocumentVersion.objects.filter(pk=version_id).update(extraction_status=status, **fields)
+    Document.objects.filter(pk=document_id).update(
+        extraction_status=Case(When(current_version_id=version_id, then=Value(status)), default=F('extraction_status')),
+        updated_at=timezone.now(),
+        generation=F('generation') + 1,
+    )
+
+
+def mark_extraction_failed(payload, exc):
+    """Record that a version's extraction gave up after its last retry"""
+    if 'version_id' in payload:
+        versions = DocumentVersion.objects.filter(pk=payload['version_id'])
+    else:
+        versions = DocumentVersion.objects.filter(current_for=payload['document_id'])
+    version = versions.first()
+    if version is not None:
+        set_extraction_status(version.pk, version.document_id, 'failed')
+    logger.error("Giving up on text extraction for %s: %s", payload, exc)
+
+
+def earlier_version(version):
+    """The latest version before ``version`` with extracted pages, or None"""
+    return DocumentVersion.objects.filter(
+        document_id=version.document_id, version_number__lt=version.version_number,
+        extraction_status='completed',
+    ).exclude(page_hashes={}).order_by('-version_number').first()
+
+
+@task('extract_version_text', on_failure=mark_extraction_failed)
+def extract_version_text(version_id):
+    """Extract the text of a version's file into ``DocumentPage`` rows.
+
+    A file whose text is in the extraction cache (see ``extraction_cache``)
+    is not read at all; its cached pages are copied. Otherwise pages whose
+    fingerprint matches a page of the previous version reuse its text, and
+    the result is cached for later uploads of the same file. Every page
+    records how its text was obtained and how long that took.
+    """
+    version = DocumentVersion.objects.select_related('document').filter(pk=version_id).first()
+    if version is None:
+        # Deleted before the job ran
+        return
+    document_id = version.document_id
+
+    extraction = get_extractor(version.document.file_type, version.file.name)
+    if extraction is None:
+        set_extraction_status(version_id, document_id, 'skipped')
+        return
+    file_format = extraction.format
+    cache_key = extraction.key
+
+    set_extraction_status(version_id, document_id, 'processing')
+
+    start = time.perf_counter()
+    source = cache = None
+    cached = extraction_cache.lookup(version.sha256, cache_key)
+    extraction_cache_lookups.inc(result='hit' if cached is not None else 'miss')
+    if cached is not None:
+        page_texts = extraction_cache.cached_pages(cached)
+    else:
+        stored = materialize(version.file)
+        if not stored.size:
+            # Retrying won't give an empty upload any text
+            logger.warning("Not extracting text from version %s: its file is empty", version_id)
+            set_extraction_status(version_id, document_id, 'failed')
+            return
+        source = earlier_version(version)
+        known = {fingerprint: int(number) for number, fingerprint in source.page_hashes.items()} if source else None
+        page_texts = iter_file_pages(stored, extraction.extract, known)
+        cache = extraction_cache.writer(version.sha256, cache_key)
+
+    # Pages are written (and indexed by the database) batch by batch as they
+    # are extracted, so no more than a batch is held in memory. Searches see
+    # the version as 'processing' until every page is in.
+    batch_size = getattr(settings, 'DOCUMENT_EXTRACTION_BATCH_PAGES', 200)
+    page_hashes = {}
+    # Pages, characters and seconds per extraction method, for the log
+    totals = {}
+    try:
+        # Replace pages left by an earlier attempt
+        DocumentPage.objects.filter(version_id=version_id).delete()
+        while batch := list(islice(page_texts, batch_size)):
+            same_as = [page['same_as'] for page in batch if page['same_as'] is not None]
+            earlier = dict(source.pages.filter(page_number__in=same_as).values_list('page_number', 'text')) if same_as else {}
+            for page in batch:
+                if page['same_as'] is not None:
+                    page['text'] = earlier.get(page['same_as'], '')
+            if cache is not None:
+                cache.add(batch)
+            DocumentPage.objects.bulk_create([
+                DocumentPage(
+                    document_id=document_id,
+                    version_id=version_id,
+                    page_number=page['page'],
+                    text=page['text'],
+                    method=page['method'],
+                    extraction_ms=round(page['seconds'] * 1000, 3),
+                )
+                for page in batch
+            ])
+            for page in batch:
+                if page['hash']:
+                    page_hashes[str(page['page'])] = page['hash']
+                labels = {'format': file_format, 'method': page['method']}
+                extraction_page_duration.observe(page['seconds'], **labels)
+                extraction_chars.inc(len(page['text']), **labels)
+                pages, chars, seconds = totals.get(page['method'], (0, 0, 0.0))
+                totals[page['method']] = (pages + 1, chars + len(page['text']), seconds + page['seconds'])
+    except Exception:
+        if cache is not None:
+            cache.discard()
+        extraction_duration.observe(time.perf_counter() - start, status='error')
+        raise
+    if cache is not None:
+        if 'ocr-failed' in totals:
+            # Not cached, so the next upload of the file tries OCR again
+            cache.discard()
+        else:
+            cache.finish()
+
+    # Update only the status so concurrent edits to the name survive
+    set_extraction_status(version_id, document_id, 'completed', page_hashes=page_hashes)
+    elapsed = time.perf_counter() - start
+    extraction_duration.observe(elapsed, status='completed')
+    reused = totals.get('reused', (0,))[0]
+    extraction_pages.inc(sum(pages for pages, _, _ in totals.values()) - reused)
+    extraction_reused_pages.inc(reused)
+    extraction_logger.info('extracted text', extra={'fields': {
+        'version_id': version_id,
+        'format': file_format,
+        'cached': cached is not None,
+        'seconds': round(elapsed, 3),
+        **{
+            f'{method}_{name}': round(value, 3) if name == 'seconds' else value
+            for method, values in totals.items()
+            for name, value in zip(('pages', 'chars', 'seconds'), values)
+        },
+    }})
+
+
+@task('extract_document_text', on_failure=mark_extraction_failed)
+def extract_document_text(document_id):
+    """Jobs queued before extraction was per version: extract the current version"""
+    version_id = Document.objects.filter(pk=document_id).values_list('current_version_id', flat=True).first()
+    if version_id:
+        extract_version_text(version_id)
+
+
+def log_render_failure(payload, exc):
+    """Thumbnails are rendered on demand later, so a failed job is only logged"""
+    logger.error("Giving up on thumbnails for version %s: %s", payload['version_id'], exc)
+
+
+@task('render_version_thumbnails', on_failure=log_render_failure)
+def render_version_thumbnails(version_id):
+    """Pre-render thumbnails and previews for the first pages of a version"""
+    version = DocumentVersion.objects.filter(pk=version_id).first()
+    if version is None:
+        # Deleted before the job ran
+        return
+    render_version(version)
+
+
+def log_delta_failure(payload, exc):
+    """The version's file stays stored in full, so a failed job is only logged"""
+    logger.error("Giving up on delta encoding for version %s: %s", payload['version_id'], exc)
+
+
+@task('delta_encode_version', on_failure=log_delta_failure)
+def delta_encode_version(version_id):
+    """Store the file of the version that ``version_id`` superseded as a delta against its predecessor's"""
+    version = DocumentVersion.objects.filter(pk=version_id).first()
+    if version is None:
+        # Deleted before the job ran
+        return
+    # The newest version stays whole, so the current file is never rebuilt
+    superseded = list(DocumentVersion.objects.filter(
+        document_id=version.document_id, version_number__lt=version.version_number
+    ).order_by('-version_number').values_list('file', flat=True)[:2])
+    if len(superseded) < 2:
+        return
+    blob = Blob.objects.filter(file=superseded[0]).first()
+    base = Blob.objects.filter(file=superseded[1]).first()
+    if blob is not None and base is not None:
+        encode_blob(blob, base)
@@ -1,3 +1,1901 @@
-from django.test import TestCase
+import hashlib
+import io
+import json
+import os
+import shutil
+import tempfile
+import threading
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from unittest import mock
 
-# Create your tests here.
+from asgiref.sync import sync_to_async
+from channels.db import database_sync_to_async
+from channels.testing import WebsocketCommunicator
+from django.contrib.auth.models import User
+from django.core.files.base import ContentFile
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import IntegrityError, connection
+from django.db.migrations.executor import MigrationExecutor
+from django.db.migrations.loader import MigrationLoader
+from django.test import AsyncRequestFactory, TestCase, TransactionTestCase, override_settings
+from django.utils import timezone
+from PIL import Image
+from PyPDF2.errors import EmptyFileError
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+
+from docmanager.asgi import application
+from . import async_views, caching, deltas, extraction_cache, jobs, metrics
+from .authentication import CachedTokenAuthentication, token_cache
+from .blobstore import release, store
+from .extraction import (
+    can_extract, extract_docx, extract_html, extract_pdf, extract_pdf_pages_parallel, extract_text_file,
+    get_extraction_pool, get_extractor, iter_pages, page_count,
+)
+from .management.commands._fixtures import build_text_pdf, fake_page_text, revise_text
+from .management.commands.dedupe_media import walk_storage
+from .models import (
+    Annotation, AnnotationEvent, Blob, Document, DocumentPage, DocumentVersion, ExtractedFile, ExtractedPage, Job,
+    UploadSession,
+)
+from .search_engine import compile_terms, find_matches, parse_query, result_cache, search_document
+from .search_index import search_library
+from .services import add_version, create_document
+from .tasks import extract_version_text
+from .thumbnails import ThumbnailCache
+
+
+def make_document(owner, name, versions=1, annotations=0):
+    document = Document.objects.create(
+        name=name, file=f'documents/{name}.pdf', file_type='pdf', owner=owner,
+        extraction_status='completed',
+    )
+    for number in range(1, versions + 1):
+        version = DocumentVersion.objects.create(
+            document=document, version_number=number,
+            file=f'document_versions/{name}-{number}.pdf', created_by=owner,
+            extraction_status='completed',
+        )
+    document.current_version = version
+    document.last_version_number = versions
+    document.save(update_fields=['current_version', 'last_version_number'])
+    for i in range(annotations):
+        Annotation.objects.create(document=document, user=owner, type='comment', content=f'note {i}')
+    return document
+
+
+def pdf_with_blank_page():
+    """A page with a text layer followed by one without, which goes to OCR"""
+    import PyPDF2
+    writer = PyPDF2.PdfWriter()
+    writer.add_page(PyPDF2.PdfReader(io.BytesIO(build_text_pdf(1, words_per_page=8))).pages[0])
+    writer.add_blank_page(595, 842)
+    out = io.BytesIO()
+    writer.write(out)
+    return out.getvalue()
+
+
+job_calls = []
+job_failures = []
+
+
+@jobs.task('tests.record', on_failure=lambda payload, exc: job_failures.append((payload, str(exc))))
+def record_call(value, fail=False):
+    job_calls.append(value)
+    if fail:
+        raise RuntimeError(f'failed {value}')
+
+
+@override_settings(DOCUMENT_JOB_MAX_ATTEMPTS=3, DOCUMENT_JOB_RETRY_BACKOFF=30,
+                   DOCUMENT_JOB_RETRY_BACKOFF_MAX=100, DOCUMENT_JOB_LOCK_TIMEOUT=600)
+class JobQueueTests(TestCase):
+    def setUp(self):
+        job_calls.clear()
+        job_failures.clear()
+        self.queue = jobs.DatabaseJobQueue()
+
+    def test_retry_delay_doubles_up_to_the_cap(self):
+        self.assertEqual([jobs.retry_delay(n).total_seconds() for n in range(1, 6)], [30, 60, 100, 100, 100])
+
+    def test_jobs_run_once_and_complete(self):
+        self.queue.enqueue_many('tests.record', [{'value': 1}, {'value': 2}])
+
+        self.assertEqual(self.queue.work(), 2)
+        self.assertEqual(self.queue.work(), 0)
+        self.assertEqual(job_calls, [1, 2])
+        self.assertEqual(set(Job.objects.values_list('status', flat=True)), {'completed'})
+
+    def test_claimed_jobs_are_not_claimed_again(self):
+        self.queue.enqueue('tests.record', value=1)
+
+        [job] = self.queue.claim(10)
+
+        self.assertEqual(self.queue.claim(10), [])
+        self.assertEqual(Job.objects.get(pk=job.pk).status, 'running')
+
+    def test_failed_job_is_retried_with_backoff_then_fails(self):
+        job = self.queue.enqueue('tests.record', value=1, fail=True)
+
+        for attempt in (1, 2):
+            before = timezone.now()
+            self.assertEqual(self.queue.work(), 1)
+            job.refresh_from_db()
+            self.assertEqual((job.status, job.attempts), ('queued', attempt))
+            self.assertIn('RuntimeError', job.last_error)
+            self.assertGreaterEqual(job.run_after, before + jobs.retry_delay(attempt))
+            # Not due until the backoff has passed
+            self.assertEqual(self.queue.work(), 0)
+            Job.objects.filter(pk=job.pk).update(run_after=timezone.now())
+        self.assertEqual(job_failures, [])
+
+        self.queue.work()
+
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts), ('failed', 3))
+        self.assertEqual(job_failures, [({'value': 1, 'fail': True}, 'failed 1')])
+        self.assertEqual(job_calls, [1, 1, 1])
+
+    def test_stale_running_jobs_are_reclaimed(self):
+        job = self.queue.enqueue('tests.record', value=1)
+        self.queue.claim(10)
+        self.assertEqual(self.queue.work(), 0)
+
+        Job.objects.filter(pk=job.pk).update(locked_at=timezone.now() - timedelta(seconds=601))
+
+        self.assertEqual(self.queue.work(), 1)
+        self.assertEqual(Job.objects.get(pk=job.pk).status, 'completed')
+
+    def test_unknown_tasks_are_rejected_when_queued(self):
+        with self.assertRaises(KeyError):
+            self.queue.enqueue('tests.missing')
+
+    def test_immediate_queue_runs_inline(self):
+        queue = jobs.ImmediateJobQueue()
+
+        queue.enqueue('tests.record', value=1)
+        queue.enqueue('tests.record', value=2, fail=True)
+
+        self.assertEqual(job_calls, [1, 2])
+        self.assertEqual(job_failures, [({'value': 2, 'fail': True}, 'failed 2')])
+        self.assertFalse(Job.objects.exists())
+
+    def test_process_jobs_command(self):
+        self.queue.enqueue_many('tests.record', [{'value': n} for n in range(3)])
+        out = io.StringIO()
+
+        with self.settings(DOCUMENT_JOB_QUEUE='documents.jobs.DatabaseJobQueue'):
+            call_command('process_jobs', '--once', '--batch-size=2', stdout=out)
+
+        self.assertEqual(job_calls, [0, 1, 2])
+        self.assertIn('Processed 3 job(s)', out.getvalue())
+
+
+class DocumentPageMigrationTests(TransactionTestCase):
+    text_content = '\n\n--- PAGE 1 ---\n\nfirst page\n\n--- PAGE 2 ---\n\nsecond\n\npage'
+
+    def migrate(self, target):
+        executor = MigrationExecutor(connection)
+        executor.loader.build_graph()
+        executor.migrate([('documents', target)])
+        return executor.loader.project_state([('documents', target)]).apps
+
+    def tearDown(self):
+        self.migrate(MigrationLoader(connection).graph.leaf_nodes('documents')[0][1])
+
+    def test_text_content_is_split_into_pages_and_joined_back(self):
+        apps = self.migrate('0003_document_extraction_status_job')
+        Document = apps.get_model('documents', 'Document')
+        DocumentVersion = apps.get_model('documents', 'DocumentVersion')
+        owner = apps.get_model('auth', 'User').objects.create(username='reviewer')
+        document = Document.objects.create(
+            name='contract', file='documents/contract.pdf', file_type='pdf', owner=owner,
+            text_content=self.text_content,
+        )
+        version = DocumentVersion.objects.create(document=document, version_number=1, file='document_versions/contract.pdf')
+        Document.objects.filter(pk=document.pk).update(current_version=version)
+        Document.objects.create(name='empty', file='documents/empty.pdf', file_type='pdf', owner=owner)
+
+        apps = self.migrate('0004_document_pages')
+        pages = apps.get_model('documents', 'DocumentPage').objects.order_by('page_number')
+        # 0013 attaches them to a version
+        self.assertEqual(
+            list(pages.values_list('document_id', 'version_id', 'page_number', 'text')),
+            [(document.pk, None, 1, 'first page'), (document.pk, None, 2, 'second\n\npage')],
+        )
+
+        apps = self.migrate('0003_document_extraction_status_job')
+        Document = apps.get_model('documents', 'Document')
+        self.assertEqual(Document.objects.get(pk=document.pk).text_content, self.text_content)
+        self.assertIn(Document.objects.get(name='empty').text_content, (None, ''))
+
+    def test_pages_go_to_the_version_they_were_extracted_from(self):
+        apps = self.migrate('0003_document_extraction_status_job')
+        Document = apps.get_model('documents', 'Document')
+        DocumentVersion = apps.get_model('documents', 'DocumentVersion')
+        owner = apps.get_model('auth', 'User').objects.create(username='reviewer')
+        documents = {}
+        for name, newer in [('revised', True), ('unchanged', False)]:
+            document = Document.objects.create(
+                name=name, file=f'documents/{name}.pdf', file_type='pdf', owner=owner,
+                text_content=self.text_content, extraction_status='completed',
+            )
+            # The first version shares the document's file, which text was extracted from
+            first = DocumentVersion.objects.create(document=document, version_number=1, file=document.file)
+            current = first
+            if newer:
+                current = DocumentVersion.objects.create(
+                    document=document, version_number=2, file=f'document_versions/{name}-2.pdf'
+                )
+            Document.objects.filter(pk=document.pk).update(current_version=current)
+            documents[name] = (document.pk, first.pk, current.pk)
+
+        apps = self.migrate('0013_version_extraction')
+        Document = apps.get_model('documents', 'Document')
+        DocumentVersion = apps.get_model('documents', 'DocumentVersion')
+        DocumentPage = apps.get_model('documents', 'DocumentPage')
+        Job = apps.get_model('documents', 'Job')
+
+        document_id, first_id, current_id = documents['revised']
+        self.assertEqual(set(DocumentPage.objects.filter(document_id=document_id).values_list('version_id', flat=True)),
+                         {first_id})
+        self.assertEqual(DocumentVersion.objects.get(pk=first_id).extraction_status, 'completed')
+        # The newer current version is extracted instead of inheriting the first one's text
+        self.assertEqual(DocumentVersion.objects.get(pk=current_id).extraction_status, 'pending')
+        self.assertEqual(Document.objects.get(pk=document_id).extraction_status, 'pending')
+        self.assertEqual([job.payload for job in Job.objects.filter(task='extract_version_text')],
+                         [{'version_id': current_id}])
+
+        document_id, first_id, current_id = documents['unchanged']
+        self.assertEqual(set(DocumentPage.objects.filter(document_id=document_id).values_list('version_id', flat=True)),
+                         {current_id})
+        self.assertEqual(Document.objects.get(pk=document_id).extraction_status, 'completed')
+
+    def test_pages_without_a_version_are_unique(self):
+        document = Document.objects.create(
+            name='contract', file='documents/contract.pdf', file_type='pdf',
+            owner=User.objects.create_user('reviewer', 'reviewer@example.com', 'password'),
+        )
+        DocumentPage.objects.create(document=document, page_number=1, text='first')
+
+        with self.assertRaises(IntegrityError):
+            DocumentPage.objects.create(document=document, page_number=1, text='again')
+
+
+class LibrarySearchTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('reviewer', 'reviewer@example.com', 'password')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def add_pages(self, document, *texts):
+        for number, text in enumerate(texts, start=1):
+            DocumentPage.objects.create(
+                document=document, version=document.current_version, page_number=number, text=text
+            )
+
+    def search(self, query):
+        response = self.client.get('/api/documents/search/', {'q': query})
+        self.assertEqual(response.status_code, 200)
+        return response.json()['results']
+
+    def filtered(self, query):
+        response = self.client.get('/api/documents/', {'search': query})
+        self.assertEqual(response.status_code, 200)
+        return {row['name'] for row in response.json()['results']}
+
+    def test_search_endpoint_matches_page_text(self):
+        document = make_document(self.user, 'contract')
+        self.add_pages(document, 'payment terms', 'the indemnity clause survives termination')
+
+        [result] = self.search('indemnity')
+
+        self.assertEqual(result['id'], document.id)
+        self.assertEqual([hit['page'] for hit in result['hits']], [2])
+        self.assertIn('indemnity', result['hits'][0]['preview'])
+
+    def test_list_search_filter_matches_page_text(self):
+        self.add_pages(make_document(self.user, 'contract'), 'the indemnity clause')
+        self.add_pages(make_document(self.user, 'invoice'), 'amount due')
+
+        self.assertEqual(self.filtered('indemnity'), {'contract'})
+
+    def test_results_are_ranked_by_best_page(self):
+        self.add_pages(make_document(self.user, 'passing'), 'indemnity ' + 'filler words ' * 50)
+        self.add_pages(make_document(self.user, 'focused'), 'indemnity indemnity indemnity clause')
+
+        results = self.search('indemnity')
+
+        self.assertEqual([result['name'] for result in results], ['focused', 'passing'])
+        self.assertGreater(results[0]['score'], results[1]['score'])
+
+    def test_other_users_documents_are_not_found(self):
+        other = User.objects.create_user('other', 'other@example.com', 'password')
+        self.add_pages(make_document(other, 'theirs'), 'the indemnity clause')
+
+        self.assertEqual(self.search('indemnity'), [])
+        self.assertEqual(self.filtered('indemnity'), set())
+
+    def test_index_follows_page_writes(self):
+        def matches(query):
+            # The index itself, below the response cache
+            return [document_id for document_id, _, _ in search_library(query, self.user.id)]
+
+        document = make_document(self.user, 'contract')
+        self.add_pages(document, 'the indemnity clause')
+        page = document.pages.get()
+        self.assertEqual(matches('indemnity'), [document.id])
+
+        page.text = 'the arbitration clause'
+        page.save()
+        self.assertEqual(matches('indemnity'), [])
+        self.assertEqual(matches('arbitration'), [document.id])
+
+        page.delete()
+        self.assertEqual(matches('arbitration'), [])
+
+    def test_only_current_version_pages_match(self):
+        document = make_document(self.user, 'contract', versions=2)
+        DocumentPage.objects.create(
+            document=document, version=document.versions.get(version_number=1), page_number=1, text='indemnity'
+        )
+
+        self.assertEqual(self.search('indemnity'), [])
+
+    def test_query_syntax_is_treated_as_words(self):
+        self.add_pages(make_document(self.user, 'contract'), 'a and b')
+
+        for query in ('"a" AND(', 'NEAR(a b', 'a* OR -b', '"'):
+            with self.subTest(query=query):
+                self.assertEqual(self.client.get('/api/documents/search/', {'q': query}).status_code, 200)
+                self.assertEqual(self.client.get('/api/documents/', {'search': query}).status_code, 200)
+        self.assertEqual(len(self.search('"a" AND(')), 1)
+
+    def test_list_search_filter_matches_names(self):
+        make_document(self.user, 'indemnity-policy')
+        make_document(self.user, 'invoice')
+
+        self.assertEqual(self.filtered('indemnity'), {'indemnity-policy'})
+        self.assertEqual(self.filtered(''), {'indemnity-policy', 'invoice'})
+
+
+class InDocumentSearchTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('reviewer', 'reviewer@example.com', 'password')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.document = make_document(self.user, 'contract')
+        result_cache.clear()
+
+    def add_page(self, number, text, version=None):
+        return DocumentPage.objects.create(
+            document=self.document, version=version or self.document.current_version, page_number=number, text=text
+        )
+
+    def search(self, params):
+        response = self.client.get(f'/api/documents/{self.document.id}/search/', params)
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def test_every_match_is_returned_unless_paged(self):
+        self.add_page(1, 'clause ' * 150)
+
+        result = self.search({'query': 'clause'})
+        self.assertEqual((len(result['matches']), result['total']), (150, 150))
+
+        result = self.search({'query': 'clause', 'limit': 20, 'offset': 140})
+        self.assertEqual((len(result['matches']), result['total'], result['offset']), (10, 150, 140))
+
+    def test_parse_query_keeps_phrases_and_drops_duplicates(self):
+        self.assertEqual(parse_query('Net  "Payment   Terms" net'), ('net', 'payment terms'))
+        self.assertEqual(parse_query('Net net', case_sensitive=True), ('Net', 'net'))
+        self.assertEqual(parse_query('   '), ())
+
+    def test_compile_terms_prefers_phrases_over_their_words(self):
+        pattern = compile_terms(('payment', 'payment terms'))
+
+        self.assertEqual(pattern.findall('Payment\nterms and payment'), ['Payment\nterms', 'payment'])
+        self.assertEqual(compile_terms(('net',), case_sensitive=True).findall('Net net'), ['net'])
+
+    def test_whole_word_matches_terms_with_symbols(self):
+        def whole_words(*terms, text):
+            return compile_terms(terms, whole_word=True).findall(text)
+
+        self.assertEqual(whole_words('c++', text='c++ and c++11 but not abc++'), ['c++'])
+        self.assertEqual(whole_words('.net', text='.net, asp.net and .network'), ['.net'])
+        self.assertEqual(whole_words('$100', text='pay $100 not $1000'), ['$100'])
+        self.assertEqual(whole_words('net', text='net network .net'), ['net', 'net'])
+
+    def test_find_matches_stops_at_max_matches(self):
+        pattern = compile_terms(('net',))
+        pages = [(1, 'net net'), (2, 'no match'), (3, 'net'), (4, 'net')]
+
+        matches = find_matches(iter(pages), pattern, 3)
+
+        self.assertEqual([match['page'] for match in matches], [1, 1, 3])
+        self.assertEqual(matches[0]['preview'], 'net net')
+        [match] = find_matches(iter([(2, 'the net', 5)]), pattern, 10)
+        self.assertEqual((match['page'], match['version'], match['text']), (2, 5, 'net'))
+
+    def test_cached_results_are_invalidated_by_edits_and_new_versions(self):
+        page = self.add_page(1, 'the indemnity clause')
+        self.assertEqual(len(search_document(self.document, 'indemnity')), 1)
+
+        # Served from the cache until the document changes
+        DocumentPage.objects.filter(pk=page.pk).update(text='the arbitration clause')
+        self.assertEqual(len(search_document(self.document, 'indemnity')), 1)
+        self.document.save()
+        self.document.refresh_from_db()
+        self.assertEqual(search_document(self.document, 'indemnity'), [])
+
+        version = DocumentVersion.objects.create(
+            document=self.document, version_number=2, file='document_versions/contract-2.pdf',
+            created_by=self.user, extraction_status='completed',
+        )
+        self.add_page(1, 'an indemnity cap', version=version)
+        self.document.refresh_from_db()
+        self.assertEqual(search_document(self.document, 'indemnity'), [])
+        # A new current version is a new cache key, even within the same generation
+        Document.objects.filter(pk=self.document.pk).update(current_version=version)
+        self.document.current_version_id = version.id
+        [match] = search_document(self.document, 'indemnity')
+        self.assertEqual(match['preview'], 'an indemnity cap')
+
+    def test_deleted_versions_drop_out_of_cached_results(self):
+        old = self.document.current_version
+        self.add_page(1, 'the indemnity clause', version=old)
+        version = DocumentVersion.objects.create(
+            document=self.document, version_number=2, file='document_versions/contract-2.pdf',
+            created_by=self.user, extraction_status='completed',
+        )
+        Document.objects.filter(pk=self.document.pk).update(current_version=version)
+        self.add_page(1, 'an indemnity cap', version=version)
+        self.assertEqual(self.search({'query': 'indemnity', 'version': 'all'})['total'], 2)
+
+        # Deleting an old version leaves the document's updated_at alone
+        old.delete()
+
+        [match] = self.search({'query': 'indemnity', 'version': 'all'})['matches']
+        self.assertEqual((match['version'], match['preview']), (2, 'an indemnity cap'))
+
+
+class DocumentListTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('reviewer', 'reviewer@example.com', 'password')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def list_documents(self, query=''):
+        response = self.client.get(f'/api/documents/{query}')
+        self.assertEqual(response.status_code, 200)
+        return response.json()['results']
+
+    def test_list_has_counts_and_no_nested_collections(self):
+        make_document(self.user, 'contract', versions=3, annotations=2)
+
+        [row] = self.list_documents()
+
+        self.assertEqual(row['version_count'], 3)
+        self.assertEqual(row['annotation_count'], 2)
+        self.assertNotIn('versions', row)
+        self.assertNotIn('annotations', row)
+        self.assertNotIn('text_content', row)
+
+    def test_list_query_count_is_constant(self):
+        make_document(self.user, 'first', versions=2, annotations=2)
+        # Cursor pagination needs no COUNT(*), only the page itself (after
+        # the response cache's fingerprint of the library)
+        with self.assertNumQueries(2):
+            self.list_documents()
+
+        for i in range(9):
+            make_document(self.user, f'doc-{i}', versions=3, annotations=4)
+        with self.assertNumQueries(2):
+            self.list_documents()
+
+    def test_expand_prefetches_nested_collections(self):
+        for i in range(5):
+            make_document(self.user, f'doc-{i}', versions=2, annotations=3)
+
+        # Plus one prefetch query per expanded collection
+        with self.assertNumQueries(4):
+            rows = self.list_documents('?expand=versions,annotations')
+
+        self.assertEqual(len(rows[0]['versions']), 2)
+        self.assertEqual(len(rows[0]['annotations']), 3)
+        self.assertEqual(rows[0]['versions'][0]['created_by'], 'reviewer')
+
+    def test_sparse_fieldset(self):
+        make_document(self.user, 'contract')
+
+        [row] = self.list_documents('?fields=id,name,version_count')
+
+        self.assertEqual(set(row), {'id', 'name', 'version_count'})
+
+    def test_sparse_fieldset_does_not_drop_written_fields(self):
+        document = make_document(self.user, 'contract')
+
+        response = self.client.patch(f'/api/documents/{document.id}/?fields=id', {'name': 'renamed'})
+
+        self.assertEqual(response.status_code, 200)
+        document.refresh_from_db()
+        self.assertEqual(document.name, 'renamed')
+
+    def test_detail_keeps_nested_collections(self):
+        document = make_document(self.user, 'contract', versions=2, annotations=1)
+
+        # Cache fingerprint, document, versions and annotations
+        with self.assertNumQueries(4):
+            response = self.client.get(f'/api/documents/{document.id}/')
+
+        self.assertEqual(len(response.json()['versions']), 2)
+        self.assertEqual(len(response.json()['annotations']), 1)
+
+
+class CursorPaginationTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('reviewer', 'reviewer@example.com', 'password')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def collect(self, url):
+        """Follow ``next`` links and return every row in order"""
+        rows = []
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            rows.extend(response.json()['results'])
+            url = response.json()['next']
+        return rows
+
+    def test_documents_walk_newest_first_without_gaps(self):
+        documents = [make_document(self.user, f'doc-{i}') for i in range(7)]
+
+        rows = self.collect('/api/documents/?page_size=3')
+
+        self.assertEqual([row['id'] for row in rows], [d.id for d in reversed(documents)])
+
+    def test_page_size_is_capped(self):
+        for i in range(3):
+            make_document(self.user, f'doc-{i}')
+
+        with self.settings(DOCUMENT_MAX_PAGE_SIZE=2):
+            response = self.client.get('/api/documents/?page_size=1000')
+
+        self.assertEqual(len(response.json()['results']), 2)
+
+    def test_versions_and_annotations_are_cursor_paginated(self):
+        document = make_document(self.user, 'contract', versions=4, annotations=5)
+
+        versions = self.collect(f'/api/documents/{document.id}/versions/?page_size=3')
+        annotations = self.collect('/api/annotations/?page_size=2')
+
+        self.assertEqual([v['version_number'] for v in versions], [4, 3, 2, 1])
+        self.assertEqual(len(annotations), 5)
+
+
+@override_settings(MEDIA_ROOT=tempfile.mkdtemp())
+class VersionDownloadTests(TestCase):
+    content = bytes(range(256)) * 40
+
+    def setUp(self):
+        self.user = User.objects.create_user('reviewer', 'reviewer@example.com', 'password')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.document = make_document(self.user, 'contract')
+        self.version = self.document.current_version
+        self.version.file.save('contract.pdf', ContentFile(self.content))
+        self.url = f'/api/documents/{self.document.id}/versions/{self.version.version_number}/content/'
+
+    def tearDown(self):
+        shutil.rmtree(self.version.file.storage.location, ignore_errors=True)
+
+    def test_full_download_streams_file(self):
+        response = self.client.get(self.url, HTTP_ACCEPT='application/pdf')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(b''.join(response.streaming_content), self.content)
+        self.assertEqual(response['Accept-Ranges'], 'bytes')
+        self.assertIn('ETag', response)
+        self.assertIn('Last-Modified', response)
+
+    def test_range_requests(self):
+        response = self.client.get(self.url, HTTP_RANGE='bytes=100-199')
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response['Content-Range'], f'bytes 100-199/{len(self.content)}')
+        self.assertEqual(b''.join(response.streaming_content), self.content[100:200])
+
+        response = self.client.get(self.url, HTTP_RANGE='bytes=-10')
+        self.assertEqual(b''.join(response.streaming_content), self.content[-10:])
+
+        response = self.client.get(self.url, HTTP_RANGE=f'bytes={len(self.content)}-')
+        self.assertEqual(response.status_code, 416)
+
+    def test_range_requests_on_empty_file(self):
+        self.version.file.save('empty.pdf', ContentFile(b''))
+
+        for header in ('bytes=0-', 'bytes=0-0', 'bytes=-10'):
+            response = self.client.get(self.url, HTTP_RANGE=header)
+            self.assertEqual(response.status_code, 416)
+            self.assertEqual(response['Content-Range'], 'bytes */0')
+        self.assertEqual(self.client.get(self.url).status_code, 200)
+
+    def test_versions_are_addressed_by_number(self):
+        # Version ids and numbers differ once there is more than one document
+        other = make_document(self.user, 'other', versions=2)
+        version = other.versions.get(version_number=1)
+        version.file.save('other.pdf', ContentFile(b'first version'))
+        self.assertNotEqual(version.id, version.version_number)
+
+        response = self.client.get(f'/api/documents/{other.id}/versions/1/content/')
+        self.assertEqual(b''.join(response.streaming_content), b'first version')
+        self.assertEqual(self.client.get(f'/api/documents/{other.id}/versions/3/content/').status_code, 404)
+        # The version's other routes agree on which version 1 is
+        self.assertEqual(self.client.get(f'/api/documents/{other.id}/versions/1/').json()['id'], version.id)
+        self.assertEqual(self.client.delete(f'/api/documents/{other.id}/versions/1/').status_code, 204)
+        self.assertEqual(list(other.versions.values_list('version_number', flat=True)), [2])
+
+    def test_conditional_get(self):
+        etag = self.client.get(self.url)['ETag']
+
+        self.assertEqual(self.client.get(self.url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        # A stale If-Range gets the whole file instead of a partial one
+        response = self.client.get(self.url, HTTP_RANGE='bytes=0-9', HTTP_IF_RANGE='"stale"')
+        self.assertEqual(response.status_code, 200)
+
+    def test_offload_mode_sends_no_bytes(self):
+        with self.settings(DOCUMENT_DOWNLOAD_OFFLOAD='x-accel-redirect'):
+            response = self.client.get(self.url)
+
+        self.assertEqual(response['X-Accel-Redirect'], f'/protected-media/{self.version.file.name}')
+        self.assertEqual(response.content, b'')
+
+    def test_other_users_cannot_download(self):
+        other = User.objects.create_user('other', 'other@example.com', 'password')
+        self.client.force_authenticate(other)
+
+        self.assertEqual(self.client.get(self.url).status_code, 404)
+
+
+@override_settings(MEDIA_ROOT=tempfile.mkdtemp(), DOCUMENT_JOB_QUEUE='documents.jobs.ImmediateJobQueue')
+class BlobStoreTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('reviewer', 'reviewer@example.com', 'password')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def tearDown(self):
+        from django.conf import settings
+        shutil.rmtree(settings.MEDIA_ROOT, ignore_errors=True)
+
+    def upload(self, content, name='notes.txt'):
+        response = self.client.post('/api/documents/', {
+            'name': name, 'file_type': 'text', 'file': SimpleUploadedFile(name, content),
+        }, format='multipart')
+        self.assertEqual(response.status_code, 201)
+        return Document.objects.get(pk=response.json()['id'])
+
+    def add_version(self, document, content):
+        response = self.client.post(f'/api/documents/{document.id}/version-create/', {
+            'file': SimpleUploadedFile('notes.txt', content),
+        }, format='multipart')
+        self.assertEqual(response.status_code, 201)
+        return DocumentVersion.objects.get(pk=response.json()['id'])
+
+    def test_identical_uploads_share_one_blob(self):
+        first = self.upload(b'same bytes')
+        second = self.upload(b'same bytes')
+        version = self.add_version(first, b'same bytes')
+
+        blob = Blob.objects.get()
+        self.assertEqual(first.file.name, blob.file.name)
+        self.assertEqual(second.current_version.file.name, blob.file.name)
+        self.assertEqual(version.sha256, blob.sha256)
+        # Two documents, their first versions and one more version
+        self.assertEqual(blob.ref_count, 5)
+
+    def test_blob_is_freed_with_its_last_reference(self):
+        document = self.upload(b'v1')
+        version = self.add_version(document, b'v2')
+        storage = version.file.storage
+
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.delete(f'/api/documents/{document.id}/versions/{version.version_number}/')
+        self.assertEqual(response.status_code, 204)
+        self.assertFalse(storage.exists(version.file.name))
+        self.assertEqual(Blob.objects.get().ref_count, 2)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.delete(f'/api/documents/{document.id}/')
+        self.assertFalse(Blob.objects.exists())
+        self.assertFalse(storage.exists(document.file.name))
+
+    def test_blob_stored_again_before_its_deletion_is_kept(self):
+        blob = store(ContentFile(b'kept', name='kept.txt'))
+        with self.captureOnCommitCallbacks() as callbacks:
+            release(blob.file.name)
+        # The same bytes come in after the last reference went, but before
+        # the deletion ran
+        self.assertEqual(store(ContentFile(b'kept', name='kept.txt')).pk, blob.pk)
+        for callback in callbacks:
+            callback()
+
+        self.assertEqual(Blob.objects.get().ref_count, 1)
+        self.assertTrue(blob.file.storage.exists(blob.file.name))
+
+    def test_downloads_keep_the_uploaded_name(self):
+        document = self.upload(b'v1', name='Q3 report.txt')
+        version = self.add_version(document, b'v2')
+
+        self.assertEqual(document.current_version.original_name, 'Q3 report.txt')
+        response = self.client.get(f'/api/documents/{document.id}/versions/{version.version_number}/content/')
+        self.assertEqual(response['Content-Disposition'], 'inline; filename="notes.txt"')
+        response = self.client.get(document.current_version.file.url)
+        self.assertEqual(response['Content-Disposition'], 'inline; filename="Q3 report.txt"')
+
+
+@override_settings(MEDIA_ROOT=tempfile.mkdtemp())
+class DedupeMediaTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('reviewer', 'reviewer@example.com', 'password')
+        self.document = make_document(self.user, 'report', versions=2)
+        self.storage = self.document.file.storage
+        for name, content in [('documents/report.pdf', b'first'), ('document_versions/report-1.pdf', b'first'),
+                              ('document_versions/report-2.pdf', b'second'), ('documents/orphan.pdf', b'stale')]:
+            self.storage.save(name, ContentFile(content))
+
+    def tearDown(self):
+        shutil.rmtree(self.storage.location, ignore_errors=True)
+
+    def dedupe(self, *args):
+        out = io.StringIO()
+        call_command('dedupe_media', *args, stdout=out)
+        return out.getvalue()
+
+    def test_dry_run_changes_nothing(self):
+        output = self.dedupe('--dry-run', '--prune-orphans')
+
+        self.assertIn('Unreferenced legacy files:     1', output)
+        self.assertIn('Would save 5', output)
+        self.assertFalse(Blob.objects.exists())
+        self.assertEqual(sorted([*walk_storage('documents'), *walk_storage('document_versions')]), [
+            'document_versions/report-1.pdf', 'document_versions/report-2.pdf',
+            'documents/orphan.pdf', 'documents/report.pdf',
+        ])
+
+    def test_duplicates_share_a_blob_and_orphans_are_pruned(self):
+        self.dedupe('--prune-orphans')
+
+        first, second = self.document.versions.order_by('version_number')
+        self.document.refresh_from_db()
+        self.assertEqual(self.document.file.name, first.file.name)
+        self.assertEqual(Blob.objects.get(file=first.file.name).ref_count, 2)
+        self.assertEqual(Blob.objects.get(file=second.file.name).ref_count, 1)
+        self.assertEqual(second.sha256, hashlib.sha256(b'second').hexdigest())
+        with self.storage.open(second.file.name, 'rb') as f:
+            self.assertEqual(f.read(), b'second')
+        # The legacy files and the orphan are gone
+        self.assertEqual([*walk_storage('documents'), *walk_storage('document_versions')], [])
+
+        # Downloads keep the names the files had
+        self.assertEqual(second.original_name, 'report-2.pdf')
+        client = APIClient()
+        client.force_authenticate(self.user)
+        response = client.get(f'/api/documents/{self.document.id}/versions/{second.version_number}/content/')
+        self.assertEqual(response['Content-Disposition'], 'inline; filename="report-2.pdf"')
+
+    def test_originals_and_orphans_are_kept_unless_asked(self):
+        self.dedupe('--keep-originals')
+
+        self.assertEqual(Blob.objects.count(), 2)
+        self.assertTrue(self.storage.exists('documents/report.pdf'))
+        self.assertTrue(self.storage.exists('documents/orphan.pdf'))
+
+
+@override_settings(MEDIA_ROOT=tempfile.mkdtemp(), DOCUMENT_UPLOAD_SESSION_DIR=tempfile.mkdtemp(),
+                   DOCUMENT_JOB_QUEUE='documents.jobs.ImmediateJobQueue')
+class ChunkedUploadTests(TestCase):
+    content = bytes(range(256)) * 100
+
+    def setUp(self):
+        self.user = User.objects.create_user('reviewer', 'reviewer@example.com', 'password')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def tearDown(self):
+        from django.conf import settings
+        shutil.rmtree(settings.MEDIA_ROOT, ignore_errors=True)
+        shutil.rmtree(settings.DOCUMENT_UPLOAD_SESSION_DIR, ignore_errors=True)
+
+    def open_session(self, **fields):
+        data = {'filename': 'scan.bin', 'size': len(self.content),
+                'sha256': hashlib.sha256(self.content).hexdigest(), **fields}
+        response = self.client.post('/api/uploads/', data, format='json')
+        self.assertEqual(response.status_code, 201)
+        return response.json()['id']
+
+    def put_chunk(self, session_id, offset, data, checksum=True):
+        headers = {'HTTP_X_CHUNK_SHA256': hashlib.sha256(data).hexdigest()} if checksum else {}
+        return self.client.put(f'/api/uploads/{session_id}/chunk/?offset={offset}', data,
+                               content_type='application/octet-stream', **headers)
+
+    def test_upload_in_chunks_creates_document(self):
+        session_id = self.open_session(name='Scan')
+
+        for offset in range(0, len(self.content), 10000):
+            response = self.put_chunk(session_id, offset, self.content[offset:offset + 10000])
+            self.assertEqual(response.status_code, 200)
+        response = self.client.post(f'/api/uploads/{session_id}/complete/')
+
+        self.assertEqual(response.status_code, 201)
+        document = Document.objects.get(pk=response.json()['document'])
+        self.assertEqual(document.name, 'Scan')
+        self.assertEqual(document.file_type, 'bin')
+        self.assertEqual(document.current_version_id, response.json()['version'])
+        with document.current_version.file.open('rb') as f:
+            self.assertEqual(f.read(), self.content)
+        self.assertEqual(Blob.objects.get().ref_count, 2)
+
+    def test_resume_after_rejected_chunks(self):
+        session_id = self.open_session()
+        self.put_chunk(session_id, 0, self.content[:5000])
+
+        # A corrupted chunk is dropped and a chunk at the wrong offset is refused
+        response = self.client.put(f'/api/uploads/{session_id}/chunk/?offset=5000', b'x' * 100,
+                                   content_type='application/octet-stream', HTTP_X_CHUNK_SHA256='0' * 64)
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(self.put_chunk(session_id, 9000, self.content[9000:]).status_code, 409)
+
+        offset = self.client.get(f'/api/uploads/{session_id}/').json()['offset']
+        self.assertEqual(offset, 5000)
+        self.assertEqual(self.put_chunk(session_id, offset, self.content[offset:], checksum=False).status_code, 200)
+        self.assertEqual(self.client.post(f'/api/uploads/{session_id}/complete/').status_code, 201)
+        self.assertEqual(self.client.post(f'/api/uploads/{session_id}/complete/').status_code, 409)
+
+    def test_upload_new_version(self):
+        document = make_document(self.user, 'contract')
+        session_id = self.open_session(document=document.id)
+        self.put_chunk(session_id, 0, self.content)
+
+        response = self.client.post(f'/api/uploads/{session_id}/complete/')
+
+        version = DocumentVersion.objects.get(pk=response.json()['version'])
+        self.assertEqual(version.version_number, 2)
+        self.assertEqual(version.sha256, hashlib.sha256(self.content).hexdigest())
+        document.refresh_from_db()
+        self.assertEqual(document.current_version, version)
+
+    def test_failed_completion_can_be_retried(self):
+        document = make_document(self.user, 'contract')
+        session_id = self.open_session(document=document.id)
+        self.put_chunk(session_id, 0, self.content)
+
+        with mock.patch('documents.uploads.add_version', side_effect=RuntimeError('database hiccup')):
+            with self.assertRaises(RuntimeError):
+                self.client.post(f'/api/uploads/{session_id}/complete/')
+        # The part file is back in place and nothing was left in the blob store
+        self.assertFalse(Blob.objects.exists())
+        self.assertEqual(list(walk_storage('blobs')), [])
+
+        # The bytes aren't a PDF, so extracting the new version fails
+        with self.assertLogs('documents.tasks', 'ERROR'):
+            response = self.client.post(f'/api/uploads/{session_id}/complete/')
+
+        self.assertEqual(response.status_code, 201)
+        version = DocumentVersion.objects.get(pk=response.json()['version'])
+        with version.file.open('rb') as f:
+            self.assertEqual(f.read(), self.content)
+        self.assertEqual(Blob.objects.get().ref_count, 1)
+
+    def test_final_checksum_mismatch_fails_session(self):
+        session_id = self.open_session(sha256='f' * 64)
+        self.put_chunk(session_id, 0, self.content)
+
+        response = self.client.post(f'/api/uploads/{session_id}/complete/')
+
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(UploadSession.objects.get().status, 'failed')
+        self.assertFalse(Document.objects.exists())
+
+
+@override_settings(MEDIA_ROOT=tempfile.mkdtemp(), DOCUMENT_THUMBNAIL_CACHE_DIR=tempfile.mkdtemp(),
+                   DOCUMENT_JOB_QUEUE='documents.jobs.ImmediateJobQueue', DOCUMENT_THUMBNAIL_PRERENDER_PAGES=1)
+class ThumbnailTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('reviewer', 'reviewer@example.com', 'password')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def tearDown(self):
+        from django.conf import settings
+        shutil.rmtree(settings.MEDIA_ROOT, ignore_errors=True)
+        shutil.rmtree(settings.DOCUMENT_THUMBNAIL_CACHE_DIR, ignore_errors=True)
+
+    def test_upload_prerenders_and_serves_page_images(self):
+        from django.conf import settings
+        response = self.client.post('/api/documents/', {
+            'name': 'contract', 'file_type': 'pdf',
+            'file': SimpleUploadedFile('contract.pdf', build_text_pdf(3, words_per_page=40)),
+        }, format='multipart')
+        document = Document.objects.get(pk=response.json()['id'])
+        version = document.current_version
+        cached = {name for _, _, files in os.walk(settings.DOCUMENT_THUMBNAIL_CACHE_DIR) for name in files}
+        self.assertEqual(cached, {'1-thumb.jpg', '1-preview.jpg'})
+
+        url = f'/api/documents/{document.id}/versions/{version.version_number}/pages/2/thumb/'
+        response = self.client.get(url, HTTP_ACCEPT='image/*')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'image/jpeg')
+        self.assertEqual(Image.open(io.BytesIO(response.content)).width, 200)
+
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag']).status_code, 304)
+        preview = self.client.get(f'{url}?size=preview')
+        self.assertEqual(Image.open(io.BytesIO(preview.content)).width, 1024)
+        missing = f'/api/documents/{document.id}/versions/{version.version_number}/pages/4/thumb/'
+        self.assertEqual(self.client.get(missing).status_code, 404)
+
+    def test_cache_evicts_least_recently_used(self):
+        from django.conf import settings
+        cache = ThumbnailCache(settings.DOCUMENT_THUMBNAIL_CACHE_DIR, max_bytes=300)
+        for page in (1, 2, 3):
+            path = cache.put('key', page, 'thumb', b'x' * 100)
+            os.utime(path, (page, page))
+        # Reading page 1 makes page 2 the least recently used
+        cache.get('key', 1, 'thumb')
+
+        cache.put('key', 4, 'thumb', b'x' * 100)
+
+        self.assertIsNotNone(cache.get('key', 1, 'thumb'))
+        self.assertIsNone(cache.get('key', 2, 'thumb'))
+        self.assertIsNotNone(cache.get('key', 4, 'thumb'))
+
+
+@override_settings(MEDIA_ROOT=tempfile.mkdtemp(), DOCUMENT_JOB_QUEUE='documents.jobs.ImmediateJobQueue')
+class VersionExtractionTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('reviewer', 'reviewer@example.com', 'password')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.original = build_text_pdf(3, words_per_page=40, seed=1)
+        response = self.client.post('/api/documents/', {
+            'name': 'contract', 'file_type': 'pdf', 'file': SimpleUploadedFile('contract.pdf', self.original),
+        }, format='multipart')
+        self.document = Document.objects.get(pk=response.json()['id'])
+
+    def upload(self, content):
+        url = f'/api/documents/{self.document.id}/version-create/'
+        response = self.client.post(url, {'file': SimpleUploadedFile('contract.pdf', content)}, format='multipart')
+        self.assertEqual(response.status_code, 201)
+        version = DocumentVersion.objects.get(pk=response.json()['id'])
+        self.assertEqual(version.extraction_status, 'completed')
+
+    def reused_pages(self):
+        return sum(value for _, value in metrics.extraction_reused_pages._values.items())
+
+    def with_new_second_page(self):
+        import PyPDF2
+        original = PyPDF2.PdfReader(io.BytesIO(self.original))
+        replacement = PyPDF2.PdfReader(io.BytesIO(build_text_pdf(3, words_per_page=40, seed=2)))
+        writer = PyPDF2.PdfWriter()
+        for page in (original.pages[0], replacement.pages[1], original.pages[2]):
+            writer.add_page(page)
+        out = io.BytesIO()
+        writer.write(out)
+        return out.getvalue()
+
+    def test_new_version_reuses_unchanged_pages_and_search_follows_it(self):
+        reused = self.reused_pages()
+        self.upload(self.with_new_second_page())
+
+        # Only the replaced page was extracted again
+        self.assertEqual(self.reused_pages() - reused, 2)
+        self.document.refresh_from_db()
+        self.assertEqual(self.document.current_version.version_number, 2)
+        self.assertEqual(self.document.extraction_status, 'completed')
+        pages = self.client.get(f'/api/documents/{self.document.id}/pages/').json()['pages']
+        self.assertEqual(len(pages), 3)
+        self.assertIn(' '.join(fake_page_text(2, 40, seed=2).split()[:4]), ' '.join(pages[1]['text'].split()))
+        old = self.client.get(f'/api/documents/{self.document.id}/pages/?version=1').json()['pages']
+        self.assertIn(' '.join(fake_page_text(2, 40, seed=1).split()[:4]), ' '.join(old[1]['text'].split()))
+
+        phrase = '"{}"'.format(' '.join(fake_page_text(2, 40, seed=1).split()[:4]))
+        search = f'/api/documents/{self.document.id}/search/?query={phrase}'
+        self.assertEqual(self.client.get(search).json()['total'], 0)
+        self.assertEqual(self.client.get(f'{search}&version=1').json()['total'], 1)
+        [match] = self.client.get(f'{search}&version=all').json()['matches']
+        self.assertEqual((match['page'], match['version']), (2, 1))
+        self.assertEqual(self.client.get(f'{search}&version=9').status_code, 404)
+
+    def test_identical_file_copies_pages_without_extracting(self):
+        self.upload(self.with_new_second_page())
+        reused = self.reused_pages()
+
+        self.upload(self.original)
+
+        self.assertEqual(self.reused_pages() - reused, 3)
+        first, third = DocumentVersion.objects.filter(document=self.document, version_number__in=(1, 3))
+        self.assertEqual(first.page_hashes, third.page_hashes)
+        self.assertEqual(list(third.pages.values_list('page_number', 'text')),
+                         list(first.pages.values_list('page_number', 'text')))
+
+
+class StreamingExtractionTests(TestCase):
+    def test_page_ranges_match_the_whole_document(self):
+        import PyPDF2
+        content = build_text_pdf(5, words_per_page=20)
+        expected = [page.extract_text() for page in PyPDF2.PdfReader(io.BytesIO(content)).pages]
+
+        pdf_reader = PyPDF2.PdfReader(io.BytesIO(content))
+        self.assertEqual(page_count(pdf_reader), 5)
+        self.assertEqual([page['text'] for page in iter_pages(pdf_reader)], expected)
+        self.assertEqual([page['page'] for page in iter_pages(pdf_reader, 2, 4)], [3, 4])
+        # Parsed objects don't pile up across pages
+        self.assertLess(len(pdf_reader.resolved_objects), 5)
+
+    @override_settings(MEDIA_ROOT=tempfile.mkdtemp(), DOCUMENT_JOB_QUEUE='documents.jobs.ImmediateJobQueue',
+                       DOCUMENT_EXTRACTION_BATCH_PAGES=2)
+    def test_job_writes_pages_in_batches(self):
+        user = User.objects.create_user('reviewer', 'reviewer@example.com', 'password')
+        client = APIClient()
+        client.force_authenticate(user)
+        response = client.post('/api/documents/', {
+            'name': 'contract', 'file_type': 'pdf',
+            'file': SimpleUploadedFile('contract.pdf', build_text_pdf(5, words_per_page=20)),
+        }, format='multipart')
+
+        document = Document.objects.get(pk=response.json()['id'])
+        self.assertEqual(document.extraction_status, 'completed')
+        self.assertEqual(list(document.current_version.pages.values_list('page_number', flat=True)), [1, 2, 3, 4, 5])
+        self.assertEqual(len(document.current_version.page_hashes), 5)
+        self.assertEqual(set(document.current_version.pages.values_list('method', flat=True)), {'text'})
+        self.assertFalse(document.current_version.pages.filter(extraction_ms__isnull=True).exists())
+
+    def test_parallel_extraction_matches_serial(self):
+        import PyPDF2
+        content = build_text_pdf(7, words_per_page=20)
+        serial = list(iter_pages(PyPDF2.PdfReader(io.BytesIO(content))))
+        known = {serial[2]['hash']: 3}
+        # A pool of its own, shut down afterwards
+        with tempfile.NamedTemporaryFile(suffix='.pdf') as f, \
+                mock.patch('documents.extraction._pool', None), mock.patch('documents.extraction._pool_workers', None):
+            f.write(content)
+            f.flush()
+            parallel = list(extract_pdf_pages_parallel(f.name, workers=2, pages_per_task=2, known=known))
+            get_extraction_pool(2).shutdown()
+
+        def fields(pages):
+            return [(page['page'], page['text'], page['hash'], page['same_as']) for page in pages]
+
+        expected = fields(serial)
+        expected[2] = (3, None, serial[2]['hash'], 3)
+        self.assertEqual(fields(parallel), expected)
+
+    @override_settings(MEDIA_ROOT=tempfile.mkdtemp())
+    def test_empty_file_fails_without_retrying(self):
+        with tempfile.NamedTemporaryFile(suffix='.pdf') as f:
+            with self.assertRaises(EmptyFileError):
+                list(extract_pdf(f.name))
+
+        user = User.objects.create_user('reviewer', 'reviewer@example.com', 'password')
+        version = make_document(user, 'empty').current_version
+        version.file.save('empty.pdf', ContentFile(b''))
+        queue = jobs.DatabaseJobQueue()
+        job = queue.enqueue('extract_version_text', version_id=version.id)
+
+        with self.assertLogs('documents.tasks', 'WARNING'):
+            queue.work()
+
+        job.refresh_from_db()
+        version.refresh_from_db()
+        self.assertEqual((job.status, job.attempts), ('completed', 1))
+        self.assertEqual(version.extraction_status, 'failed')
+
+
+class ExtractorTests(TestCase):
+    def write(self, suffix, content):
+        with tempfile.NamedTemporaryFile(suffix=suffix, delete=False) as f:
+            f.write(content)
+        self.addCleanup(os.unlink, f.name)
+        return f.name
+
+    def texts(self, extract, path):
+        return [(page['page'], page['text']) for page in extract(path) if page['text']]
+
+    def test_lookup_prefers_the_file_extension(self):
+        self.assertEqual(get_extractor('word', 'blobs/ab/cd/abcd.docx')[0], 'docx')
+        self.assertIsNone(get_extractor('word', 'blobs/ab/cd/abcd.doc'))
+        self.assertEqual(get_extractor('PDF')[0], 'pdf')
+        self.assertFalse(can_extract('image', 'scan.png'))
+
+    def test_docx_pages_follow_page_breaks(self):
+        w = 'http://schemas.openxmlformats.org/wordprocessingml/2006/main'
+        body = (
+            f'<w:document xmlns:w="{w}"><w:body>'
+            '<w:p><w:r><w:t>First page</w:t></w:r></w:p>'
+            '<w:p><w:r><w:br w:type="page"/><w:t>Second</w:t><w:tab/><w:t>page</w:t></w:r></w:p>'
+            '</w:body></w:document>'
+        )
+        archive = io.BytesIO()
+        with zipfile.ZipFile(archive, 'w') as zf:
+            zf.writestr('word/document.xml', body)
+
+        path = self.write('.docx', archive.getvalue())
+
+        self.assertEqual(self.texts(extract_docx, path), [(1, 'First page\n'), (2, 'Second\tpage\n')])
+
+    def test_html_keeps_visible_text_only(self):
+        path = self.write('.html', b'<html><head><style>p {}</style><script>var x;</script></head>'
+                                   b'<body><h1>Lease</h1><p>Rent is   due &amp; payable</p></body></html>')
+
+        [(_, text)] = self.texts(extract_html, path)
+
+        self.assertEqual([line for line in text.split('\n') if line], ['Lease', 'Rent is due & payable'])
+
+    @override_settings(DOCUMENT_EXTRACTION_PAGE_CHARS=12)
+    def test_text_is_paged_at_form_feeds_and_line_breaks(self):
+        path = self.write('.txt', 'one\ntwo\nthree\nfour\fnext page'.encode())
+
+        self.assertEqual(self.texts(extract_text_file, path),
+                         [(1, 'one\ntwo\n'), (2, 'three\nfour'), (3, 'next page')])
+
+    def test_pages_without_a_text_layer_are_sent_to_ocr(self):
+        path = self.write('.pdf', pdf_with_blank_page())
+        engine = self.write('.sh', b'#!/bin/sh\ncat > /dev/null\necho "scanned text"\n')
+        os.chmod(engine, 0o755)
+
+        with override_settings(DOCUMENT_OCR_COMMAND=engine, DOCUMENT_OCR_DPI=36):
+            pages = list(extract_pdf(path))
+
+        self.assertEqual([page['method'] for page in pages], ['text', 'ocr'])
+        self.assertEqual(pages[1]['text'], 'scanned text\n')
+        self.assertGreater(pages[1]['seconds'], 0)
+        with override_settings(DOCUMENT_OCR_COMMAND=None):
+            self.assertEqual([page['text'] for page in extract_pdf(path)][1], '')
+
+    def test_pages_ocr_fails_on_are_kept_without_text(self):
+        path = self.write('.pdf', pdf_with_blank_page())
+        failing = self.write('.sh', b'#!/bin/sh\ncat > /dev/null\nexit 1\n')
+        hanging = self.write('.sh', b'#!/bin/sh\ncat > /dev/null\nsleep 5\n')
+        os.chmod(failing, 0o755)
+        os.chmod(hanging, 0o755)
+
+        for engine, timeout in ((failing, 120), (hanging, 0.5)):
+            with self.subTest(engine=engine), self.assertLogs('documents.ocr', 'WARNING'), \
+                    override_settings(DOCUMENT_OCR_COMMAND=engine, DOCUMENT_OCR_DPI=36, DOCUMENT_OCR_TIMEOUT=timeout):
+                pages = list(extract_pdf(path))
+
+            self.assertEqual([page['method'] for page in pages], ['text', 'ocr-failed'])
+            self.assertTrue(pages[0]['text'].strip())
+            self.assertEqual(pages[1]['text'], '')
+
+
+@override_settings(MEDIA_ROOT=tempfile.mkdtemp(), DOCUMENT_JOB_QUEUE='documents.jobs.ImmediateJobQueue')
+class ExtractionCacheTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('reviewer', 'reviewer@example.com', 'password')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.content = build_text_pdf(3, words_per_page=20)
+        self.key = get_extractor('pdf').key
+
+    def upload(self, name):
+        response = self.client.post('/api/documents/', {
+            'name': name, 'file_type': 'pdf', 'file': SimpleUploadedFile(f'{name}.pdf', self.content),
+        }, format='multipart')
+        return Document.objects.get(pk=response.json()['id'])
+
+    def test_known_file_is_not_parsed_again(self):
+        first = self.upload('contract')
+        entry = ExtractedFile.objects.get()
+        self.assertEqual((entry.sha256, entry.extractor, entry.complete, entry.page_count),
+                         (first.current_version.sha256, self.key, True, 3))
+
+        with mock.patch('documents.tasks.iter_file_pages', side_effect=AssertionError('parsed')):
+            second = self.upload('copy')
+
+        self.assertEqual(second.extraction_status, 'completed')
+        self.assertEqual(list(second.current_version.pages.values_list('text', 'method')),
+                         [(text, 'reused') for text in first.current_version.pages.values_list('text', flat=True)])
+        self.assertEqual(second.current_version.page_hashes, first.current_version.page_hashes)
+
+    def test_new_extractor_version_misses_and_prunes_old_entries(self):
+        self.upload('contract')
+        bumped = get_extractor('pdf')._replace(version=2)
+
+        with mock.patch.dict('documents.extraction._extractors', {'pdf': bumped}):
+            document = self.upload('copy')
+            self.assertEqual(list(document.current_version.pages.values_list('method', flat=True)), ['text'] * 3)
+            self.assertEqual(extraction_cache.prune(), 1)
+
+        self.assertEqual(list(ExtractedFile.objects.values_list('extractor', flat=True)), [bumped.key])
+
+    def test_pages_ocr_failed_on_are_stored_but_not_cached(self):
+        self.content = pdf_with_blank_page()
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        engine = os.path.join(directory, 'ocr.sh')
+        with open(engine, 'w') as f:
+            f.write('#!/bin/sh\ncat > /dev/null\nexit 1\n')
+        os.chmod(engine, 0o755)
+
+        with self.assertLogs('documents.ocr', 'WARNING'), \
+                override_settings(DOCUMENT_OCR_COMMAND=engine, DOCUMENT_OCR_DPI=36):
+            document = self.upload('scan')
+
+        self.assertEqual(document.extraction_status, 'completed')
+        self.assertEqual(list(document.current_version.pages.values_list('page_number', 'method')),
+                         [(1, 'text'), (2, 'ocr-failed')])
+        # The next upload of the file tries OCR again
+        self.assertFalse(ExtractedFile.objects.exists())
+
+    def test_command_prewarms_and_prunes(self):
+        document = self.upload('contract')
+        ExtractedFile.objects.all().delete()
+
+        out = io.StringIO()
+        call_command('extraction_cache', '--prewarm', stdout=out)
+        call_command('extraction_cache', '--prewarm', stdout=out)
+
+        self.assertIn('Cached 1 file(s), 3 page(s)', out.getvalue())
+        self.assertIn('Cached 0 file(s), 0 page(s)', out.getvalue())
+        self.assertEqual(ExtractedPage.objects.count(), 3)
+
+        # Kept while a version references the file, however old
+        ExtractedFile.objects.update(last_used_at=timezone.now() - timedelta(days=365))
+        call_command('extraction_cache', '--prune', stdout=out)
+        self.assertTrue(ExtractedFile.objects.exists())
+        document.delete()
+        call_command('extraction_cache', '--prune', stdout=out)
+        self.assertFalse(ExtractedFile.objects.exists())
+
+
+class DeltaEncodingTests(TestCase):
+    def test_delta_rebuilds_an_edited_file(self):
+        source = '\n\n'.join(fake_page_text(number, 120) for number in range(1, 20)).encode()
+        target = revise_text(source.decode(), 3).encode()
+
+        delta = deltas.encode(source, target)
+
+        self.assertLess(len(delta), len(target) // 10)
+        self.assertEqual(deltas.apply(source, delta), target)
+        self.assertEqual(deltas.apply(source, deltas.encode(source, b'')), b'')
+
+    def test_unrelated_files_are_given_up_on(self):
+        source = fake_page_text(1, 2000).encode()
+
+        self.assertIsNone(deltas.encode(source, os.urandom(len(source)), max_size=len(source) // 2))
+
+
+@override_settings(MEDIA_ROOT=tempfile.mkdtemp(), DOCUMENT_JOB_QUEUE='documents.jobs.ImmediateJobQueue',
+                   DOCUMENT_VERSION_DELTAS=True, DOCUMENT_DELTA_SNAPSHOT_INTERVAL=3,
+                   DOCUMENT_DELTA_CACHE_DIR=tempfile.mkdtemp())
+class VersionDeltaTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('reviewer', 'reviewer@example.com', 'password')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        text = '\n\n'.join(fake_page_text(number, 120) for number in range(1, 20))
+        self.revisions = [text.encode()]
+        for revision in range(1, 6):
+            text = revise_text(text, revision)
+            self.revisions.append(text.encode())
+
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post('/api/documents/', {
+                'name': 'notes', 'file_type': 'text', 'file': SimpleUploadedFile('notes.txt', self.revisions[0]),
+            }, format='multipart')
+        self.document = Document.objects.get(pk=response.json()['id'])
+        for content in self.revisions[1:]:
+            with self.captureOnCommitCallbacks(execute=True):
+                response = self.client.post(f'/api/documents/{self.document.id}/version-create/', {
+                    'file': SimpleUploadedFile('notes.txt', content),
+                }, format='multipart')
+            self.assertEqual(response.status_code, 201)
+        self.versions = list(self.document.versions.order_by('version_number'))
+
+    def tearDown(self):
+        from django.conf import settings
+        shutil.rmtree(settings.MEDIA_ROOT, ignore_errors=True)
+        shutil.rmtree(settings.DOCUMENT_DELTA_CACHE_DIR, ignore_errors=True)
+
+    def test_superseded_versions_between_snapshots_are_stored_as_deltas(self):
+        blobs = [Blob.objects.get(sha256=version.sha256) for version in self.versions]
+        storage = self.versions[0].file.storage
+
+        # The newest version stays whole
+        self.assertEqual([blob.depth for blob in blobs], [0, 1, 2, 0, 1, 0])
+        self.assertIsNone(blobs[5].base_id)
+        self.assertEqual([blob.base_id for blob in blobs[1:3]], [blobs[0].pk, blobs[1].pk])
+        for blob in (blobs[1], blobs[2], blobs[4]):
+            self.assertFalse(storage.exists(blob.file.name))
+            self.assertLess(blob.stored_size, blob.size // 5)
+        # Each blob holds a reference on its base
+        self.assertEqual(blobs[1].ref_count, 2)
+
+        for version, content in zip(self.versions, self.revisions):
+            response = self.client.get(f'/api/documents/{self.document.id}/versions/{version.version_number}/content/')
+            self.assertEqual(b''.join(response.streaming_content), content)
+        # Media URLs of versions stored as deltas are rebuilt too
+        response = self.client.get(self.versions[2].file_url)
+        self.assertEqual(b''.join(response.streaming_content), self.revisions[2])
+        # Extraction reads the rebuilt file
+        with override_settings(DOCUMENT_EXTRACTION_CACHE=False):
+            extract_version_text(self.versions[2].id)
+        page = self.client.get(f'/api/documents/{self.document.id}/pages/?version=3').json()['pages'][0]
+        self.assertEqual(page['method'], 'text')
+        self.assertEqual(page['text'], self.revisions[2].decode()[:len(page['text'])])
+
+    def test_media_urls_of_deltas_are_only_rebuilt_for_owners(self):
+        url = self.versions[2].file_url
+        other = User.objects.create_user('other', 'other@example.com', 'password')
+
+        self.client.force_authenticate(None)
+        self.assertEqual(self.client.get(url).status_code, 401)
+        self.client.force_authenticate(other)
+        self.assertEqual(self.client.get(url).status_code, 404)
+        self.assertIsNone(deltas.get_cache().get(self.versions[2].sha256, '.txt'))
+
+        self.client.force_authenticate(self.user)
+        self.assertEqual(self.client.get(url).status_code, 200)
+        self.assertIsNotNone(deltas.get_cache().get(self.versions[2].sha256, '.txt'))
+
+    def test_command_encodes_existing_versions(self):
+        contents = [content + b'\n\nPlan copy.' for content in self.revisions]
+        with override_settings(DOCUMENT_VERSION_DELTAS=False):
+            document = create_document(self.user, 'plan', 'text', store(ContentFile(contents[0], name='plan.md')))
+            for content in contents[1:]:
+                add_version(document, store(ContentFile(content, name='plan.md')), self.user)
+
+        out = io.StringIO()
+        with self.captureOnCommitCallbacks(execute=True):
+            call_command('compact_versions', stdout=out)
+
+        self.assertIn('Stored 3 version file(s) as deltas', out.getvalue())
+        self.assertIn('Storage ratio', out.getvalue())
+        self.assertEqual(sorted(Blob.objects.exclude(base=None).values_list('depth', flat=True)), [1, 1, 1, 1, 2, 2])
+
+    def test_deleting_the_document_frees_deltas_and_bases(self):
+        storage = self.versions[0].file.storage
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.delete(f'/api/documents/{self.document.id}/')
+
+        self.assertFalse(Blob.objects.exists())
+        dirs, files = storage.listdir('blobs')
+        self.assertEqual([name for directory in dirs for name in walk_storage(f'blobs/{directory}')], [])
+
+
+@override_settings(MEDIA_ROOT=tempfile.mkdtemp())
+class ConcurrentVersionTests(TransactionTestCase):
+    uploads = 8
+
+    def tearDown(self):
+        from django.conf import settings
+        shutil.rmtree(settings.MEDIA_ROOT, ignore_errors=True)
+
+    def test_parallel_uploads_get_distinct_numbers(self):
+        user = User.objects.create_user('reviewer', 'reviewer@example.com', 'password')
+        document = make_document(user, 'contract')
+        start = threading.Barrier(self.uploads)
+
+        def upload(i):
+            client = APIClient()
+            client.force_authenticate(user)
+            try:
+                start.wait()
+                return client.post(f'/api/documents/{document.id}/version-create/', {
+                    'file': SimpleUploadedFile('notes.txt', b'same bytes'),
+                }, format='multipart').status_code
+            finally:
+                connection.close()
+
+        with ThreadPoolExecutor(self.uploads) as pool:
+            statuses = list(pool.map(upload, range(self.uploads)))
+
+        self.assertEqual(statuses, [201] * self.uploads)
+        numbers = sorted(document.versions.values_list('version_number', flat=True))
+        self.assertEqual(numbers, list(range(1, self.uploads + 2)))
+        document.refresh_from_db()
+        self.assertEqual(document.last_version_number, self.uploads + 1)
+        self.assertEqual(document.current_version.version_number, self.uploads + 1)
+        self.assertEqual(Blob.objects.get().ref_count, self.uploads)
+
+
+@override_settings(MEDIA_ROOT=tempfile.mkdtemp(), DOCUMENT_JOB_QUEUE='documents.jobs.DatabaseJobQueue')
+class BulkImportExportTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('reviewer', 'reviewer@example.com', 'password')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def tearDown(self):
+        from django.conf import settings
+        shutil.rmtree(settings.MEDIA_ROOT, ignore_errors=True)
+
+    def make_zip(self, files):
+        buffer = io.BytesIO()
+        with zipfile.ZipFile(buffer, 'w') as archive:
+            for name, content in files.items():
+                archive.writestr(name, content)
+        return SimpleUploadedFile('archive.zip', buffer.getvalue())
+
+    def test_import_zip_dedupes_and_queues_extraction(self):
+        archive = self.make_zip({
+            'contracts/lease.pdf': b'%PDF lease', 'contracts/copy.pdf': b'%PDF lease',
+            'notes.txt': b'notes', '__MACOSX/._notes.txt': b'junk',
+        })
+
+        response = self.client.post('/api/documents/import/', {'archive': archive}, format='multipart')
+
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.json()['files'], 3)
+        self.assertEqual(response.json()['imported'], 2)
+        self.assertEqual(response.json()['duplicates'], 1)
+        lease = Document.objects.get(name='lease')
+        self.assertEqual(lease.file_type, 'pdf')
+        self.assertEqual(lease.current_version.version_number, 1)
+        self.assertEqual(Blob.objects.get(sha256=lease.current_version.sha256).ref_count, 2)
+        self.assertEqual(list(Job.objects.values_list('task', 'payload')),
+                         [('extract_version_text', {'version_id': lease.current_version_id}),
+                          ('extract_version_text', {'version_id': Document.objects.get(name='notes').current_version_id}),
+                          ('render_version_thumbnails', {'version_id': lease.current_version_id})])
+
+    def test_import_directory_command(self):
+        source = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, source)
+        for i in range(5):
+            with open(os.path.join(source, f'doc-{i}.txt'), 'wb') as f:
+                f.write(f'document {i}'.encode())
+
+        call_command('import_documents', source, owner='reviewer', batch_size=2, stdout=io.StringIO())
+
+        self.assertEqual(Document.objects.filter(owner=self.user).count(), 5)
+        self.assertEqual(self.client.get('/api/documents/').json()['results'][0]['version_count'], 1)
+
+    def test_export_round_trips_through_import(self):
+        self.client.post('/api/documents/', {
+            'name': 'Lease agreement', 'file_type': 'text', 'file': SimpleUploadedFile('lease.txt', b'lease'),
+        }, format='multipart')
+
+        response = self.client.get('/api/documents/export/')
+        content = b''.join(response.streaming_content)
+
+        with zipfile.ZipFile(io.BytesIO(content)) as archive:
+            manifest = json.loads(archive.read('manifest.json'))
+            self.assertEqual(archive.read(manifest[0]['file']), b'lease')
+        other = User.objects.create_user('other', 'other@example.com', 'password')
+        self.client.force_authenticate(other)
+        self.client.post('/api/documents/import/', {'archive': SimpleUploadedFile('export.zip', content)},
+                         format='multipart')
+        self.assertEqual(Document.objects.get(owner=other).name, 'Lease agreement')
+
+
+class AnnotationBatchTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('reviewer', 'reviewer@example.com', 'password')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.document = make_document(self.user, 'contract', annotations=2)
+        self.url = f'/api/documents/{self.document.id}/annotations/batch/'
+
+    def test_mixed_batch_applies_in_request_order(self):
+        first, second = self.document.annotations.order_by('id')
+        operations = [
+            {'op': 'create', 'type': 'highlight', 'content': 'new 1', 'page': 3, 'position_x': 0.1, 'position_y': 0.2},
+            {'op': 'delete', 'id': first.id},
+            {'op': 'update', 'id': second.id, 'content': 'edited'},
+            {'op': 'create', 'type': 'comment', 'content': 'new 2'},
+        ]
+
+        # Document, annotations referenced, then insert, update, delete
+        # (collecting rows for the delete signals) and the document's
+        # generation inside one savepoint, plus the event counter and log in
+        # a nested one
+        with self.assertNumQueries(13):
+            response = self.client.post(self.url, {'operations': operations}, format='json')
+
+        self.assertEqual(response.status_code, 200)
+        results = response.json()['results']
+        self.assertEqual([r['op'] for r in results], ['create', 'delete', 'update', 'create'])
+        self.assertEqual(results[0]['annotation']['content'], 'new 1')
+        self.assertEqual(results[1]['id'], first.id)
+        self.assertEqual(results[2]['annotation']['content'], 'edited')
+        self.assertEqual(results[3]['annotation']['created_by'], 'reviewer')
+        self.assertEqual(
+            sorted(self.document.annotations.values_list('content', flat=True)),
+            ['edited', 'new 1', 'new 2'],
+        )
+
+    def test_batch_bumps_the_generation_once(self):
+        generation = Document.objects.get(pk=self.document.pk).generation
+        operations = [{'op': 'delete', 'id': pk} for pk in self.document.annotations.values_list('id', flat=True)]
+        operations.append({'op': 'create', 'type': 'comment', 'content': 'new'})
+
+        response = self.client.post(self.url, {'operations': operations}, format='json')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(Document.objects.get(pk=self.document.pk).generation, generation + 1)
+
+    def test_invalid_batch_applies_nothing(self):
+        annotation = self.document.annotations.first()
+        operations = [
+            {'op': 'create', 'type': 'comment', 'content': 'fine'},
+            {'op': 'create', 'type': 'sticker', 'content': 'bad type'},
+            {'op': 'delete', 'id': 999999},
+            {'op': 'delete', 'id': annotation.id},
+        ]
+
+        response = self.client.post(self.url, operations, format='json')
+
+        self.assertEqual(response.status_code, 400)
+        errors = response.json()['errors']
+        self.assertIsNone(errors[0])
+        self.assertIn('type', errors[1])
+        self.assertIn('id', errors[2])
+        self.assertIsNone(errors[3])
+        self.assertEqual(self.document.annotations.count(), 2)
+
+    def test_other_users_documents_are_off_limits(self):
+        other = User.objects.create_user('other', 'other@example.com', 'password')
+        self.client.force_authenticate(other)
+
+        response = self.client.post(self.url, [{'op': 'create', 'type': 'comment', 'content': 'x'}], format='json')
+
+        self.assertEqual(response.status_code, 404)
+
+
+class AnnotationViewportTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('reviewer', 'reviewer@example.com', 'password')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.document = make_document(self.user, 'contract')
+        for page, x, y in [(1, 0.1, 0.1), (2, 0.2, 0.2), (2, 0.8, 0.8), (3, 0.3, 0.3), (2, None, None)]:
+            Annotation.objects.create(document=self.document, user=self.user, type='highlight',
+                                      content=f'{page} {x}', page=page, position_x=x, position_y=y)
+
+    def contents(self, url):
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        rows = response.json()
+        rows = rows['results'] if isinstance(rows, dict) else rows
+        return sorted(row['content'] for row in rows)
+
+    def test_page_range_and_bounding_box(self):
+        base = f'/api/documents/{self.document.id}/annotations/'
+
+        self.assertEqual(self.contents(f'{base}?start=2&end=3'), ['2 0.2', '2 0.8', '2 None', '3 0.3'])
+        self.assertEqual(self.contents(f'{base}?page=2&bbox=0.5,0.5,0,0'), ['2 0.2'])
+        self.assertEqual(self.contents('/api/annotations/?bbox=0,0,0.25,0.25'), ['1 0.1', '2 0.2'])
+        self.assertEqual(self.client.get(f'{base}?bbox=1,2').status_code, 400)
+
+    def test_other_users_see_only_their_own_annotations(self):
+        other = User.objects.create_user('other', 'other@example.com', 'password')
+        Annotation.objects.create(document=self.document, user=other, type='comment', content='mine', page=2)
+        self.client.force_authenticate(other)
+
+        self.assertEqual(self.contents('/api/annotations/?page=2'), ['mine'])
+
+
+class AnnotationSyncTests(TransactionTestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('reviewer', 'reviewer@example.com', 'password')
+        self.token = Token.objects.create(user=self.user)
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.document = make_document(self.user, 'contract')
+
+    def connect(self, since=None, token=None):
+        query = f'token={token or self.token.key}'
+        if since is not None:
+            query += f'&since={since}'
+        return WebsocketCommunicator(application, f'/ws/documents/{self.document.id}/annotations/?{query}',
+                                     headers=[(b'origin', b'http://localhost')])
+
+    def create_annotation(self, content):
+        response = self.client.post(f'/api/documents/{self.document.id}/create-annotation/',
+                                    {'content': content, 'page': 2}, format='json')
+        self.assertEqual(response.status_code, 201)
+        return response.json()
+
+    def test_every_mutation_path_logs_numbered_events(self):
+        created = self.create_annotation('first')
+        self.client.patch(f'/api/annotations/{created["id"]}/', {'content': 'edited'}, format='json')
+        self.client.post(f'/api/documents/{self.document.id}/annotations/batch/', [
+            {'op': 'create', 'type': 'comment', 'content': 'batched'},
+            {'op': 'delete', 'id': created['id']},
+        ], format='json')
+
+        events = list(AnnotationEvent.objects.filter(document=self.document).values_list('seq', 'op'))
+        self.assertEqual(events, [(1, 'create'), (2, 'update'), (3, 'create'), (4, 'delete')])
+        self.assertEqual(AnnotationEvent.objects.get(seq=2).data['content'], 'edited')
+        self.document.refresh_from_db()
+        self.assertEqual(self.document.last_event_seq, 4)
+
+    async def test_subscriber_receives_changes_and_resumes(self):
+        communicator = self.connect()
+        connected, _ = await communicator.connect()
+        self.assertTrue(connected)
+        self.assertEqual(await communicator.receive_json_from(), {'type': 'subscribed', 'seq': 0})
+
+        await database_sync_to_async(self.create_annotation)('live')
+        message = await communicator.receive_json_from()
+        self.assertEqual(message['type'], 'events')
+        self.assertEqual([(e['seq'], e['op'], e['annotation']['content']) for e in message['events']],
+                         [(1, 'create', 'live')])
+        await communicator.disconnect()
+
+        # Changes made while disconnected are replayed from the log
+        await database_sync_to_async(self.create_annotation)('offline 1')
+        await database_sync_to_async(self.create_annotation)('offline 2')
+        communicator = self.connect(since=1)
+        await communicator.connect()
+        message = await communicator.receive_json_from()
+        self.assertEqual([e['seq'] for e in message['events']], [2, 3])
+        self.assertEqual(await communicator.receive_json_from(), {'type': 'subscribed', 'seq': 3})
+        await communicator.disconnect()
+
+    async def test_pruned_history_asks_client_to_reload(self):
+        await database_sync_to_async(self.create_annotation)('old')
+        await database_sync_to_async(self.create_annotation)('new')
+        await database_sync_to_async(call_command)('prune_annotation_events', '--max-age=0', stdout=io.StringIO())
+
+        communicator = self.connect(since=0)
+        await communicator.connect()
+        self.assertEqual(await communicator.receive_json_from(), {'type': 'reset', 'seq': 2})
+        await communicator.disconnect()
+
+    async def test_only_the_owner_can_subscribe(self):
+        other = await database_sync_to_async(User.objects.create_user)('other', 'other@example.com', 'password')
+        other_token = await database_sync_to_async(Token.objects.create)(user=other)
+
+        connected, code = await self.connect(token=other_token.key).connect()
+        self.assertEqual((connected, code), (False, 4403))
+        connected, code = await self.connect(token='not-a-token').connect()
+        self.assertEqual((connected, code), (False, 4401))
+
+
+class AsyncReadViewTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('reviewer', 'reviewer@example.com', 'password')
+        self.token = Token.objects.create(user=self.user)
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {self.token.key}')
+        self.document = make_document(self.user, 'contract', versions=3, annotations=2)
+        make_document(self.user, 'invoice')
+        for number in (1, 2):
+            DocumentPage.objects.create(document=self.document, version=self.document.current_version,
+                                        page_number=number,
+                                        text=f'page {number}: renewal notice for the contract')
+
+    async def call(self, view, path, token=None, **kwargs):
+        request = AsyncRequestFactory().get(path, headers={'Authorization': f'Token {token or self.token.key}'})
+        return await view(request, **kwargs)
+
+    async def test_responses_match_the_sync_views(self):
+        pk = self.document.id
+        cases = [
+            (async_views.document_list, '/api/documents/?expand=versions&page_size=1', {}),
+            (async_views.document_detail, f'/api/documents/{pk}/', {'pk': pk}),
+            (async_views.document_version_list, f'/api/documents/{pk}/version-list/', {'pk': pk}),
+            (async_views.version_list, f'/api/documents/{pk}/versions/', {'document_id': pk}),
+            (async_views.document_search, f'/api/documents/{pk}/search/?query=renewal&limit=1', {'pk': pk}),
+        ]
+        for view, path, kwargs in cases:
+            with self.subTest(path=path):
+                expected = await sync_to_async(self.client.get)(path)
+                result_cache.clear()
+                caching.get_cache().clear()
+                response = await self.call(view, path, **kwargs)
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual(json.loads(response.content), expected.json())
+
+    async def test_authentication_and_ownership(self):
+        other = await sync_to_async(User.objects.create_user)('other', 'other@example.com', 'password')
+        other_token = await sync_to_async(Token.objects.create)(user=other)
+        path = f'/api/documents/{self.document.id}/'
+
+        response = await self.call(async_views.document_detail, path, token='not-a-token', pk=self.document.id)
+        self.assertEqual(response.status_code, 401)
+        self.assertEqual(response['WWW-Authenticate'], 'Token')
+
+        response = await self.call(async_views.document_detail, path, token=other_token.key, pk=self.document.id)
+        self.assertEqual(response.status_code, 404)
+        response = await self.call(async_views.document_search, path + 'search/?query=x',
+                                   token=other_token.key, pk=self.document.id)
+        self.assertEqual(response.status_code, 404)
+
+    async def test_conditional_requests_share_the_sync_etag(self):
+        path = f'/api/documents/{self.document.id}/'
+        etag = (await sync_to_async(self.client.get)(path))['ETag']
+
+        request = AsyncRequestFactory().get(path, headers={
+            'Authorization': f'Token {self.token.key}', 'If-None-Match': etag,
+        })
+        response = await async_views.document_detail(request, pk=self.document.id)
+        self.assertEqual(response.status_code, 304)
+
+
+class ResponseCacheTests(TestCase):
+    def setUp(self):
+        caching.get_cache().clear()
+        self.user = User.objects.create_user('reviewer', 'reviewer@example.com', 'password')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.document = make_document(self.user, 'contract', versions=2, annotations=1)
+        self.url = f'/api/documents/{self.document.id}/'
+
+    def test_unchanged_document_is_not_modified(self):
+        response = self.client.get(self.url)
+        etag = response['ETag']
+        self.assertIn('private', response['Cache-Control'])
+
+        # Only the fingerprint is read; nothing is loaded or serialized
+        with self.assertNumQueries(1):
+            response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response['ETag'], etag)
+
+    def test_cached_response_skips_the_queries(self):
+        first = self.client.get(self.url)
+        with self.assertNumQueries(1):
+            second = self.client.get(self.url)
+        self.assertEqual(second.json(), first.json())
+        self.assertEqual(second['ETag'], first['ETag'])
+
+    def test_changes_invalidate_the_document(self):
+        versions_url = self.url + 'versions/'
+        annotations_url = self.url + 'annotations/'
+        changes = [
+            lambda: Annotation.objects.create(document=self.document, user=self.user, content='new'),
+            lambda: self.document.annotations.first().delete(),
+            lambda: DocumentVersion.objects.create(document=self.document, version_number=3,
+                                                   file='document_versions/v3.pdf', created_by=self.user),
+            lambda: self.document.versions.order_by('id').first().delete(),
+            lambda: Document.objects.get(pk=self.document.pk).save(),
+        ]
+        for change in changes:
+            etags = [self.client.get(url)['ETag'] for url in (self.url, versions_url, annotations_url)]
+            change()
+            for url, etag in zip((self.url, versions_url, annotations_url), etags):
+                with self.subTest(url=url):
+                    response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+                    self.assertEqual(response.status_code, 200)
+                    self.assertNotEqual(response['ETag'], etag)
+
+        response = self.client.get(self.url)
+        self.assertEqual(len(response.json()['annotations']), 1)
+        self.assertEqual(len(response.json()['versions']), 2)
+
+    def test_library_list_tracks_every_document(self):
+        etag = self.client.get('/api/documents/')['ETag']
+        other = make_document(self.user, 'invoice')
+        response = self.client.get('/api/documents/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.json()['results']), 2)
+
+        etag = response['ETag']
+        other.delete()
+        response = self.client.get('/api/documents/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.json()['results']), 1)
+
+    def test_batch_edits_invalidate(self):
+        url = self.url + 'annotations/'
+        etag = self.client.get(url)['ETag']
+        response = self.client.post(self.url + 'annotations/batch/', {'operations': [
+            {'op': 'create', 'type': 'comment', 'content': 'batched'},
+        ]}, format='json')
+        self.assertEqual(response.status_code, 200)
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.json()), 2)
+
+    def test_responses_are_per_user(self):
+        other = User.objects.create_user('other', 'other@example.com', 'password')
+        etag = self.client.get(self.url)['ETag']
+
+        self.client.force_authenticate(other)
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 404)
+
+
+class TokenAuthCacheTests(TestCase):
+    def setUp(self):
+        token_cache.clear()
+        self.user = User.objects.create_user('reviewer', 'reviewer@example.com', 'password')
+        self.token = Token.objects.create(user=self.user)
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {self.token.key}')
+
+    def test_repeated_lookups_skip_the_database(self):
+        with self.assertNumQueries(1):
+            user, token = CachedTokenAuthentication().authenticate_credentials(self.token.key)
+        with self.assertNumQueries(0):
+            cached_user, cached_token = CachedTokenAuthentication().authenticate_credentials(self.token.key)
+        self.assertEqual(cached_user, user)
+        self.assertEqual(cached_token, token)
+        self.assertIsNot(cached_user, user)
+
+    def test_logout_invalidates_the_token(self):
+        self.assertEqual(self.client.get('/api/documents/').status_code, 200)
+        self.assertEqual(self.client.post('/api/auth/logout/').status_code, 204)
+        self.assertEqual(self.client.get('/api/documents/').status_code, 401)
+
+    def test_rotation_replaces_the_token(self):
+        self.assertEqual(self.client.get('/api/documents/').status_code, 200)
+        new_key = self.client.post('/api/auth/token/rotate/').json()['token']
+
+        self.assertEqual(self.client.get('/api/documents/').status_code, 401)
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {new_key}')
+        self.assertEqual(self.client.get('/api/documents/').status_code, 200)
+
+    def test_deactivated_user_is_rejected(self):
+        self.assertEqual(self.client.get('/api/documents/').status_code, 200)
+        self.user.is_active = False
+        self.user.save()
+        self.assertEqual(self.client.get('/api/documents/').status_code, 401)
+
+    @override_settings(DOCUMENT_TOKEN_CACHE_TTL=0)
+    def test_zero_ttl_disables_the_cache(self):
+        CachedTokenAuthentication().authenticate_credentials(self.token.key)
+        with self.assertNumQueries(1):
+            CachedTokenAuthentication().authenticate_credentials(self.token.key)
+
+
+class MetricsTests(TestCase):
+    def setUp(self):
+        for metric in metrics.registry:
+            metric.clear()
+        self.user = User.objects.create_user('reviewer', 'reviewer@example.com', 'password')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        make_document(self.user, 'contract', versions=2, annotations=1)
+
+    def test_requests_are_measured_per_view(self):
+        self.client.get('/api/documents/')
+        body = self.client.get('/metrics').content.decode()
+
+        labels = 'view="document-list",method="GET"'
+        self.assertIn(f'docmanager_http_request_duration_seconds_count{{{labels},status="200"}} 1', body)
+        self.assertIn(f'docmanager_http_request_db_queries_count{{{labels}}} 1', body)
+        self.assertNotIn(f'docmanager_http_request_db_queries_sum{{{labels}}} 0.0', body)
+        self.assertIn(f'docmanager_http_request_render_duration_seconds_count{{{labels}}} 1', body)
+        self.assertIn(f'docmanager_http_response_bytes_total{{{labels}}}', body)
+
+    async def test_async_requests_are_measured(self):
+        token = await sync_to_async(Token.objects.create)(user=self.user)
+        await self.async_client.get('/api/documents/', headers={'Authorization': f'Token {token.key}'})
+        body = metrics.render()
+        self.assertIn('docmanager_http_request_db_queries_count{view="document-list",method="GET"} 1', body)
+        self.assertNotIn('docmanager_http_request_db_queries_sum{view="document-list",method="GET"} 0.0', body)
+
+    @override_settings(DOCUMENT_METRICS_TOKEN='scraper')
+    def test_metrics_token(self):
+        self.assertEqual(self.client.get('/metrics').status_code, 401)
+        response = self.client.get('/metrics', HTTP_AUTHORIZATION='Bearer scraper')
+        self.assertEqual(response.status_code, 200)
+
+    @override_settings(DOCUMENT_SLOW_REQUEST_SECONDS=0)
+    def test_slow_requests_log_their_queries(self):
+        with self.assertLogs('documents.slow_requests', 'WARNING') as logs:
+            self.client.get('/api/documents/')
+        [record] = logs.records
+        self.assertEqual(record.fields['view'], 'document-list')
+        self.assertTrue(any('documents_document' in query['sql'] for query in record.fields['queries']))
+
+    @override_settings(DOCUMENT_SLOW_REQUEST_SECONDS=0, DOCUMENT_SLOW_REQUEST_PROFILER='cprofile')
+    def test_slow_requests_can_be_profiled(self):
+        with self.assertLogs('documents.slow_requests', 'WARNING') as logs:
+            self.client.get('/api/documents/')
+        self.assertIn('cumulative', logs.records[0].fields['profile'])
+
+    def test_json_log_lines(self):
+        with self.assertLogs('documents.requests', 'INFO') as logs:
+            self.client.get('/api/documents/')
+        line = json.loads(metrics.JsonFormatter().format(logs.records[0]))
+        self.assertEqual(line['view'], 'document-list')
+        self.assertEqual(line['status'], 200)
+        self.assertGreater(line['db_queries'], 0)
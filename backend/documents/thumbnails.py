@@ -0,0 +1,175 @@
+"""Server-side page thumbnails and previews.
+
+Pages are rasterized with pdfium (images are simply scaled with Pillow) and
+kept as JPEGs in a size-bounded disk cache that evicts the least recently
+used files. Cache entries are keyed by the version's content hash, so
+versions and documents sharing a blob share their images too. A job renders
+the first pages of every new version; anything else (or anything evicted)
+is rendered on first request.
+"""
+import io
+import os
+import threading
+
+import pypdfium2 as pdfium
+from django.conf import settings
+from PIL import Image
+
+from .deltas import materialize
+from .diskcache import DiskCache
+
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.gif', '.bmp', '.tif', '.tiff', '.webp')
+
+# pdfium is not thread-safe; serialize rendering within a process
+_render_lock = threading.Lock()
+_cache = None
+
+
+class UnsupportedFile(Exception):
+    """The file type can't be rendered"""
+
+
+def can_render(name):
+    """Whether files named like ``name`` get thumbnails"""
+    extension = os.path.splitext(name)[1].lower()
+    return extension == '.pdf' or extension in IMAGE_EXTENSIONS
+
+
+def image_widths():
+    """Return ``{kind: width in pixels}`` for every image kind we render"""
+    return {
+        'thumb': getattr(settings, 'DOCUMENT_THUMBNAIL_WIDTH', 200),
+        'preview': getattr(settings, 'DOCUMENT_PREVIEW_WIDTH', 1024),
+    }
+
+
+class ThumbnailCache(DiskCache):
+    """Rendered page images, keyed by content hash, page and image kind"""
+
+    def path(self, key, page_number, kind):
+        return os.path.join(self.directory, key[:2], key, f'{page_number}-{kind}.jpg')
+
+    def get(self, key, page_number, kind):
+        """Return the path of a cached image, or None"""
+        return self._get(self.path(key, page_number, kind))
+
+    def put(self, key, page_number, kind, data):
+        """Store image bytes and return their path"""
+        return self._put(self.path(key, page_number, kind), data)
+
+
+def get_cache():
+    """Return the shared cache, recreating it if its settings changed"""
+    global _cache
+    directory = getattr(settings, 'DOCUMENT_THUMBNAIL_CACHE_DIR', os.path.join(settings.BASE_DIR, 'thumbnail_cache'))
+    max_bytes = getattr(settings, 'DOCUMENT_THUMBNAIL_CACHE_MAX_BYTES', 512 * 1024 ** 2)
+    if _cache is None or (_cache.directory, _cache.max_bytes) != (directory, max_bytes):
+        _cache = ThumbnailCache(directory, max_bytes)
+    return _cache
+
+
+def cache_key(version):
+    return version.sha256 or f'version-{version.pk}'
+
+
+class PageRenderer:
+    """Renders pages of one stored file; use as a context manager"""
+
+    def __init__(self, field_file):
+        if not can_render(field_file.name):
+            raise UnsupportedFile(f"Can't render {field_file.name}")
+        extension = os.path.splitext(field_file.name)[1].lower()
+        # pdfium and Pillow both read from a local path directly
+        try:
+            source = field_file.path
+        except NotImplementedError:
+            with field_file.open('rb') as f:
+                source = io.BytesIO(f.read())
+
+        if extension == '.pdf':
+            self._pdf = pdfium.PdfDocument(source)
+            self._image = None
+            self.page_count = len(self._pdf)
+        else:
+            self._pdf = None
+            self._image = Image.open(source)
+            self.page_count = getattr(self._image, 'n_frames', 1)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        if self._pdf is not None:
+            self._pdf.close()
+        if self._image is not None:
+            self._image.close()
+
+    def render(self, page_number, width):
+        """Return a JPEG of the 1-based ``page_number`` scaled to ``width`` pixels"""
+        if not 1 <= page_number <= self.page_count:
+            raise IndexError(f"No page {page_number}")
+
+        if self._pdf is not None:
+            with _render_lock:
+                page = self._pdf[page_number - 1]
+                try:
+                    bitmap = page.render(scale=width / page.get_width())
+                    image = bitmap.to_pil()
+                finally:
+                    page.close()
+            if image.width != width:
+                # pdfium rounds the scaled page size up
+                image = image.resize((width, round(image.height * width / image.width)))
+        else:
+            self._image.seek(page_number - 1)
+            image = self._image.copy()
+            image.thumbnail((width, width * 10))
+
+        out = io.BytesIO()
+        image.convert('RGB').save(out, 'JPEG', quality=80, optimize=True)
+        return out.getvalue()
+
+
+def render_version(version, pages=None):
+    """Render the first ``pages`` pages of a version into the cache, skipping cached images.
+
+    Returns the number of images rendered.
+    """
+    if pages is None:
+        pages = getattr(settings, 'DOCUMENT_THUMBNAIL_PRERENDER_PAGES', 10)
+    cache = get_cache()
+    key = cache_key(version)
+    rendered = 0
+    with PageRenderer(materialize(version.file)) as renderer:
+        for page_number in range(1, min(pages, renderer.page_count) + 1):
+            for kind, width in image_widths().items():
+                if cache.get(key, page_number, kind) is None:
+                    cache.put(key, page_number, kind, renderer.render(page_number, width))
+                    rendered += 1
+    return rendered
+
+
+def page_image(version, page_number, kind='thumb'):
+    """Return the JPEG bytes of a page image, rendering it on a cache miss.
+
+    Raises ``IndexError`` for pages past the end and ``UnsupportedFile`` for
+    files that can't be rendered.
+    """
+    cache = get_cache()
+    key = cache_key(version)
+    path = cache.get(key, page_number, kind)
+    if path is not None:
+        try:
+            with open(path, 'rb') as f:
+                return f.read()
+        except FileNotFoundError:
+            # Evicted since the lookup
+            pass
+
+    with PageRenderer(materialize(version.file)) as renderer:
+        data = renderer.render(page_number, image_widths()[kind])
+    cache.put(key, page_number, kind, data)
+    return data
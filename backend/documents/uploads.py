@@ -0,0 +1,166 @@
+"""Resumable chunked uploads.
+
+A client opens a session with the file's size (and optionally its SHA-256),
+PUTs the bytes in order as raw request bodies at the session's current
+offset, and finally completes the session. Chunks are streamed from the
+request straight into a part file under ``DOCUMENT_UPLOAD_SESSION_DIR``, so
+neither a chunk nor the whole file is ever held in memory. On completion the
+part file is verified and handed to the blob store, then to the same
+document/version creation path as a regular upload.
+"""
+import hashlib
+import os
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.db import transaction
+from django.utils import timezone
+
+from .blobstore import LocalFile, blob_name, hash_file, store
+from .models import Blob, UploadSession
+from .services import add_version, create_document
+
+READ_SIZE = 1024 * 1024
+
+
+class UploadError(Exception):
+    """A chunk or a completed upload failed validation"""
+
+
+class OffsetConflict(UploadError):
+    """The chunk doesn't start where the session's received bytes end"""
+
+
+def session_dir():
+    return getattr(settings, 'DOCUMENT_UPLOAD_SESSION_DIR', os.path.join(settings.BASE_DIR, 'upload_sessions'))
+
+
+def part_path(session):
+    return os.path.join(session_dir(), f'{session.pk}.part')
+
+
+def open_session(session):
+    """Create the empty part file for a new session"""
+    os.makedirs(session_dir(), exist_ok=True)
+    open(part_path(session), 'wb').close()
+
+
+def discard(session):
+    """Delete the session's part file, if it still has one"""
+    try:
+        os.remove(part_path(session))
+    except FileNotFoundError:
+        pass
+
+
+def restore_part(session, sha256):
+    """Move the part file back out of the blob store after storing it was rolled back.
+
+    ``store`` moves the part file into place rather than copying it, so
+    without this the session couldn't be completed again and the blob file
+    would be left without a row.
+    """
+    path = part_path(session)
+    name = blob_name(sha256, session.filename)
+    if os.path.exists(path) or Blob.objects.filter(sha256=sha256).exists() or not default_storage.exists(name):
+        return
+    os.replace(default_storage.path(name), path)
+
+
+def write_chunk(session, offset, stream, sha256=None):
+    """Copy ``stream`` into the part file at ``offset`` and record the new offset.
+
+    ``offset`` must equal the bytes received so far. The chunk is checked
+    against ``sha256`` (hex) when given; a rejected chunk is cut off again so
+    the client can simply resend it. Returns the number of bytes written.
+    """
+    if offset != session.received:
+        raise OffsetConflict(f"Expected offset {session.received}")
+
+    digest = hashlib.sha256()
+    written = 0
+    limit = session.size - offset
+    with open(part_path(session), 'r+b') as f:
+        f.seek(offset)
+        while True:
+            data = stream.read(READ_SIZE) if stream is not None else b''
+            if not data:
+                break
+            written += len(data)
+            if written > limit:
+                f.truncate(offset)
+                raise UploadError("Chunk runs past the declared file size")
+            digest.update(data)
+            f.write(data)
+        if not written:
+            raise UploadError("Empty chunk")
+        if sha256 and digest.hexdigest() != sha256.lower():
+            f.truncate(offset)
+            raise UploadError("Chunk checksum mismatch")
+
+    # Only one of two racing requests for the same offset gets to advance it
+    advanced = UploadSession.objects.filter(
+        pk=session.pk, status='active', received=offset
+    ).update(received=offset + written, updated_at=timezone.now())
+    if not advanced:
+        raise OffsetConflict("Offset was advanced by another request")
+    session.received = offset + written
+    return written
+
+
+def complete(session):
+    """Verify the assembled file and turn it into a document or a new version.
+
+    A size or checksum mismatch fails the session for good, since resending
+    chunks at the end offset can't repair bytes already written.
+    """
+    if session.received != session.size:
+        raise UploadError(f"Received {session.received} of {session.size} bytes")
+
+    path = part_path(session)
+    with open(path, 'rb') as f:
+        upload = LocalFile(f, name=session.filename)
+        sha256, size = hash_file(upload)
+        if size != session.size or (session.sha256 and sha256 != session.sha256):
+            session.status = 'failed'
+            session.save(update_fields=['status', 'updated_at'])
+            discard(session)
+            raise UploadError("File checksum mismatch")
+
+        try:
+            with transaction.atomic():
+                # A concurrent complete request must not create a second document
+                if not UploadSession.objects.select_for_update().filter(pk=session.pk, status='active').exists():
+                    raise OffsetConflict("Upload was already completed")
+
+                blob = store(upload, sha256=sha256, size=size)
+                if session.document_id:
+                    session.version = add_version(session.document, blob, session.owner, session.filename)
+                else:
+                    name = session.name or session.filename
+                    session.document = create_document(session.owner, name, session.file_type, blob,
+                                                       session.filename)
+                    session.version = session.document.current_version
+                session.status = 'complete'
+                session.save()
+        except Exception:
+            restore_part(session, sha256)
+            raise
+
+    # Left behind when the blob already existed and nothing was moved
+    discard(session)
+    return session
+
+
+def expire_sessions(max_age=None):
+    """Discard active sessions idle for longer than ``max_age`` and return how many"""
+    if max_age is None:
+        max_age = timedelta(seconds=getattr(settings, 'DOCUMENT_UPLOAD_SESSION_TTL', 24 * 60 * 60))
+    stale = UploadSession.objects.filter(status='active', updated_at__lt=timezone.now() - max_age)
+    count = 0
+    for session in stale:
+        discard(session)
+        session.delete()
+        count += 1
+    return count
@@ -1,25 +1,52 @@
+from django.conf import settings
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
-from .views import DocumentViewSet, DocumentVersionViewSet, AnnotationViewSet, login_user, register_user
+from . import async_views
+from .downloads import IgnoreClientContentNegotiation
+from .views import DocumentViewSet, DocumentVersionViewSet, AnnotationViewSet, UploadSessionViewSet, login_user, logout_user, register_user, rotate_token
 
 router = DefaultRouter()
 router.register(r'documents', DocumentViewSet)
 router.register(r'versions', DocumentVersionViewSet, basename='version')
 router.register(r'annotations', AnnotationViewSet, basename='annotation')
+router.register(r'uploads', UploadSessionViewSet, basename='upload')
 
 urlpatterns = [
     path('', include(router.urls)),
     path('auth/login/', login_user, name='login'),
     path('auth/register/', register_user, name='register'),
+    path('auth/logout/', logout_user, name='logout'),
+    path('auth/token/rotate/', rotate_token, name='rotate-token'),
     
     # Explicit document-related paths
     path('documents/<int:document_id>/versions/', DocumentVersionViewSet.as_view({'get': 'list', 'post': 'create'}), name='document-versions'),
     
-    path('documents/<int:document_id>/versions/<int:pk>/', DocumentVersionViewSet.as_view({'get': 'retrieve', 'delete': 'destroy'}), name='document-version-detail'),
+    # Versions are addressed by their number within the document under this prefix
+    path('documents/<int:document_id>/versions/<int:version_number>/', DocumentVersionViewSet.as_view({'get': 'retrieve', 'delete': 'destroy'}, lookup_field='version_number'), name='document-version-detail'),
+    
+    path('documents/<int:document_id>/versions/<int:version_number>/content/', DocumentVersionViewSet.as_view({'get': 'content'}, lookup_field='version_number', content_negotiation_class=IgnoreClientContentNegotiation), name='document-version-content'),
+    
+    path('documents/<int:document_id>/versions/<int:version_number>/pages/<int:page_number>/thumb/', DocumentVersionViewSet.as_view({'get': 'thumbnail'}, lookup_field='version_number', content_negotiation_class=IgnoreClientContentNegotiation), name='document-version-thumbnail'),
     
     path('documents/<int:document_id>/annotations/', AnnotationViewSet.as_view({'get': 'list', 'post': 'create'}), name='document-annotations'),
     
     path('documents/<int:document_id>/annotations/<int:pk>/', AnnotationViewSet.as_view({'get': 'retrieve', 'put': 'update', 'patch': 'partial_update', 'delete': 'destroy'}), name='document-annotation-detail'),
     
     path('documents/<int:pk>/search/', DocumentViewSet.as_view({'get': 'search'}), name='document-search'),
-] 
\ No newline at end of file
+] 
+
+# Async GET handlers for the read-heavy endpoints, ahead of the DRF routes
+async_urlpatterns = [
+    path('documents/', async_views.read_async(async_views.document_list, DocumentViewSet.as_view({'get': 'list', 'post': 'create'}))),
+    
+    path('documents/<int:pk>/', async_views.read_async(async_views.document_detail, DocumentViewSet.as_view({'get': 'retrieve', 'put': 'update', 'patch': 'partial_update', 'delete': 'destroy'}))),
+    
+    path('documents/<int:pk>/version-list/', async_views.read_async(async_views.document_version_list, DocumentViewSet.as_view({'get': 'list_versions'}))),
+    
+    path('documents/<int:document_id>/versions/', async_views.read_async(async_views.version_list, DocumentVersionViewSet.as_view({'get': 'list', 'post': 'create'}))),
+    
+    path('documents/<int:pk>/search/', async_views.read_async(async_views.document_search, DocumentViewSet.as_view({'get': 'search'}))),
+]
+
+if getattr(settings, 'DOCUMENT_ASYNC_VIEWS', False):
+    urlpatterns = async_urlpatterns + urlpatterns
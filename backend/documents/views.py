@@ -1,52 +1,95 @@
+import logging
+import zipfile
+
+from django.conf import settings
 from django.shortcuts import render
-from rest_framework import viewsets, permissions, status, filters
+from rest_framework import mixins, viewsets, permissions, status
 from rest_framework.decorators import action, api_view, permission_classes
 from rest_framework.response import Response
+from rest_framework.views import APIView
 from django.shortcuts import get_object_or_404
-from django.db.models import Q
+from django.db import transaction
+from django.db.models import Count, OuterRef, Prefetch, Q, Subquery
+from django.db.models.functions import Coalesce
 from django.contrib.auth.models import User
+from django.http import Http404, HttpResponse, StreamingHttpResponse
+from django.utils.cache import get_conditional_response
+from django.utils.crypto import constant_time_compare
+from django.utils.http import content_disposition_header, quote_etag
 from django.contrib.auth import authenticate
 from rest_framework.authtoken.models import Token
 from rest_framework.permissions import AllowAny, IsAuthenticated
-from .models import Document, DocumentVersion, Annotation
-from .serializers import DocumentSerializer, DocumentVersionSerializer, AnnotationSerializer, UserSerializer
-import PyPDF2
-import io
-import re
+from .models import Blob, Document, DocumentPage, DocumentVersion, Annotation, UploadSession
+from .serializers import DocumentSerializer, DocumentListSerializer, DocumentVersionSerializer, DocumentPageSerializer, AnnotationSerializer, UploadSessionSerializer, UserSerializer, get_expand
+from .blobstore import release, store
+from .caching import bump_generation, cache_response
+from .deltas import materialize
+from .bulk import import_entries, iter_library_zip, iter_zip
+from .downloads import IgnoreClientContentNegotiation, serve_file
+from .extraction import can_extract
+from .filters import AnnotationViewportFilter, FullTextSearchFilter
+from .pagination import CreatedAtCursorPagination
+from .realtime import record_events
+from .search_engine import ALL_VERSIONS, search_document
+from .search_index import search_library
+from .services import add_version, start_document
+from .thumbnails import UnsupportedFile, cache_key, image_widths, page_image
+from . import caching, metrics, uploads
 
 # Create your views here.
 
+logger = logging.getLogger(__name__)
+
+VERSIONS_PREFETCH = Prefetch('versions', queryset=DocumentVersion.objects.select_related('created_by'))
+ANNOTATIONS_PREFETCH = Prefetch('annotations', queryset=Annotation.objects.select_related('user'))
+
+def count_related(model):
+    """Subquery counting ``model`` rows that point at the outer document"""
+    counts = model.objects.filter(document=OuterRef('pk')).order_by().values('document').annotate(
+        count=Count('id')
+    ).values('count')
+    return Coalesce(Subquery(counts), 0)
+
+def record_annotation_change(op, annotation):
+    """Log a single annotation change for live subscribers"""
+    data = AnnotationSerializer(annotation).data if op != 'delete' else None
+    record_events(annotation.document_id, [(op, annotation.pk, data)])
+
+def metrics_endpoint(request):
+    """Prometheus metrics of this process"""
+    token = getattr(settings, 'DOCUMENT_METRICS_TOKEN', '')
+    if token and not constant_time_compare(request.headers.get('Authorization', ''), f'Bearer {token}'):
+        return HttpResponse(status=status.HTTP_401_UNAUTHORIZED, headers={'WWW-Authenticate': 'Bearer'})
+    return HttpResponse(metrics.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+class BlobFileView(APIView):
+    """A file under MEDIA_URL/blobs/, rebuilt if it is stored as a delta.
+
+    The web server serves stored files directly and falls back to this view
+    for the missing ones, so version URLs keep working in delta storage mode.
+    Like a version's content endpoint, it is only for owners of a document
+    or version with the file, so no one else can make the server rebuild it.
+    """
+    permission_classes = [IsAuthenticated]
+    content_negotiation_class = IgnoreClientContentNegotiation
+
+    def get(self, request, path):
+        name = f'blobs/{path}'
+        versions = DocumentVersion.objects.filter(file=name, document__owner=request.user)
+        if not (versions.exists() or Document.objects.filter(file=name, owner=request.user).exists()):
+            raise Http404
+        blob = get_object_or_404(Blob, file=name)
+        original_name = versions.exclude(original_name='').values_list('original_name', flat=True).first()
+        return serve_file(request, materialize(blob.file), fallback_modified=blob.created_at,
+                          filename=original_name)
+
+
 class IsOwnerOrReadOnly(permissions.BasePermission):
     def has_object_permission(self, request, view, obj):
         if request.method in permissions.SAFE_METHODS:
             return True
         return obj.owner == request.user
 
-def extract_text_from_pdf(file_content):
-    """Extract text from a PDF file using PyPDF2"""
-    try:
-        # Create a file-like object from the bytes
-        pdf_file = io.BytesIO(file_content)
-        
-        # Create a PDF reader
-        pdf_reader = PyPDF2.PdfReader(pdf_file)
-        
-        # Extract text from each page
-        text_content = ""
-        page_texts = []
-        
-        for page_num, page in enumerate(pdf_reader.pages):
-            page_text = page.extract_text()
-            if page_text:
-                text_content += f"\n\n--- PAGE {page_num + 1} ---\n\n"
-                text_content += page_text
-                page_texts.append({"page": page_num + 1, "text": page_text})
-        
-        return text_content, page_texts
-    except Exception as e:
-        print(f"Error extracting text from PDF: {e}")
-        return "", []
-
 @api_view(['POST'])
 @permission_classes([AllowAny])
 def register_user(request):
@@ -89,70 +132,159 @@ def login_user(request):
                 'username': user.username,
                 'email': user.email
             }
-            print(f"User {username} logged in successfully")
+            logger.info("User %s logged in successfully", username)
             return Response(response_data, status=status.HTTP_200_OK)
         else:
-            print(f"Failed login attempt for user {username}")
+            logger.warning("Failed login attempt for user %s", username)
             return Response(
                 {'error': 'Invalid credentials - username or password incorrect'},
                 status=status.HTTP_401_UNAUTHORIZED
             )
     except Exception as e:
-        print(f"Login error: {str(e)}")
+        logger.exception("Login error: %s", e)
         return Response(
             {'error': 'An error occurred during login'},
             status=status.HTTP_500_INTERNAL_SERVER_ERROR
         )
 
+@api_view(['POST'])
+def logout_user(request):
+    """Delete the user's API token, signing out every client that uses it"""
+    Token.objects.filter(user=request.user).delete()
+    return Response(status=status.HTTP_204_NO_CONTENT)
+
+@api_view(['POST'])
+def rotate_token(request):
+    """Replace the user's API token; the old one stops working"""
+    with transaction.atomic():
+        Token.objects.filter(user=request.user).delete()
+        token = Token.objects.create(user=request.user)
+    return Response({'token': token.key})
+
 class DocumentViewSet(viewsets.ModelViewSet):
     queryset = Document.objects.all()
     serializer_class = DocumentSerializer
     permission_classes = [permissions.IsAuthenticated, IsOwnerOrReadOnly]
-    filter_backends = [filters.SearchFilter]
-    search_fields = ['name', 'text_content']
+    pagination_class = CreatedAtCursorPagination
+    filter_backends = [FullTextSearchFilter]
     
     def get_queryset(self):
         user = self.request.user
         # Show documents owned by the user
-        return Document.objects.filter(owner=user)
+        queryset = Document.objects.filter(owner=user).select_related('owner', 'current_version')
+        
+        if self.action == 'list':
+            # Counts come from correlated subqueries so a page costs the same
+            # number of queries however many versions and annotations it has
+            queryset = queryset.annotate(
+                version_count=count_related(DocumentVersion),
+                annotation_count=count_related(Annotation),
+            )
+            expand = get_expand(self.request)
+            if 'versions' in expand:
+                queryset = queryset.prefetch_related(VERSIONS_PREFETCH)
+            if 'annotations' in expand:
+                queryset = queryset.prefetch_related(ANNOTATIONS_PREFETCH)
+        elif self.action == 'retrieve':
+            queryset = queryset.prefetch_related(VERSIONS_PREFETCH, ANNOTATIONS_PREFETCH)
+        return queryset
+    
+    def get_serializer_class(self):
+        if self.action == 'list':
+            return DocumentListSerializer
+        return DocumentSerializer
+    
+    @cache_response(caching.library)
+    def list(self, request, *args, **kwargs):
+        return super().list(request, *args, **kwargs)
+    
+    @cache_response(caching.document)
+    def retrieve(self, request, *args, **kwargs):
+        return super().retrieve(request, *args, **kwargs)
     
     def perform_create(self, serializer):
-        document = serializer.save(owner=self.request.user)
+        upload = serializer.validated_data.get('file')
+        if upload is None:
+            serializer.save(owner=self.request.user)
+            return
+        
+        with transaction.atomic():
+            # Identical bytes are stored only once; the document and its first
+            # version each hold a reference on the same blob
+            blob = store(upload)
+            document = serializer.save(owner=self.request.user, file=blob.file.name)
+            start_document(document, blob, self.request.user, upload.name)
+    
+    def perform_update(self, serializer):
+        upload = serializer.validated_data.get('file')
+        if upload is None:
+            serializer.save()
+            return
+        
+        with transaction.atomic():
+            old_name = serializer.instance.file.name
+            blob = store(upload)
+            serializer.save(file=blob.file.name)
+            release(old_name)
+    
+    @action(detail=False, methods=['post'], url_path='import')
+    def bulk_import(self, request):
+        """Import every file in an uploaded ZIP archive as a document"""
+        archive = request.FILES.get('archive')
+        if archive is None:
+            return Response({"error": "No archive provided"}, status=status.HTTP_400_BAD_REQUEST)
+        if not zipfile.is_zipfile(archive):
+            return Response({"error": "Archive must be a ZIP file"}, status=status.HTTP_400_BAD_REQUEST)
+        
+        skip_duplicates = str(request.data.get('allow_duplicates', 'false')).lower() != 'true'
+        with zipfile.ZipFile(archive) as zf:
+            summary = import_entries(request.user, iter_zip(zf), skip_duplicates=skip_duplicates)
+        return Response(summary, status=status.HTTP_201_CREATED)
+    
+    @action(detail=False, methods=['get'], url_path='export',
+            content_negotiation_class=IgnoreClientContentNegotiation)
+    def export(self, request):
+        """Stream a ZIP of the user's documents (current versions) with a manifest"""
+        response = StreamingHttpResponse(iter_library_zip(request.user), content_type='application/zip')
+        response['Content-Disposition'] = content_disposition_header(True, 'documents.zip')
+        return response
+    
+    @action(detail=False, methods=['get'], url_path='search')
+    @cache_response(caching.library)
+    def search_library(self, request):
+        """Ranked full-text search over all of the user's documents"""
+        query = request.query_params.get('q', '').strip()
+        if not query:
+            return Response({"results": []})
+        
+        try:
+            limit = min(int(request.query_params.get('limit', 20)), 100)
+        except ValueError:
+            return Response({"error": "limit must be a number"}, status=status.HTTP_400_BAD_REQUEST)
+        
+        ranked = search_library(query, request.user.id, limit=limit)
+        documents = Document.objects.in_bulk([document_id for document_id, _, _ in ranked])
+        
+        results = []
+        for document_id, score, hits in ranked:
+            document = documents.get(document_id)
+            if document is None:
+                continue
+            results.append({
+                "id": document.id,
+                "name": document.name,
+                "file_type": document.file_type,
+                "score": score,
+                "hits": hits
+            })
         
-        # If this is a new document, create the first version
-        if 'file' in serializer.validated_data:
-            version = DocumentVersion.objects.create(
-                document=document,
-                version_number=1,
-                file=document.file,
-                created_by=self.request.user
-            )
-            # Set this as the current version
-            document.current_version = version
-            document.save()
-            
-            # Process PDF extraction if it's a PDF
-            if document.file_type.lower() == 'pdf':
-                try:
-                    # Read the file content
-                    document.file.seek(0)
-                    file_content = document.file.read()
-                    
-                    # Extract text from PDF
-                    text_content, _ = extract_text_from_pdf(file_content)
-                    
-                    # Update document with extracted text
-                    document.text_content = text_content
-                    document.is_ocr_processed = True
-                    document.save()
-                    
-                except Exception as e:
-                    print(f"Error processing PDF document: {e}")
+        return Response({"results": results})
     
     @action(detail=True, methods=['get'], url_path='version-list')
+    @cache_response(caching.document)
     def list_versions(self, request, pk=None):
         document = self.get_object()
-        versions = document.versions.all()
+        versions = document.versions.select_related('created_by')
         serializer = DocumentVersionSerializer(versions, many=True)
         return Response(serializer.data)
     
@@ -165,29 +297,20 @@ class DocumentViewSet(viewsets.ModelViewSet):
             return Response({"error": "No file provided"}, status=status.HTTP_400_BAD_REQUEST)
         
         # Create a new version
-        version_number = 1
-        latest_version = document.versions.order_by('-version_number').first()
-        if latest_version:
-            version_number = latest_version.version_number + 1
-        
-        version = DocumentVersion.objects.create(
-            document=document,
-            version_number=version_number,
-            file=request.FILES['file'],
-            created_by=request.user
-        )
-        
-        # Set this as the current version
-        document.current_version = version
-        document.save()
+        with transaction.atomic():
+            blob = store(request.FILES['file'])
+            version = add_version(document, blob, request.user, request.FILES['file'].name)
         
         serializer = DocumentVersionSerializer(version)
         return Response(serializer.data, status=status.HTTP_201_CREATED)
     
     @action(detail=True, methods=['get'], url_path='annotations')
+    @cache_response(caching.document)
     def get_annotations(self, request, pk=None):
         document = self.get_object()
-        annotations = document.annotations.all()
+        annotations = AnnotationViewportFilter().filter_queryset(
+            request, document.annotations.select_related('user'), self
+        )
         serializer = AnnotationSerializer(annotations, many=True)
         return Response(serializer.data)
     
@@ -207,20 +330,153 @@ class DocumentViewSet(viewsets.ModelViewSet):
             return Response({"error": "Content is required"}, status=status.HTTP_400_BAD_REQUEST)
         
         # Create annotation
-        annotation = Annotation.objects.create(
-            document=document,
-            user=request.user,
-            type=annotation_type,
-            content=content,
-            page=page,
-            position_x=position_x,
-            position_y=position_y
-        )
+        with transaction.atomic():
+            annotation = Annotation.objects.create(
+                document=document,
+                user=request.user,
+                type=annotation_type,
+                content=content,
+                page=page,
+                position_x=position_x,
+                position_y=position_y
+            )
+            record_annotation_change('create', annotation)
         
         serializer = AnnotationSerializer(annotation)
         return Response(serializer.data, status=status.HTTP_201_CREATED)
     
+    @action(detail=True, methods=['post'], url_path='annotations/batch')
+    def annotations_batch(self, request, pk=None):
+        """Apply a list of annotation creates, updates and deletes in one transaction.
+
+        Every operation is validated first; if any is invalid nothing is
+        applied and the errors come back in request order.
+        """
+        document = self.get_object()
+        operations = request.data.get('operations') if isinstance(request.data, dict) else request.data
+        if not isinstance(operations, list) or not operations:
+            return Response({"error": "Expected a non-empty list of operations"}, status=status.HTTP_400_BAD_REQUEST)
+        max_operations = getattr(settings, 'DOCUMENT_ANNOTATION_BATCH_MAX', 1000)
+        if len(operations) > max_operations:
+            return Response({"error": f"At most {max_operations} operations per batch"},
+                            status=status.HTTP_400_BAD_REQUEST)
+        
+        # One query for every annotation the batch refers to
+        ids = [op.get('id') for op in operations if isinstance(op, dict) and op.get('op') in ('update', 'delete')]
+        existing = Annotation.objects.select_related('user').filter(
+            document=document, pk__in=[i for i in ids if isinstance(i, int)]
+        ).in_bulk()
+        
+        planned = []
+        errors = []
+        seen = set()
+        for op in operations:
+            kind = op.get('op') if isinstance(op, dict) else None
+            if kind not in ('create', 'update', 'delete'):
+                planned.append(None)
+                errors.append({"op": ["Must be one of create, update, delete"]})
+                continue
+            if kind == 'create':
+                serializer = AnnotationSerializer(data=op)
+            else:
+                annotation = existing.get(op.get('id'))
+                if annotation is None or annotation.pk in seen:
+                    planned.append(None)
+                    errors.append({"id": ["Not found" if annotation is None else "Appears more than once"]})
+                    continue
+                seen.add(annotation.pk)
+                if kind == 'delete':
+                    planned.append((kind, annotation))
+                    errors.append(None)
+                    continue
+                serializer = AnnotationSerializer(annotation, data=op, partial=True)
+            
+            if serializer.is_valid():
+                planned.append((kind, serializer))
+                errors.append(None)
+            else:
+                planned.append(None)
+                errors.append(serializer.errors)
+        
+        if any(errors):
+            return Response({"errors": errors}, status=status.HTTP_400_BAD_REQUEST)
+        
+        created = []
+        updated = []
+        update_fields = set()
+        deleted = []
+        for kind, item in planned:
+            if kind == 'create':
+                created.append(Annotation(document=document, user=request.user, **item.validated_data))
+            elif kind == 'update':
+                for field, value in item.validated_data.items():
+                    setattr(item.instance, field, value)
+                update_fields.update(item.validated_data)
+                updated.append(item.instance)
+            else:
+                deleted.append(item.pk)
+        
+        with transaction.atomic():
+            Annotation.objects.bulk_create(created)
+            if updated and update_fields:
+                Annotation.objects.bulk_update(updated, sorted(update_fields))
+            if deleted:
+                Annotation.objects.filter(pk__in=deleted).delete()
+            # Bulk writes leave invalidating cached responses to us: once per batch
+            bump_generation(document.pk)
+            
+            # bulk_create fills in ids and created_at in place, so results map back in order
+            created = iter(created)
+            results = []
+            changes = []
+            for kind, item in planned:
+                if kind == 'create':
+                    annotation = next(created)
+                    data = AnnotationSerializer(annotation).data
+                    results.append({"op": kind, "annotation": data})
+                    changes.append((kind, annotation.pk, data))
+                elif kind == 'update':
+                    data = AnnotationSerializer(item.instance).data
+                    results.append({"op": kind, "annotation": data})
+                    changes.append((kind, item.instance.pk, data))
+                else:
+                    results.append({"op": kind, "id": item.pk})
+                    changes.append((kind, item.pk, None))
+            # Subscribers see the batch as one message, in request order
+            record_events(document.pk, changes)
+        return Response({"results": results})
+    
+    @action(detail=True, methods=['get'], url_path='pages')
+    @cache_response(caching.document)
+    def get_pages(self, request, pk=None):
+        """Return extracted page text of the current (or ?version=) version, optionally limited to ?start=&end= (inclusive)"""
+        document = self.get_object()
+        
+        try:
+            start = int(request.query_params.get('start', 1))
+            end = request.query_params.get('end')
+            end = int(end) if end is not None else None
+            number = request.query_params.get('version')
+            number = int(number) if number is not None else None
+        except ValueError:
+            return Response({"error": "start, end and version must be numbers"}, status=status.HTTP_400_BAD_REQUEST)
+        
+        if number is None:
+            version = document.current_version
+        else:
+            version = get_object_or_404(document.versions, version_number=number)
+        pages = DocumentPage.objects.filter(document=document, version=version, page_number__gte=start)
+        if end is not None:
+            pages = pages.filter(page_number__lte=end)
+        
+        serializer = DocumentPageSerializer(pages, many=True)
+        return Response({
+            "extraction_status": version.extraction_status if version else document.extraction_status,
+            "pages": serializer.data
+        })
+    
     @action(detail=True, methods=['get'])
+    @cache_response(caching.document)
     def search(self, request, pk=None):
         document = self.get_object()
         query = request.query_params.get('query', '')
@@ -230,97 +486,112 @@ class DocumentViewSet(viewsets.ModelViewSet):
                 "matches": []
             })
         
-        # Check if text content is available
-        if not document.text_content:
-            # If no text content and it's a PDF, try to extract it now
-            if document.file_type.lower() == 'pdf':
-                try:
-                    # Read the file content
-                    file_content = document.file.read()
-                    
-                    # Extract text from PDF
-                    text_content, _ = extract_text_from_pdf(file_content)
-                    
-                    # Update document with extracted text
-                    document.text_content = text_content
-                    document.is_ocr_processed = True
-                    document.save()
-                except Exception as e:
-                    print(f"Error processing PDF document during search: {e}")
-                    return Response({
-                        "matches": [],
-                        "error": "Could not extract text from document"
-                    })
-            else:
-                return Response({
-                    "matches": [],
-                    "error": "Document doesn't have searchable text content"
-                })
-        
-        # Improved search implementation
-        matches = []
-        query_lower = query.lower()
-        
-        # Split text content by page markers
-        page_pattern = r"--- PAGE (\d+) ---\n\n"
-        page_splits = re.split(page_pattern, document.text_content)
-        
-        # The split results in [text_before_first_marker, page1, text1, page2, text2, ...]
-        # So we need to process it accordingly
-        for i in range(1, len(page_splits), 2):
-            if i + 1 < len(page_splits):
-                page_num = int(page_splits[i])
-                page_text = page_splits[i + 1]
-                
-                # Check if the query exists in this page
-                if query_lower in page_text.lower():
-                    # Find all occurrences
-                    text_lower = page_text.lower()
-                    start_idx = 0
-                    while start_idx < len(text_lower):
-                        match_idx = text_lower.find(query_lower, start_idx)
-                        if match_idx == -1:
-                            break
-                        
-                        # Extract context around the match (100 chars)
-                        context_start = max(0, match_idx - 50)
-                        context_end = min(len(page_text), match_idx + len(query) + 50)
-                        preview = page_text[context_start:context_end]
-                        
-                        # Add ellipsis if needed
-                        if context_start > 0:
-                            preview = "..." + preview
-                        if context_end < len(page_text):
-                            preview = preview + "..."
-                        
-                        # Add match information
-                        matches.append({
-                            "page": page_num,
-                            "text": query,
-                            "preview": preview
-                        })
-                        
-                        # Move to next potential match
-                        start_idx = match_idx + len(query)
+        try:
+            flags, offset, limit = search_options(request.query_params)
+        except ValueError:
+            return Response({"error": "limit, offset and version must be numbers"}, status=status.HTTP_400_BAD_REQUEST)
+        
+        extraction_status = document.extraction_status
+        if flags['version'] == ALL_VERSIONS:
+            # Whatever has been extracted so far is searchable
+            if document.versions.filter(extraction_status='completed').exists():
+                extraction_status = 'completed'
+        elif flags['version'] is not None:
+            extraction_status = get_object_or_404(
+                document.versions.values_list('extraction_status', flat=True), version_number=flags['version']
+            )
+        unavailable = search_unavailable(document, extraction_status)
+        if unavailable:
+            return Response(unavailable)
         
-        return Response({
-            "matches": matches
-        })
+        matches = search_document(document, query, **flags)
+        return Response(search_page(matches, offset, limit))
+
+def search_unavailable(document, extraction_status=None):
+    """Explain why the searched version of ``document`` has no text yet, or return None.
+
+    ``extraction_status`` is that version's status; it defaults to the
+    current version's, which the document mirrors.
+    """
+    extraction_status = extraction_status or document.extraction_status
+    if extraction_status == 'completed':
+        return None
+    if not can_extract(document.file_type, document.file.name):
+        return {
+            "matches": [],
+            "error": "Document doesn't have searchable text content"
+        }
+    if extraction_status == 'failed':
+        return {
+            "matches": [],
+            "error": "Could not extract text from document"
+        }
+    return {
+        "matches": [],
+        "status": extraction_status,
+        "error": "Text extraction is still in progress"
+    }
+
+def search_options(params):
+    """Return ``(flags, offset, limit)`` for in-document search; raises ValueError on bad numbers.
+
+    ``?version=`` searches one version by number, or every version with
+    ``all``, instead of the current one. Without ``?limit=`` every match is
+    returned (``limit`` is None), as the viewer highlights them all.
+    """
+    version = params.get('version')
+    flags = {
+        'case_sensitive': params.get('case_sensitive', '').lower() in ('1', 'true'),
+        'whole_word': params.get('whole_word', '').lower() in ('1', 'true'),
+        'version': version if version in (None, ALL_VERSIONS) else int(version),
+    }
+    limit = params.get('limit')
+    if limit is not None:
+        limit = max(min(int(limit), 1000), 1)
+    offset = max(int(params.get('offset', 0)), 0)
+    return flags, offset, limit
+
+def search_page(matches, offset, limit):
+    return {
+        "matches": matches[offset:] if limit is None else matches[offset:offset + limit],
+        "total": len(matches),
+        "offset": offset,
+        "limit": limit
+    }
 
 class DocumentVersionViewSet(viewsets.ModelViewSet):
     serializer_class = DocumentVersionSerializer
     permission_classes = [permissions.IsAuthenticated]
+    pagination_class = CreatedAtCursorPagination
     
     def get_queryset(self):
         document_id = self.kwargs.get('document_id')
+        versions = DocumentVersion.objects.select_related('created_by')
         if document_id:
             # Handle nested route
-            return DocumentVersion.objects.filter(
+            return versions.filter(
                 document_id=document_id,
                 document__owner=self.request.user
             )
         # Handle standard route
-        return DocumentVersion.objects.filter(document__owner=self.request.user)
+        return versions.filter(document__owner=self.request.user)
+    
+    def list(self, request, *args, **kwargs):
+        if self.kwargs.get('document_id'):
+            return self.list_for_document(request, *args, **kwargs)
+        return self.list_all(request, *args, **kwargs)
+    
+    @cache_response(caching.document)
+    def list_for_document(self, request, *args, **kwargs):
+        return super().list(request, *args, **kwargs)
+    
+    @cache_response(caching.library)
+    def list_all(self, request, *args, **kwargs):
+        return super().list(request, *args, **kwargs)
+    
+    @cache_response(caching.version)
+    def retrieve(self, request, *args, **kwargs):
+        return super().retrieve(request, *args, **kwargs)
     
     def create(self, request, *args, **kwargs):
         document_id = self.kwargs.get('document_id')
@@ -334,25 +605,46 @@ class DocumentVersionViewSet(viewsets.ModelViewSet):
             return Response({"error": "No file provided"}, status=status.HTTP_400_BAD_REQUEST)
         
         # Create a new version
-        version_number = 1
-        latest_version = document.versions.order_by('-version_number').first()
-        if latest_version:
-            version_number = latest_version.version_number + 1
-        
-        version = DocumentVersion.objects.create(
-            document=document,
-            version_number=version_number,
-            file=request.FILES['file'],
-            created_by=request.user
-        )
-        
-        # Set this as the current version
-        document.current_version = version
-        document.save()
+        with transaction.atomic():
+            blob = store(request.FILES['file'])
+            version = add_version(document, blob, request.user, request.FILES['file'].name)
         
         serializer = self.get_serializer(version)
         return Response(serializer.data, status=status.HTTP_201_CREATED)
     
+    @action(detail=True, methods=['get'], url_path='content',
+            content_negotiation_class=IgnoreClientContentNegotiation)
+    def content(self, request, *args, **kwargs):
+        """Stream the version's file, with Range, ETag and Last-Modified support"""
+        version = self.get_object()
+        return serve_file(request, materialize(version.file), fallback_modified=version.created_at,
+                          filename=version.original_name or None)
+    
+    @action(detail=True, methods=['get'], url_path=r'pages/(?P<page_number>\d+)/thumb',
+            content_negotiation_class=IgnoreClientContentNegotiation)
+    def thumbnail(self, request, page_number=None, *args, **kwargs):
+        """Serve a rendered page image; ``?size=preview`` for the large one"""
+        version = self.get_object()
+        kind = request.query_params.get('size', 'thumb')
+        if kind not in image_widths():
+            return Response({"error": f"Unknown size: {kind}"}, status=status.HTTP_400_BAD_REQUEST)
+        
+        # Images are keyed by content, so the ETag can be checked before rendering
+        etag = quote_etag(f'{cache_key(version)}-{page_number}-{kind}-{image_widths()[kind]}')
+        response = get_conditional_response(request, etag=etag)
+        if response is not None:
+            return response
+        
+        try:
+            data = page_image(version, int(page_number), kind)
+        except (IndexError, UnsupportedFile):
+            return Response({"error": "No such page image"}, status=status.HTTP_404_NOT_FOUND)
+        
+        response = HttpResponse(data, content_type='image/jpeg')
+        response['ETag'] = etag
+        response['Cache-Control'] = 'private, max-age=86400'
+        return response
+    
     def destroy(self, request, *args, **kwargs):
         version = self.get_object()
         document = version.document
@@ -369,6 +661,8 @@ class DocumentVersionViewSet(viewsets.ModelViewSet):
             latest_version = document.versions.exclude(id=version.id).order_by('-version_number').first()
             if latest_version:
                 document.current_version = latest_version
+                # Search follows the current version's extracted text
+                document.extraction_status = latest_version.extraction_status
                 document.save()
         
         return super().destroy(request, *args, **kwargs)
@@ -376,20 +670,36 @@ class DocumentVersionViewSet(viewsets.ModelViewSet):
 class AnnotationViewSet(viewsets.ModelViewSet):
     serializer_class = AnnotationSerializer
     permission_classes = [permissions.IsAuthenticated]
+    pagination_class = CreatedAtCursorPagination
+    filter_backends = [AnnotationViewportFilter]
     
     def get_queryset(self):
+        user = self.request.user
+        annotations = Annotation.objects.select_related('user')
+        # Own annotations, plus everyone's on documents the user owns. The
+        # subquery (rather than a join) lets each side of the OR use an index.
+        visible = Q(user=user) | Q(document__in=Document.objects.filter(owner=user).values('pk'))
         document_id = self.kwargs.get('document_id')
         if document_id:
             # Handle nested route - get annotations for specific document
-            return Annotation.objects.filter(
-                document_id=document_id
-            ).filter(
-                Q(user=self.request.user) | Q(document__owner=self.request.user)
-            )
+            return annotations.filter(document_id=document_id).filter(visible)
         # Handle standard route - get all annotations
-        return Annotation.objects.filter(
-            Q(user=self.request.user) | Q(document__owner=self.request.user)
-        )
+        return annotations.filter(visible)
+    
+    def list(self, request, *args, **kwargs):
+        # The standard route also lists the user's annotations on other
+        # people's documents, which no generation of the user's own covers
+        if self.kwargs.get('document_id'):
+            return self.list_for_document(request, *args, **kwargs)
+        return super().list(request, *args, **kwargs)
+    
+    @cache_response(caching.document)
+    def list_for_document(self, request, *args, **kwargs):
+        return super().list(request, *args, **kwargs)
+    
+    @cache_response(caching.annotation)
+    def retrieve(self, request, *args, **kwargs):
+        return super().retrieve(request, *args, **kwargs)
     
     def create(self, request, *args, **kwargs):
         document_id = self.kwargs.get('document_id')
@@ -410,15 +720,89 @@ class AnnotationViewSet(viewsets.ModelViewSet):
             return Response({"error": "Content is required"}, status=status.HTTP_400_BAD_REQUEST)
         
         # Create annotation
-        annotation = Annotation.objects.create(
-            document=document,
-            user=request.user,
-            type=annotation_type,
-            content=content,
-            page=page,
-            position_x=position_x,
-            position_y=position_y
-        )
+        with transaction.atomic():
+            annotation = Annotation.objects.create(
+                document=document,
+                user=request.user,
+                type=annotation_type,
+                content=content,
+                page=page,
+                position_x=position_x,
+                position_y=position_y
+            )
+            record_annotation_change('create', annotation)
         
         serializer = self.get_serializer(annotation)
         return Response(serializer.data, status=status.HTTP_201_CREATED)
+    
+    def perform_update(self, serializer):
+        with transaction.atomic():
+            annotation = serializer.save()
+            record_annotation_change('update', annotation)
+    
+    def perform_destroy(self, instance):
+        with transaction.atomic():
+            record_annotation_change('delete', instance)
+            instance.delete()
+
+
+class UploadSessionViewSet(mixins.CreateModelMixin, mixins.RetrieveModelMixin,
+                           mixins.DestroyModelMixin, viewsets.GenericViewSet):
+    """Resumable chunked uploads.
+
+    POST /uploads/ opens a session, PUT /uploads/<id>/chunk/?offset=N appends
+    the raw request body (optionally checked against ``X-Chunk-SHA256``), GET
+    /uploads/<id>/ reports the offset to resume from, and POST
+    /uploads/<id>/complete/ creates the document or version.
+    """
+    serializer_class = UploadSessionSerializer
+    permission_classes = [permissions.IsAuthenticated]
+    
+    def get_queryset(self):
+        return UploadSession.objects.filter(owner=self.request.user)
+    
+    def perform_create(self, serializer):
+        session = serializer.save(owner=self.request.user)
+        uploads.open_session(session)
+    
+    def perform_destroy(self, instance):
+        uploads.discard(instance)
+        instance.delete()
+    
+    @action(detail=True, methods=['put'], url_path='chunk')
+    def chunk(self, request, pk=None):
+        session = self.get_object()
+        if session.status != 'active':
+            return Response({"error": f"Upload is {session.status}"}, status=status.HTTP_409_CONFLICT)
+        
+        try:
+            offset = int(request.query_params.get('offset', ''))
+        except ValueError:
+            return Response({"error": "offset must be a number"}, status=status.HTTP_400_BAD_REQUEST)
+        
+        # Read the raw body from the request stream; touching request.data would buffer it
+        try:
+            uploads.write_chunk(session, offset, request.stream, sha256=request.headers.get('X-Chunk-SHA256'))
+        except uploads.OffsetConflict as e:
+            session.refresh_from_db(fields=['received'])
+            return Response({"error": str(e), "offset": session.received}, status=status.HTTP_409_CONFLICT)
+        except uploads.UploadError as e:
+            return Response({"error": str(e), "offset": session.received}, status=status.HTTP_400_BAD_REQUEST)
+        
+        return Response({"offset": session.received, "size": session.size})
+    
+    @action(detail=True, methods=['post'], url_path='complete')
+    def complete(self, request, pk=None):
+        session = self.get_object()
+        if session.status != 'active':
+            return Response({"error": f"Upload is {session.status}"}, status=status.HTTP_409_CONFLICT)
+        
+        try:
+            uploads.complete(session)
+        except uploads.OffsetConflict as e:
+            return Response({"error": str(e)}, status=status.HTTP_409_CONFLICT)
+        except uploads.UploadError as e:
+            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        
+        serializer = self.get_serializer(session)
+        return Response(serializer.data, status=status.HTTP_201_CREATED)
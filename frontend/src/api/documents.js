@@ -113,14 +113,14 @@ export const createDocumentVersion = async (documentId, formData, token) => {
   }
 };
 
-export const deleteDocumentVersion = async (documentId, versionId, token) => {
+export const deleteDocumentVersion = async (documentId, versionNumber, token) => {
   try {
     const authAxios = createAuthenticatedAxios(token);
-    await authAxios.delete(`/documents/${documentId}/versions/${versionId}/`);
+    await authAxios.delete(`/documents/${documentId}/versions/${versionNumber}/`);
     return true;
   } catch (error) {
     console.error(
-      `Error deleting version ${versionId} for document ${documentId}:`,
+      `Error deleting version ${versionNumber} for document ${documentId}:`,
       error
     );
     throw error;
@@ -200,6 +200,64 @@ export const deleteAnnotation = async (documentId, annotationId, token) => {
   }
 };
 
+// Live annotation updates over a WebSocket. onEvents receives each batch of
+// create/update/delete events in order; onReset is called when the client
+// has to reload the annotations (on first connect, or when missed events
+// are no longer available). Reconnects resume from the last event seen.
+export const subscribeToAnnotations = (documentId, token, onEvents, onReset) => {
+  const wsUrl = API_URL.replace(/^http/, "ws").replace(/\/api$/, "");
+  let socket = null;
+  let lastSeq = null;
+  let retryDelay = 1000;
+  let closed = false;
+
+  const connect = () => {
+    const params = new URLSearchParams({ token });
+    if (lastSeq !== null) {
+      params.set("since", lastSeq);
+    }
+    socket = new WebSocket(
+      `${wsUrl}/ws/documents/${documentId}/annotations/?${params}`
+    );
+
+    socket.onmessage = (message) => {
+      const data = JSON.parse(message.data);
+      if (data.type === "events") {
+        lastSeq = data.events[data.events.length - 1].seq;
+        onEvents(data.events);
+      } else if (data.type === "reset") {
+        lastSeq = data.seq;
+        onReset();
+      } else if (data.type === "subscribed") {
+        if (lastSeq === null) {
+          // Anything changed between the initial load and subscribing
+          onReset();
+        }
+        lastSeq = data.seq;
+        retryDelay = 1000;
+      }
+    };
+
+    socket.onclose = (event) => {
+      // 4401/4403: not allowed to subscribe, don't retry
+      if (closed || event.code === 4401 || event.code === 4403) {
+        return;
+      }
+      setTimeout(connect, retryDelay);
+      retryDelay = Math.min(retryDelay * 2, 30000);
+    };
+  };
+
+  connect();
+
+  return () => {
+    closed = true;
+    if (socket) {
+      socket.close();
+    }
+  };
+};
+
 // Document search functionality
 export const searchDocument = async (documentId, query, token) => {
   try {
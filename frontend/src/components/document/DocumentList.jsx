@@ -153,15 +153,15 @@ export default function DocumentList({ searchQuery }) {
                                             {document.file_type.toUpperCase()}
                                         </span>
 
-                                        {document.versions && document.versions.length > 0 && (
+                                        {document.version_count > 0 && (
                                             <span className="ml-2 inline-flex items-center px-2.5 py-0.5 rounded-full text-xs font-medium bg-slate-700 text-slate-300">
-                                                v{document.versions.length}
+                                                v{document.version_count}
                                             </span>
                                         )}
 
-                                        {document.annotations && document.annotations.length > 0 && (
+                                        {document.annotation_count > 0 && (
                                             <span className="ml-2 inline-flex items-center px-2.5 py-0.5 rounded-full text-xs font-medium bg-indigo-900/60 text-indigo-300">
-                                                {document.annotations.length} {document.annotations.length === 1 ? 'note' : 'notes'}
+                                                {document.annotation_count} {document.annotation_count === 1 ? 'note' : 'notes'}
                                             </span>
                                         )}
                                     </div>
@@ -173,8 +173,8 @@ export default function DocumentList({ searchQuery }) {
                             <div className="text-xs text-slate-400 flex items-center">
                                 <TagIcon className="h-4 w-4 mr-1" />
                                 <span>
-                                    {document.versions?.length
-                                        ? `${document.versions.length} versions`
+                                    {document.version_count
+                                        ? `${document.version_count} versions`
                                         : 'No versions'
                                     }
                                 </span>
@@ -95,7 +95,7 @@ export default function DocumentSearch({ documentId, onSearch, onNavigateToMatch
                     <h3 className="font-medium text-slate-200">Search Document</h3>
                     {searchResults?.matches?.length > 0 && (
                         <span className="bg-slate-700 text-xs px-2 py-1 rounded-full text-slate-300">
-                            {searchResults.matches.length} matches
+                            {searchResults.total ?? searchResults.matches.length} matches
                         </span>
                     )}
                 </div>
@@ -149,7 +149,7 @@ export default function DocumentSearch({ documentId, onSearch, onNavigateToMatch
                             <div className="flex items-center justify-between mb-3">
                                 <p className="text-sm text-slate-400">
                                     {searchResults.matches?.length > 0
-                                        ? `Found ${searchResults.matches.length} matches for "${searchQuery}"`
+                                        ? `Found ${searchResults.total ?? searchResults.matches.length} matches for "${searchQuery}"`
                                         : `No matches found for "${searchQuery}"`}
                                 </p>
 
@@ -85,6 +85,12 @@ export const AuthProvider = ({ children }) => {
     };
 
     const logout = () => {
+        // Revoke the token on the server; the local session ends either way
+        const authorization = axios.defaults.headers.common['Authorization'];
+        if (authorization) {
+            axios.post('/api/auth/logout/', null, { headers: { Authorization: authorization } }).catch(() => {});
+        }
+
         // Remove from localStorage
         localStorage.removeItem('token');
         localStorage.removeItem('user');
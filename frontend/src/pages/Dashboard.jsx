@@ -61,8 +61,8 @@ export default function Dashboard() {
                 let versions = 0;
 
                 documents.forEach(doc => {
-                    annotations += doc.annotations?.length || 0;
-                    versions += doc.versions?.length || 0;
+                    annotations += doc.annotation_count || 0;
+                    versions += doc.version_count || 0;
                 });
 
                 setStats({
@@ -367,10 +367,10 @@ export default function Dashboard() {
                                                                 </div>
                                                                 <div className="mt-2 flex items-center text-sm text-slate-400 sm:mt-0">
                                                                     <span className="flex items-center">
-                                                                        {doc.annotations?.length ? (
+                                                                        {doc.annotation_count ? (
                                                                             <>
                                                                                 <TagIcon className="mr-1.5 h-4 w-4 flex-shrink-0 text-slate-500" aria-hidden="true" />
-                                                                                <p>{doc.annotations.length} annotations</p>
+                                                                                <p>{doc.annotation_count} annotations</p>
                                                                             </>
                                                                         ) : null}
                                                                     </span>
@@ -9,7 +9,7 @@ import DocumentAnnotations from '../components/document/DocumentAnnotations';
 import DocumentSearch from '../components/document/DocumentSearch';
 
 // Import API functions
-import { getDocument, searchDocument, addAnnotation, deleteAnnotation, getAnnotations, createDocumentVersion, getDocumentVersions } from '../api/documents';
+import { getDocument, searchDocument, addAnnotation, deleteAnnotation, getAnnotations, subscribeToAnnotations, createDocumentVersion, getDocumentVersions } from '../api/documents';
 import { useAuth } from '../context/AuthContext';
 
 export default function DocumentDetail() {
@@ -56,6 +56,31 @@ export default function DocumentDetail() {
         fetchData();
     }, [id, token]);
 
+    // Apply collaborators' annotation changes as they happen
+    useEffect(() => {
+        const applyEvents = (events) => {
+            setAnnotations(prev => {
+                let next = prev;
+                for (const event of events) {
+                    next = next.filter(a => a.id !== event.id);
+                    if (event.op !== 'delete') {
+                        next = [...next, event.annotation];
+                    }
+                }
+                return next;
+            });
+        };
+        const reload = async () => {
+            try {
+                setAnnotations(await getAnnotations(id, token));
+            } catch (err) {
+                console.error('Error reloading annotations:', err);
+            }
+        };
+
+        return subscribeToAnnotations(id, token, applyEvents, reload);
+    }, [id, token]);
+
     // Handle page change
     const handlePageChange = (newPage) => {
         setCurrentPage(newPage);
@@ -257,4 +282,4 @@ export default function DocumentDetail() {
             </div>
         </div>
     );
-} 
\ No newline at end of file
+} 
\ No newline at end of file
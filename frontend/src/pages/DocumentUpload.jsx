@@ -128,6 +128,10 @@ export default function DocumentUpload() {
             fileType = 'excel';
         } else if (['jpg', 'jpeg', 'png', 'gif'].includes(extension)) {
             fileType = 'image';
+        } else if (['txt', 'md', 'csv'].includes(extension)) {
+            fileType = 'text';
+        } else if (['html', 'htm'].includes(extension)) {
+            fileType = 'html';
         } else {
             fileType = 'other';
         }
@@ -350,7 +354,7 @@ export default function DocumentUpload() {
                                             type="file"
                                             className="sr-only"
                                             onChange={handleFileChange}
-                                            accept=".pdf,.doc,.docx,.xls,.xlsx,.jpg,.jpeg,.png"
+                                            accept=".pdf,.doc,.docx,.xls,.xlsx,.jpg,.jpeg,.png,.txt,.md,.csv,.html,.htm"
                                         />
                                     </label>
                                 </div>